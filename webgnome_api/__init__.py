@@ -3,6 +3,7 @@ Main entry point
 """
 
 import os
+import time
 import shutil
 import logging
 from pathlib import Path
@@ -13,6 +14,7 @@ import socketio
 from redis import StrictRedis
 
 from pyramid.config import Configurator
+from pyramid.settings import asbool
 from pyramid.renderers import JSON as JSONRenderer
 from pyramid.threadlocal import get_current_request
 from pyramid_log import Formatter, _WrapDict, _DottedLookup
@@ -20,6 +22,12 @@ from pyramid_log import Formatter, _WrapDict, _DottedLookup
 from pyramid_session_redis import session_factory_from_settings
 
 from webgnome_api.common.views import cors_policy
+from webgnome_api.common.disk_cache import DiskCache
+from webgnome_api.common.blob_cache import BlobCache
+from webgnome_api.common.upload_store import UploadStore
+from webgnome_api.common.chunked_upload import (get_max_upload_age,
+                                                remove_stale_session_uploads)
+from webgnome_api.common.system_resources import TransferStats
 from webgnome_api.socket.sockserv import (WebgnomeSocketioServer,
                                           WebgnomeNamespace,
                                           GoodsFileNamespace)
@@ -142,6 +150,142 @@ def reconcile_directory_settings(settings):
         )
 
 
+def init_file_caches(settings):
+    '''
+        Create the process-wide file caches that are shared by all sessions.
+    '''
+    model_data_dir = settings.get('model_data_dir', './models')
+
+    export_cache_dir = settings.get('export_cache.dir',
+                                    os.path.join(model_data_dir,
+                                                 'export_cache'))
+    export_cache_size = eval(settings.get(
+        'export_cache.max_size',
+        '2 * 1024 * 1024 * 1024',  # default
+    ), {}, {})  # Safety: don't reference any global or local variables.
+
+    settings['export_cache'] = DiskCache(export_cache_dir, export_cache_size)
+
+    goods_cache_dir = settings.get('goods_cache.dir',
+                                   os.path.join(model_data_dir, 'goods_cache'))
+    goods_cache_size = eval(settings.get(
+        'goods_cache.max_size',
+        '10 * 1024 * 1024 * 1024',  # default
+    ), {}, {})  # Safety: don't reference any global or local variables.
+
+    settings['goods_cache'] = DiskCache(goods_cache_dir, goods_cache_size)
+
+    # uploaded files are linked from the session folders, so the store
+    # needs to be on the same file system.
+    upload_store_dir = settings.get('upload_store.dir',
+                                    os.path.join(model_data_dir,
+                                                 'upload_store'))
+    upload_store_size = eval(settings.get(
+        'upload_store.max_size',
+        '10 * 1024 * 1024 * 1024',  # default
+    ), {}, {})  # Safety: don't reference any global or local variables.
+
+    settings['upload_store'] = UploadStore(
+        upload_store_dir, upload_store_size,
+        gc_delay=float(settings.get('upload_store.gc_delay', 60.0))
+    )
+
+    # how our uploaded files got to where they are going, and how many
+    # bytes that took to copy.
+    settings['transfer_stats'] = TransferStats()
+
+
+def init_grid_cache(settings):
+    '''
+        Create the process-wide cache of compressed grid geometry that is
+        shared by all sessions.
+    '''
+    grid_cache_size = eval(settings.get(
+        'grid_cache.max_size',
+        '512 * 1024 * 1024',  # default
+    ), {}, {})  # Safety: don't reference any global or local variables.
+
+    settings['grid_cache'] = BlobCache(grid_cache_size)
+
+
+def init_netcdf_probes(settings):
+    '''
+        Create the process-wide cache of the metadata of our NetCDF files.
+    '''
+    from webgnome_api.common.netcdf_probe import NetCDFProbeCache
+
+    max_entries = int(settings.get('netcdf_probe.max_entries', 1024))
+
+    settings['netcdf_probes'] = NetCDFProbeCache(max_entries)
+
+
+def init_folder_index(settings):
+    '''
+        Create the process-wide index of the listings of our persistent
+        upload folders.
+    '''
+    from webgnome_api.common.folder_index import FolderIndex
+
+    max_folders = int(settings.get('folder_index.max_folders', 256))
+    max_age = float(settings.get('folder_index.max_age', 60))
+
+    settings['folder_index'] = FolderIndex(max_folders, max_age)
+
+
+def init_goods_pool(settings):
+    '''
+        Create the process-wide pool of GOODS subset workers.  The workers
+        are started on the first subset, unless we prefork them here.
+    '''
+    from webgnome_api.common.worker_pool import WorkerPool
+
+    goods_pool = WorkerPool(
+        num_workers=int(settings.get('goods_pool.num_workers', 2)),
+        max_queued=int(settings.get('goods_pool.max_queued', 32)),
+        max_session_queued=int(settings.get('goods_pool.max_session_queued',
+                                             4)),
+    )
+    settings['goods_pool'] = goods_pool
+
+    if asbool(settings.get('goods_pool.prefork', False)):
+        goods_pool.start()
+
+
+def init_location_cache(settings):
+    '''
+        Create the location index and the location model cache, and
+        optionally load all our location models into it in the background.
+    '''
+    from webgnome_api.common.location_cache import (LocationIndex,
+                                                    LocationModelCache)
+
+    settings['location_index'] = LocationIndex(settings['locations_dir'])
+
+    location_models = LocationModelCache()
+    settings['location_models'] = location_models
+
+    if asbool(settings.get('locations.warm_cache', False)):
+        location_models.warm_in_background(settings['locations_dir'])
+
+
+def init_help_corpus(settings):
+    '''
+        Create our help corpus, and compile it in the background.
+    '''
+    from webgnome_api.common.help_corpus import (HelpCorpus,
+                                                 help_dir_from_settings)
+
+    model_data_dir = settings.get('model_data_dir', './models')
+    help_cache_dir = settings.get('help.cache_dir',
+                                  os.path.join(model_data_dir, 'help_cache'))
+
+    help_corpus = HelpCorpus(help_dir_from_settings(settings),
+                             cache_dir=help_cache_dir)
+    settings['help_corpus'] = help_corpus
+
+    help_corpus.compile_in_background()
+
+
 def load_cors_origins(settings, key):
     """
     Overload the cors_policy module with the CORS origins from our settings.
@@ -215,6 +359,9 @@ def start_session_cleaner(settings):
         functionality.  Here we will look for expired key events.
     '''
     session_dir = settings.get('session_dir', './models/session')
+    upload_store = settings.get('upload_store')
+    max_upload_age = get_max_upload_age(settings)
+    last_upload_sweep = [0.0]
 
     cache_uri = os.environ.get('CACHE_URI')
     if cache_uri:
@@ -224,12 +371,27 @@ def start_session_cleaner(settings):
         port = int(settings.get('redis.sessions.port', 6379))
         redis = StrictRedis(host=host, port=port)
 
-    def event_handler(msg, session_dir=session_dir):
+    def event_handler(msg, session_dir=session_dir,
+                      upload_store=upload_store):
         session_id = msg['data']
         if isinstance(session_id, bytes):
             session_id = session_id.decode('utf-8')
 
-        cleanup_dir = (Path(session_dir) / session_id).resolve()
+        session_root = Path(session_dir).resolve()
+        cleanup_dir = (session_root / session_id).resolve()
+
+        if cleanup_dir.parent != session_root:
+            # not a key that could be one of our sessions
+            return
+
+        now = time.time()
+
+        if now - last_upload_sweep[0] > min(max_upload_age, 600.0):
+            # the uploads that the live sessions have abandoned.  These
+            # are only looked for every so often, not for every session.
+            last_upload_sweep[0] = now
+            remove_stale_session_uploads(session_root, max_upload_age)
+
         print(f'Session Cleaner: Cleaning up folder {cleanup_dir}')
 
         try:
@@ -237,9 +399,16 @@ def start_session_cleaner(settings):
         except OSError as err:
             if err.errno == 2:  # not-found error.  Print message & continue.
                 print(f'Session Cleaner: Folder {cleanup_dir} does not exist!')
+                return
             else:
                 raise
 
+        if upload_store is not None:
+            # the session's uploads may have been the last references to
+            # some of our stored files.  Sessions tend to expire in bursts,
+            # so this is batched into one collection a little later.
+            upload_store.collect_garbage_later()
+
     pubsub = redis.pubsub()
     pubsub.psubscribe(**{'__keyevent*__:expired': event_handler})
 
@@ -334,6 +503,13 @@ def main(global_config, **settings):
 
     parse_redis_uri(settings)
     reconcile_directory_settings(settings)
+    init_file_caches(settings)
+    init_grid_cache(settings)
+    init_netcdf_probes(settings)
+    init_folder_index(settings)
+    init_goods_pool(settings)
+    init_location_cache(settings)
+    init_help_corpus(settings)
     load_cors_origins(settings, 'cors_policy.origins')
     configure_redis_keyspace_notifications(settings)
     start_session_cleaner(settings)
@@ -367,6 +543,8 @@ def main(global_config, **settings):
     config.add_route('environment_upload', '/environment/upload')
     config.add_route('environment_activate', '/environment/activate')
 
+    config.add_route('help_search', '/help/search')
+
     config.add_route('socket.io', '/socket.io/*remaining')
     config.add_route('logger', '/logger')
 
@@ -0,0 +1,171 @@
+"""
+    Writing zip archives of the files we generate for the client.
+
+    Members that are already compressed (NetCDF, zip, png, etc.) are simply
+    stored.  The rest are deflated in parallel over a thread pool (zlib
+    releases the GIL while compressing), and then copied into the archive
+    in their original order.
+
+    zipfile has no public API for adding a member that is already deflated,
+    so we do what ZipFile.write() does with its internals.  If a version of
+    zipfile doesn't have them, we fall back to ZipFile.write().
+"""
+import os
+import zlib
+import shutil
+import zipfile
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+stored_extensions = ('.nc', '.nc4', '.zip', '.kmz', '.gnome',
+                     '.png', '.jpg', '.jpeg', '.gif',
+                     '.gz', '.bz2', '.xz', '.zst')
+
+
+def archive_settings(settings):
+    '''
+        Get our archive writer options from the app settings.
+    '''
+    return {
+        'compress_level': int(settings.get('archive.compress_level', 6)),
+        'max_workers': int(settings.get('archive.workers', 4)),
+    }
+
+
+def is_compressed_file(filename):
+    return filename.lower().endswith(stored_extensions)
+
+
+def write_archive(zip_path, members, compress_level=6, max_workers=4,
+                  chunk_size=1024 * 1024):
+    '''
+        Write a zip archive containing the specified files.
+
+        :param zip_path: The path of the zipfile to create.
+        :param members: A sequence of (file path, archive name) pairs.
+        :param compress_level: The deflate level for compressible members.
+        :param max_workers: The number of threads used for compression.
+    '''
+    members = list(members)
+    compressible = [m for m in members if not is_compressed_file(m[0])]
+
+    with zipfile.ZipFile(zip_path, 'w', allowZip64=True) as zf:
+        if (max_workers <= 1 or len(compressible) <= 1 or
+                not _can_write_deflated(zf)):
+            for path, arcname in members:
+                _write_member(zf, path, arcname, compress_level)
+
+            return zip_path
+
+        spool_dir = os.path.dirname(os.path.abspath(zip_path))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = dict([(path, executor.submit(_deflate_file, path,
+                                                   compress_level, spool_dir,
+                                                   chunk_size))
+                            for path, _arcname in compressible])
+
+            for path, arcname in members:
+                if path in futures:
+                    with futures[path].result() as deflated:
+                        _write_deflated_member(zf, path, arcname, deflated)
+                else:
+                    _write_member(zf, path, arcname, compress_level)
+
+    return zip_path
+
+
+def _can_write_deflated(zf):
+    '''
+        Does this ZipFile have the internals that _write_deflated_member()
+        needs?
+    '''
+    return all([hasattr(zf, a) for a in ('fp', 'start_dir', 'filelist',
+                                         'NameToInfo', '_lock',
+                                         '_writecheck', '_didModify')])
+
+
+def _write_member(zf, path, arcname, compress_level):
+    if is_compressed_file(path):
+        zf.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+    else:
+        zf.write(path, arcname, compress_type=zipfile.ZIP_DEFLATED,
+                 compresslevel=compress_level)
+
+
+class _DeflatedFile(object):
+    '''
+        The raw deflate stream of a file, spooled to a temporary file,
+        plus the information we need for its zip header.
+    '''
+    def __init__(self, spool, crc, file_size, compress_size):
+        self.spool = spool
+        self.crc = crc
+        self.file_size = file_size
+        self.compress_size = compress_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.spool.close()
+
+
+def _deflate_file(path, compress_level, spool_dir, chunk_size):
+    compressor = zlib.compressobj(compress_level, zlib.DEFLATED,
+                                  -zlib.MAX_WBITS)
+    spool = tempfile.TemporaryFile(dir=spool_dir)
+    crc = file_size = compress_size = 0
+
+    try:
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(chunk_size), b''):
+                crc = zlib.crc32(chunk, crc)
+                file_size += len(chunk)
+
+                data = compressor.compress(chunk)
+                compress_size += len(data)
+                spool.write(data)
+
+        data = compressor.flush()
+        compress_size += len(data)
+        spool.write(data)
+    except Exception:
+        spool.close()
+        raise
+
+    return _DeflatedFile(spool, crc, file_size, compress_size)
+
+
+def _write_deflated_member(zf, path, arcname, deflated):
+    '''
+        Copy an already deflated member into the archive.  This does the
+        same work as ZipFile.write(), minus the compression.
+    '''
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    zinfo.compress_type = zipfile.ZIP_DEFLATED
+    zinfo.CRC = deflated.crc
+    zinfo.file_size = deflated.file_size
+    zinfo.compress_size = deflated.compress_size
+
+    zip64 = (deflated.file_size > zipfile.ZIP64_LIMIT or
+             deflated.compress_size > zipfile.ZIP64_LIMIT)
+
+    with zf._lock:
+        zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+
+        zf._writecheck(zinfo)
+        zf._didModify = True
+
+        zf.fp.write(zinfo.FileHeader(zip64))
+
+        deflated.spool.seek(0)
+        shutil.copyfileobj(deflated.spool, zf.fp)
+
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
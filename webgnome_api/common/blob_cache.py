@@ -0,0 +1,198 @@
+"""
+    A process-wide, in-memory cache of the binary blobs we send to the
+    client.
+
+    The grid geometry of a large regional ocean model can take a while to
+    extract and compress, and the same grid is fetched by every session
+    that loads that model.  So we compress it once and keep the compressed
+    bytes, keyed by a signature of the grid, and evict the least recently
+    used blobs once the total size goes over a configured budget.
+
+    A blob is anything that supports the buffer protocol, so read-only
+    numpy arrays can be cached as well as bytes.
+"""
+import os
+import hashlib
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+import numpy as np
+
+from .upload_store import hash_file
+
+log = logging.getLogger(__name__)
+
+# The SHA-256 of the files we have hashed, by their identity on disk
+max_content_hashes = 4096
+_content_hashes = OrderedDict()
+_content_hashes_lock = Lock()
+
+
+class BlobCache(object):
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> (blob, info)
+        self._size = 0
+        self._pending = {}  # key -> lock held while the blob is created
+
+    @property
+    def size(self):
+        return self._size
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''
+            Return the (blob, info) of an entry, or None if we don't have it.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+
+            return entry
+
+    def put(self, key, blob, info=None):
+        with self._lock:
+            old_entry = self._entries.pop(key, None)
+
+            if old_entry is not None:
+                self._size -= blob_size(old_entry[0])
+
+            size = blob_size(blob)
+
+            if size > self.max_size:
+                log.info(f'Not caching blob {key}, size {size} '
+                         'is over budget')
+                return
+
+            self._entries[key] = (blob, info)
+            self._size += size
+            self._evict()
+
+    def get_or_create(self, key, create_func):
+        '''
+            Return the (blob, info) of an entry, creating it with
+            create_func() if we don't have it.
+
+            Only one thread creates any particular entry.  Other threads
+            asking for the same entry wait for it to be created.
+        '''
+        entry = self.get(key)
+
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            key_lock = self._pending.setdefault(key, Lock())
+
+        with key_lock:
+            try:
+                entry = self.get(key)
+
+                if entry is None:
+                    entry = create_func()
+                    self.put(key, *entry)
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+
+        return entry
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            key, (blob, _info) = self._entries.popitem(last=False)
+            self._size -= blob_size(blob)
+
+            log.info(f'Evicting blob {key}')
+
+
+def blob_size(blob):
+    return memoryview(blob).nbytes
+
+
+def file_signature(filenames):
+    '''
+        Generate a signature that identifies the contents of a file, or a
+        list of files, by their identity on disk.  If a file changes, its
+        signature changes.  Returns None if we don't have any files.
+    '''
+    if isinstance(filenames, str):
+        filenames = [filenames]
+
+    try:
+        file_stats = [os.stat(f) for f in filenames]
+    except (TypeError, OSError):
+        return None
+
+    if len(file_stats) == 0:
+        return None
+
+    return tuple([(os.path.realpath(f), s.st_dev, s.st_ino,
+                   s.st_size, s.st_mtime_ns)
+                  for f, s in zip(filenames, file_stats)])
+
+
+def file_content_hash(filename):
+    '''
+        Get the SHA-256 of a file's contents.  The file is only read again
+        if its identity on disk changes, and a file that is linked into a
+        number of sessions is only read once.
+    '''
+    s = os.stat(filename)
+    key = (s.st_dev, s.st_ino, s.st_size, s.st_mtime_ns)
+
+    with _content_hashes_lock:
+        digest = _content_hashes.get(key)
+
+        if digest is not None:
+            _content_hashes.move_to_end(key)
+            return digest
+
+    digest = hash_file(filename)
+
+    with _content_hashes_lock:
+        _content_hashes[key] = digest
+
+        while len(_content_hashes) > max_content_hashes:
+            _content_hashes.popitem(last=False)
+
+    return digest
+
+
+def grid_signature(grid):
+    '''
+        Generate a signature that identifies a grid's geometry across
+        sessions.
+
+        Grids that were loaded from a file are identified by the file,
+        which is a lot cheaper than looking at the geometry.  Grids that
+        don't have a file are identified by a hash of their nodes and faces.
+    '''
+    file_sig = file_signature(getattr(grid, 'filename', None))
+
+    if file_sig is not None:
+        # a file can hold more than one grid, so include the topology
+        return (grid.__class__.__name__,
+                repr(getattr(grid, 'grid_topology', None)),
+                'file',
+                file_sig)
+
+    digest = hashlib.sha1()
+
+    for attr in ('nodes', 'faces'):
+        data = getattr(grid, attr, None)
+
+        if data is not None:
+            digest.update(np.ascontiguousarray(data).tobytes())
+
+    return (grid.__class__.__name__, 'geometry', digest.hexdigest())
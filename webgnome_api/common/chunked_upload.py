@@ -0,0 +1,384 @@
+"""
+    Resumable, chunked uploads of large data files.
+
+    A multi-gigabyte hindcast file can't reliably be sent in a single
+    multipart request.  Instead, the client:
+
+    - starts an upload with the file's name and size, and gets an upload id
+    - appends the file's bytes, one chunk at a time, at the offset the
+      upload is at.  Each chunk can carry its SHA-256, which we check.
+    - commits the upload, once all the bytes are there.
+
+    If a chunk fails, the client asks for the upload's offset, and carries
+    on from there.  An upload that hasn't had a chunk for a while is
+    abandoned, and removed.
+
+    The bytes go straight into a part file in the session folder, and we
+    hash the file as it arrives, so committing it is just a rename.  The
+    state of an upload is kept in a small JSON file next to the part file,
+    so an upload can also be resumed after the server restarts.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import uuid
+from threading import Lock
+
+import ujson
+
+from .system_resources import get_free_space
+
+log = logging.getLogger(__name__)
+
+upload_id_pattern = re.compile(r'^[0-9a-f]{32}$')
+
+# the folder, in a session folder, that holds its uploads in progress
+upload_dir_name = 'chunked_uploads'
+
+
+class UploadError(ValueError):
+    '''
+        A request that doesn't fit the state of an upload.
+    '''
+    pass
+
+
+class OffsetMismatch(UploadError):
+    '''
+        A chunk that was not sent at the offset the upload is at.
+    '''
+    def __init__(self, offset, expected):
+        super().__init__(f'Chunk offset {offset} does not match '
+                         f'the upload offset {expected}')
+        self.offset = offset
+        self.expected = expected
+
+
+class InsufficientSpace(UploadError):
+    '''
+        There is not enough free space for a chunk.
+    '''
+    pass
+
+
+class ChunkedUpload(object):
+    '''
+        An upload in progress.
+
+        :param upload_dir: The folder that holds our part & state files.
+        :param upload_id: Our unique id.
+        :param filename: The name of the file being uploaded.
+        :param size: The declared size of the file.
+        :param sha256: The declared SHA-256 of the file, if we were given
+                       one.
+    '''
+    chunk_size = 1024 * 1024
+
+    def __init__(self, upload_dir, upload_id, filename, size, sha256=None):
+        self.upload_dir = upload_dir
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.sha256 = sha256
+
+        self.lock = Lock()
+
+        self._hasher = None
+        self._hashed = 0  # the number of bytes our hasher has seen
+
+    @classmethod
+    def create(cls, upload_dir, filename, size, sha256=None):
+        filename = os.path.basename(filename or '')
+
+        if filename in ('', '.', '..'):
+            raise UploadError('A filename is required')
+
+        if size < 0:
+            raise UploadError(f'Invalid size: {size}')
+
+        if sha256 is not None:
+            sha256 = sha256.lower()
+
+            if re.match(r'^[0-9a-f]{64}$', sha256) is None:
+                raise UploadError(f'Invalid SHA-256: {sha256}')
+
+        os.makedirs(upload_dir, exist_ok=True)
+
+        upload = cls(upload_dir, uuid.uuid4().hex, filename, size, sha256)
+
+        open(upload.part_path, 'wb').close()
+        upload._save_state()
+
+        return upload
+
+    @classmethod
+    def load(cls, upload_dir, upload_id):
+        '''
+            Load an upload from its state file.  Returns None if there is
+            no such upload.
+        '''
+        if upload_id_pattern.match(upload_id or '') is None:
+            return None
+
+        try:
+            with open(os.path.join(upload_dir, upload_id + '.json'),
+                      encoding='utf-8') as fd:
+                state = ujson.load(fd)
+        except (OSError, ValueError):
+            return None
+
+        return cls(upload_dir, upload_id,
+                   state['filename'], state['size'], state.get('sha256'))
+
+    @property
+    def part_path(self):
+        return os.path.join(self.upload_dir, self.upload_id + '.part')
+
+    @property
+    def state_path(self):
+        return os.path.join(self.upload_dir, self.upload_id + '.json')
+
+    @property
+    def offset(self):
+        return os.path.getsize(self.part_path)
+
+    @property
+    def remaining(self):
+        '''
+            The number of bytes still to come.  An upload that has been
+            removed has none.
+        '''
+        try:
+            return self.size - self.offset
+        except FileNotFoundError:
+            return 0
+
+    def exists(self):
+        return os.path.exists(self.state_path)
+
+    def to_dict(self):
+        return {'upload_id': self.upload_id,
+                'filename': self.filename,
+                'size': self.size,
+                'offset': self.offset}
+
+    def _save_state(self):
+        with open(self.state_path, 'w', encoding='utf-8') as fd:
+            ujson.dump({'filename': self.filename,
+                        'size': self.size,
+                        'sha256': self.sha256}, fd)
+
+    def _catch_up_hasher(self, offset):
+        '''
+            Make sure our hasher has seen the first offset bytes of our
+            part file.  Normally it has, unless we were loaded after a
+            restart.
+        '''
+        if self._hasher is not None and self._hashed == offset:
+            return
+
+        self._hasher = hashlib.sha256()
+        self._hashed = 0
+
+        with open(self.part_path, 'rb') as fd:
+            while self._hashed < offset:
+                data = fd.read(min(self.chunk_size, offset - self._hashed))
+
+                if not data:
+                    break
+
+                self._hasher.update(data)
+                self._hashed += len(data)
+
+    def append(self, input_file, offset, length=None, chunk_sha256=None):
+        '''
+            Append a chunk, read from a file-like object, at an offset.
+            The chunk is written straight to our part file.  If it turns
+            out to be bad, the part file is truncated back to where it was.
+
+            :param length: The length of the chunk, if it is known.
+            :param chunk_sha256: The SHA-256 the chunk is supposed to have.
+            :returns: The new offset of our upload.
+        '''
+        with self.lock:
+            expected = self.offset
+
+            if offset != expected:
+                raise OffsetMismatch(offset, expected)
+
+            remaining = self.size - offset
+
+            if length is not None and length > remaining:
+                raise UploadError(f'Chunk of {length} bytes goes past '
+                                  f'the end of the file ({self.size} bytes)')
+
+            # the space we checked for when the upload started may have
+            # been taken since.
+            if length is not None:
+                self._check_free_space(length)
+
+            self._catch_up_hasher(offset)
+
+            chunk_hasher = hashlib.sha256()
+            file_hasher = self._hasher.copy()
+            written = 0
+
+            try:
+                with open(self.part_path, 'r+b') as fd:
+                    fd.seek(offset)
+
+                    while length is None or written < length:
+                        want = self.chunk_size
+
+                        if length is not None:
+                            want = min(want, length - written)
+
+                        data = input_file.read(want)
+
+                        if not data:
+                            break
+
+                        if length is None:
+                            self._check_free_space(len(data))
+
+                        written += len(data)
+
+                        if written > remaining:
+                            raise UploadError('Chunk goes past the end of '
+                                              f'the file ({self.size} bytes)')
+
+                        fd.write(data)
+                        chunk_hasher.update(data)
+                        file_hasher.update(data)
+
+                if length is not None and written != length:
+                    raise UploadError(f'Chunk is incomplete, got {written} '
+                                      f'of {length} bytes')
+
+                if (chunk_sha256 is not None and
+                        chunk_hasher.hexdigest() != chunk_sha256.lower()):
+                    raise UploadError('Chunk SHA-256 does not match')
+            except Exception:
+                os.truncate(self.part_path, offset)
+                raise
+
+            self._hasher = file_hasher
+            self._hashed = offset + written
+
+            return self._hashed
+
+    def _check_free_space(self, length):
+        free_space = get_free_space(self.upload_dir)
+
+        if length >= free_space:
+            raise InsufficientSpace(f'Not enough space for {length} more '
+                                    f'bytes, {free_space} bytes are free')
+
+    def hexdigest(self):
+        '''
+            The SHA-256 of our complete file.
+        '''
+        with self.lock:
+            self._catch_up_hasher(self.offset)
+
+            return self._hasher.hexdigest()
+
+    def commit(self, dest_path):
+        '''
+            Finish our upload, moving the complete file to dest_path.
+
+            :returns: The SHA-256 of the file.
+        '''
+        with self.lock:
+            offset = self.offset
+
+            if offset != self.size:
+                raise UploadError(f'Upload is incomplete, got {offset} '
+                                  f'of {self.size} bytes')
+
+            self._catch_up_hasher(offset)
+            digest = self._hasher.hexdigest()
+
+            if self.sha256 is not None and digest != self.sha256:
+                raise UploadError('File SHA-256 does not match')
+
+            os.replace(self.part_path, dest_path)
+            self.remove()
+
+        return digest
+
+    def remove(self):
+        for path in (self.part_path, self.state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def get_max_upload_age(settings):
+    '''
+        How long, in seconds, an upload can go without a chunk before it
+        is abandoned.
+    '''
+    return float(settings.get('chunked_upload.max_age', 24 * 60 * 60))
+
+
+def list_uploads(upload_dir):
+    '''
+        The uploads in progress in a folder.
+    '''
+    try:
+        names = os.listdir(upload_dir)
+    except FileNotFoundError:
+        return []
+
+    uploads = [ChunkedUpload.load(upload_dir, n[:-len('.json')])
+               for n in names if n.endswith('.json')]
+
+    return [u for u in uploads if u is not None]
+
+
+def remove_stale_uploads(upload_dir, max_age):
+    '''
+        Remove the uploads in a folder that haven't had a chunk for max_age
+        seconds.
+
+        :returns: The number of uploads we removed.
+    '''
+    now = time.time()
+    removed = 0
+
+    for upload in list_uploads(upload_dir):
+        # the part file is touched by every chunk.
+        mtimes = []
+
+        for path in (upload.part_path, upload.state_path):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except FileNotFoundError:
+                pass
+
+        if mtimes and now - max(mtimes) > max_age:
+            log.info(f'Removing abandoned upload {upload.upload_id} '
+                     f'of {upload.filename}')
+            upload.remove()
+            removed += 1
+
+    return removed
+
+
+def remove_stale_session_uploads(session_dir, max_age):
+    '''
+        Remove the abandoned uploads of all our sessions.
+    '''
+    try:
+        session_names = os.listdir(session_dir)
+    except FileNotFoundError:
+        return 0
+
+    return sum([remove_stale_uploads(os.path.join(session_dir, name,
+                                                  upload_dir_name),
+                                     max_age)
+                for name in session_names])
@@ -0,0 +1,245 @@
+"""
+    Compression codecs for our binary array responses.
+
+    Our binary endpoints used to always deflate their payloads.  The client
+    can now choose a faster codec, either with the Accept-Encoding header,
+    or explicitly with a 'codec' query parameter:
+
+    - deflate: zlib, our default.  Decoded natively by browsers.
+    - zstd: Zstandard.  Decoded natively by recent browsers.
+    - lz4: LZ4 frames.  Not an HTTP content encoding, so the response is
+           sent as identity and the client decodes it.
+    - raw: no compression, for clients on a fast local connection.
+
+    zstd and lz4 are only available if their python packages are installed.
+
+    Arrays are fed to the codec's streaming compressor in chunks, through
+    memoryviews of the arrays, so a large array is never copied as a whole
+    just to be compressed.
+
+    Our responses always carry an explicit Content-Encoding, so the gzip
+    filter in our pipeline never compresses them a second time.  The codec
+    used is in the 'codec' response header.
+"""
+import zlib
+import logging
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+log = logging.getLogger(__name__)
+
+
+class Codec(object):
+    '''
+        The raw codec.  Our data is passed through unchanged.
+    '''
+    name = 'raw'
+    content_encoding = 'identity'
+
+    def compress(self, data):
+        return bytes(data)
+
+    def compressobj(self):
+        '''
+            Get an object with compress(data) and flush() methods, for
+            compressing a stream of data.
+        '''
+        return _PassThrough()
+
+
+class _PassThrough(object):
+    def compress(self, data):
+        return bytes(data)
+
+    def flush(self):
+        return b''
+
+
+class DeflateCodec(Codec):
+    name = 'deflate'
+    content_encoding = 'deflate'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def compressobj(self):
+        return zlib.compressobj(self.level)
+
+
+class ZstdCodec(Codec):
+    name = 'zstd'
+    content_encoding = 'zstd'
+
+    def __init__(self, level=3):
+        self.level = level
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressobj(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+
+
+class Lz4Codec(Codec):
+    name = 'lz4'
+    content_encoding = 'identity'
+
+    def compress(self, data):
+        return lz4.frame.compress(data)
+
+    def compressobj(self):
+        return _Lz4Stream()
+
+
+class _Lz4Stream(object):
+    def __init__(self):
+        self.compressor = lz4.frame.LZ4FrameCompressor()
+        self.header = self.compressor.begin()
+
+    def compress(self, data):
+        chunk = self.header + self.compressor.compress(data)
+        self.header = b''
+
+        return chunk
+
+    def flush(self):
+        return self.header + self.compressor.flush()
+
+
+codecs = {'raw': Codec(),
+          'deflate': DeflateCodec()}
+
+if zstandard is not None:
+    codecs['zstd'] = ZstdCodec()
+
+if lz4 is not None:
+    codecs['lz4'] = Lz4Codec()
+
+default_codec = codecs['deflate']
+
+# The HTTP content encodings we negotiate, in our order of preference
+accepted_encodings = (('zstd', 'zstd'),
+                      ('deflate', 'deflate'),
+                      ('identity', 'raw'))
+
+
+def parse_accept_encoding(header):
+    '''
+        Get the {encoding: quality} of an Accept-Encoding header.
+    '''
+    accepted = {}
+
+    for item in header.split(','):
+        parts = [p.strip() for p in item.split(';')]
+        encoding = parts[0].lower()
+
+        if encoding == '':
+            continue
+
+        quality = 1.0
+
+        for p in parts[1:]:
+            if p.startswith('q='):
+                try:
+                    quality = float(p[2:])
+                except ValueError:
+                    quality = 0.0
+
+        accepted[encoding] = quality
+
+    return accepted
+
+
+def negotiate_codec(codec_name=None, accept_encoding=None):
+    '''
+        Choose the codec for a response.  An explicitly requested codec
+        wins, otherwise we take the best one in the Accept-Encoding that
+        we have.  Without either one, we deflate.
+
+        :raises ValueError: If the requested codec is not available.
+    '''
+    if codec_name:
+        try:
+            return codecs[codec_name]
+        except KeyError as e:
+            raise ValueError(f'Codec {codec_name} is not available.  '
+                             f'Try one of {sorted(codecs)}') from e
+
+    if accept_encoding:
+        accepted = parse_accept_encoding(accept_encoding)
+
+        for encoding, name in accepted_encodings:
+            quality = accepted.get(encoding, accepted.get('*'))
+
+            if quality is not None and quality > 0 and name in codecs:
+                return codecs[name]
+
+    return default_codec
+
+
+def iter_array_chunks(arrays, chunk_size=1024 * 1024):
+    '''
+        Generate memoryviews of the bytes of our arrays, in chunks of about
+        chunk_size.  Contiguous arrays are not copied.  Non-contiguous
+        arrays, like a transposed raster, are copied one block of rows at
+        a time.
+    '''
+    for a in arrays:
+        if isinstance(a, (bytes, bytearray, memoryview)):
+            a = np.frombuffer(a, dtype=np.uint8)
+        else:
+            a = np.asarray(a)
+
+        if a.ndim == 0 or a.size == 0:
+            if a.nbytes > 0:
+                yield memoryview(np.ascontiguousarray(a)).cast('B')
+
+            continue
+
+        row_bytes = max(a.nbytes // a.shape[0], 1)
+        rows = max(chunk_size // row_bytes, 1)
+
+        for start in range(0, a.shape[0], rows):
+            block = np.ascontiguousarray(a[start:start + rows])
+
+            yield memoryview(block).cast('B')
+
+
+def iter_compressed(codec, arrays, chunk_size=1024 * 1024):
+    '''
+        Generate the compressed bytes of our arrays, as if they were
+        concatenated, without concatenating them.
+    '''
+    compressor = codec.compressobj()
+
+    for chunk in iter_array_chunks(arrays, chunk_size):
+        data = compressor.compress(chunk)
+
+        if data:
+            yield data
+
+    data = compressor.flush()
+
+    if data:
+        yield data
+
+
+def compress_arrays(codec, arrays):
+    '''
+        Get the compressed bytes of our arrays, as if they were
+        concatenated.
+    '''
+    return b''.join(iter_compressed(codec, arrays))
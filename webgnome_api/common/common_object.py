@@ -3,6 +3,7 @@
 """
 import os
 import shutil
+import hashlib
 import urllib.request
 import ujson
 import logging
@@ -16,6 +17,7 @@ from gnome.utilities.orderedcollection import OrderedCollection
 from gnome.spill_container import SpillContainerPair
 
 from .helpers import FQNamesToDict, PyClassFromName
+from .blob_cache import file_content_hash
 
 from webgnome_api.common.session_management import (req_session_is_valid,
                                                     set_session_object,
@@ -127,6 +129,41 @@ def UpdateObject(obj, json_obj, all_objects, deserialize_obj=True):
         return all_objects[id_]
 
 
+def ObjectContentHash(obj, by_file_content=False):
+    '''
+        Generate a hash of the content of a Gnome object, including all of
+        its contained child objects.
+
+        Object ids are left out, so the same model configuration loaded in
+        two different sessions will produce the same hash.
+
+        Data files are referenced by their full path, so a different data
+        file with the same name will not produce the same hash.  With
+        by_file_content, data files are referenced by their name and the
+        hash of their contents instead.  Then the same data in two
+        sessions produces the same hash, and a data file that is replaced
+        under the same path does not.
+    '''
+    def strip_ids(json_):
+        if isinstance(json_, dict):
+            return dict([(k, strip_ids(v)) for k, v in json_.items()
+                         if k != 'id'])
+        elif isinstance(json_, (list, tuple)):
+            return [strip_ids(v) for v in json_]
+        elif (by_file_content and isinstance(json_, str) and
+                os.path.isfile(json_)):
+            return {'file': os.path.basename(json_),
+                    'sha256': file_content_hash(json_)}
+        else:
+            return json_
+
+    json_ = strip_ids(obj.serialize(options={'raw_paths': True}))
+
+    return hashlib.sha256(ujson.dumps(json_, sort_keys=True,
+                                      ensure_ascii=False)
+                          .encode('utf-8')).hexdigest()
+
+
 def ValueIsJsonObject(value):
     return (isinstance(value, dict) and 'obj_type' in value)
 
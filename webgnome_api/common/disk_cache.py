@@ -0,0 +1,227 @@
+"""
+    A small content-addressed file cache kept on local disk.
+
+    Entries are stored as <cache_dir>/<key>/<filename>, and are evicted in
+    least-recently-used order once the total size of the cached files goes
+    over a configured budget.  The access time of an entry is kept as the
+    mtime of its folder, so the LRU order survives a server restart.
+"""
+import os
+import time
+import uuid
+import errno
+import shutil
+import hashlib
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+import ujson
+
+from .system_resources import transfer_file
+
+log = logging.getLogger(__name__)
+
+
+class DiskCache(object):
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> (file path, size)
+        self._size = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan()
+
+    @staticmethod
+    def make_key(*parts):
+        '''
+            Generate a cache key from any JSON serializable parts.
+        '''
+        data = ujson.dumps(parts, sort_keys=True, ensure_ascii=False)
+
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    @property
+    def size(self):
+        return self._size
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        '''
+            Return the path of the cached file, or None if we don't have it.
+
+            Note: The file could be evicted at any time after this returns.
+                  Use fetch() if you need a copy that is safe to keep.
+        '''
+        with self._lock:
+            return self._touch(key)
+
+    def fetch(self, key, dest_path):
+        '''
+            Make the cached file available at dest_path, preferably as a
+            hardlink.  Returns True if we had the entry.
+        '''
+        with self._lock:
+            path = self._touch(key)
+
+            if path is None:
+                return False
+
+            try:
+                os.link(path, dest_path)
+            except OSError:
+                shutil.copyfile(path, dest_path)
+
+            return True
+
+    def put(self, key, src_path):
+        '''
+            Add a file to the cache, preferably as a hardlink, so a large
+            file isn't written twice.  The file must not be modified in
+            place afterwards.  Returns the cached path, or None if the file
+            could not be cached.
+        '''
+        try:
+            size = os.path.getsize(src_path)
+        except OSError:
+            return None
+
+        if size > self.max_size:
+            log.info(f'Not caching {src_path}, size {size} is over budget')
+            return None
+
+        tmp_dir = os.path.join(self.cache_dir, f'.tmp-{uuid.uuid4()}')
+        entry_dir = os.path.join(self.cache_dir, key)
+        entry_path = os.path.join(entry_dir, os.path.basename(src_path))
+
+        try:
+            os.mkdir(tmp_dir)
+            transfer_file(src_path,
+                          os.path.join(tmp_dir, os.path.basename(src_path)),
+                          link=True)
+        except OSError as e:
+            log.warning(f'Could not cache {src_path}: {e}')
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return None
+
+        with self._lock:
+            if key in self._entries:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                return self._touch(key)
+
+            try:
+                os.rename(tmp_dir, entry_dir)
+            except OSError as e:
+                # another process populated the same entry
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+                if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                    raise
+
+                self._scan_entry(key)
+                return self._touch(key)
+
+            self._entries[key] = (entry_path, size)
+            self._size += size
+            self._evict()
+
+            return entry_path if key in self._entries else None
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _touch(self, key):
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        path, _size = entry
+
+        if not os.path.isfile(path):
+            # somebody cleaned up our folder behind our back
+            self._remove(key)
+            return None
+
+        self._entries.move_to_end(key)
+
+        try:
+            os.utime(os.path.dirname(path))
+        except OSError:
+            pass
+
+        return path
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self._size -= entry[1]
+
+        shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+
+    def _evict(self):
+        while self._size > self.max_size and self._entries:
+            key = next(iter(self._entries))
+            log.info(f'Evicting cache entry {key} from {self.cache_dir}')
+            self._remove(key)
+
+    def _scan_entry(self, key):
+        entry_dir = os.path.join(self.cache_dir, key)
+
+        try:
+            filenames = os.listdir(entry_dir)
+        except OSError:
+            return None
+
+        if len(filenames) != 1:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        path = os.path.join(entry_dir, filenames[0])
+        size = os.path.getsize(path)
+
+        if key in self._entries:
+            self._size -= self._entries[key][1]
+
+        self._entries[key] = (path, size)
+        self._size += size
+
+        return os.stat(entry_dir).st_mtime
+
+    def _scan(self):
+        '''
+            Rebuild our entries from whatever is already on disk.
+        '''
+        mtimes = {}
+
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.tmp-'):
+                tmp_dir = os.path.join(self.cache_dir, key)
+
+                # only clean up stale temp folders, in case another worker
+                # is in the middle of populating one.
+                if os.stat(tmp_dir).st_mtime < time.time() - 3600:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+                continue
+
+            mtime = self._scan_entry(key)
+
+            if mtime is not None:
+                mtimes[key] = mtime
+
+        for key in sorted(mtimes, key=mtimes.get):
+            self._entries.move_to_end(key)
+
+        self._evict()
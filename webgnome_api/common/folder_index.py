@@ -0,0 +1,184 @@
+"""
+    An index of the folders in our persistent uploads area.
+
+    Listing a folder used to stat every file in it, on every request, and
+    send the whole listing back.  Our persistent area holds thousands of
+    shared datasets, so instead we keep the listing of each folder we have
+    seen, with the sizes of its files, and only scan the folder again when
+    its modification time changes, when we modify it ourselves, or when
+    the listing gets old.
+
+    A listing can be sorted, filtered by name and paged.
+"""
+import os
+import stat
+import time
+import errno
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+from .system_resources import file_info
+
+log = logging.getLogger(__name__)
+
+sort_keys = ('name', 'size', 'type')
+
+
+def sort_files(files, sort='name', reverse=False):
+    '''
+        Sort a listing of files, as made by file_info(), by one of
+        sort_keys.  Ties are sorted by name.
+    '''
+    if sort not in sort_keys:
+        raise ValueError(f'Can not sort by {sort}')
+
+    if sort == 'name':
+        files = sorted(files, key=lambda i: i['name'])
+    else:
+        files = sorted(files, key=lambda i: (i[sort], i['name']))
+
+    return files[::-1] if reverse else files
+
+
+def filter_files(files, show_hidden=False, name_filter=None):
+    '''
+        Filter a listing of files, leaving out the hidden files, unless we
+        show them, and the files without name_filter in their name,
+        regardless of case.
+    '''
+    if not show_hidden:
+        files = [f for f in files if not f['name'].startswith('.')]
+
+    if name_filter:
+        name_filter = name_filter.lower()
+        files = [f for f in files if name_filter in f['name'].lower()]
+
+    return files
+
+
+class FolderListing(object):
+    '''
+        The files of a folder, as of its modification time.  The sorted
+        orders of the files are kept as they are asked for.
+    '''
+    def __init__(self, folder, mtime_ns):
+        self.mtime_ns = mtime_ns
+        self.scanned_at = time.time()
+        self.files = []
+        self._sorted = {}
+
+        for f in os.listdir(folder):
+            try:
+                self.files.append(file_info(folder, f))
+            except FileNotFoundError:
+                # removed since we listed the folder
+                pass
+
+    def sorted(self, sort, reverse=False):
+        files = self._sorted.get(sort)
+
+        if files is None:
+            files = sort_files(self.files, sort)
+            self._sorted[sort] = files
+
+        return files[::-1] if reverse else files
+
+
+class FolderIndex(object):
+    '''
+        The listings of up to max_folders folders, dropping the least
+        recently used.  A listing older than max_age seconds is scanned
+        again, in case a file was modified without its folder changing.
+    '''
+    def __init__(self, max_folders=256, max_age=60.0):
+        self.max_folders = max_folders
+        self.max_age = max_age
+
+        self._lock = Lock()
+        self._listings = OrderedDict()
+
+    def __len__(self):
+        return len(self._listings)
+
+    def get_listing(self, folder):
+        '''
+            Get the listing of a folder, scanning it only if it has
+            changed.  Like os.listdir(), we raise an OSError if the folder
+            doesn't exist, or is not a folder.
+        '''
+        key = os.path.realpath(folder)
+        folder_stat = os.stat(key)
+
+        if not stat.S_ISDIR(folder_stat.st_mode):
+            raise NotADirectoryError(errno.ENOTDIR,
+                                     os.strerror(errno.ENOTDIR), folder)
+
+        with self._lock:
+            listing = self._listings.get(key)
+
+            if (listing is not None and
+                    listing.mtime_ns == folder_stat.st_mtime_ns and
+                    time.time() - listing.scanned_at < self.max_age):
+                self._listings.move_to_end(key)
+                return listing
+
+        listing = FolderListing(key, folder_stat.st_mtime_ns)
+        log.debug(f'Indexed folder {key}, {len(listing.files)} files')
+
+        with self._lock:
+            self._listings[key] = listing
+            self._listings.move_to_end(key)
+
+            while len(self._listings) > self.max_folders:
+                self._listings.popitem(last=False)
+
+        return listing
+
+    def invalidate(self, *paths):
+        '''
+            Forget the listings of the given paths, and of the folders
+            that hold them.  This is called whenever we modify one of our
+            folders, so we don't rely on its modification time changing
+            within its resolution.
+        '''
+        with self._lock:
+            for path in paths:
+                path = os.path.realpath(path)
+
+                for key in (path, os.path.dirname(path)):
+                    self._listings.pop(key, None)
+
+    def list_files(self, folder, show_hidden=False, sort='name',
+                   reverse=False, name_filter=None):
+        '''
+            List the files of a folder, like system_resources.list_files()
+
+            :param sort: The key of the files to sort by, one of sort_keys.
+            :param name_filter: Only list the files with this in their
+                                name, regardless of case.
+        '''
+        if sort not in sort_keys:
+            raise ValueError(f'Can not sort by {sort}')
+
+        files = self.get_listing(folder).sorted(sort, reverse)
+
+        return filter_files(files, show_hidden, name_filter)
+
+
+def page_of(files, page, page_size):
+    '''
+        Get a page of a listing, with the paging info that a client needs
+        to get the rest.  Pages are numbered from 1.
+    '''
+    if page < 1 or page_size < 1:
+        raise ValueError('page and page_size must be positive')
+
+    start = (page - 1) * page_size
+    num_pages = (len(files) + page_size - 1) // page_size
+
+    return {'files': files[start:start + page_size],
+            'page': page,
+            'page_size': page_size,
+            'num_pages': num_pages,
+            'total': len(files)}
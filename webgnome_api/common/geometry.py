@@ -0,0 +1,385 @@
+"""
+    Level-of-detail support for the grid geometry we send to the client.
+
+    A large unstructured grid has far more detail than the client can show
+    at most zoom levels, and usually only part of it is in view.  So the
+    client can give us a viewport bounding box and a zoom level, and we
+    send only the part of the grid that is in view, decimated to about one
+    vertex per pixel.
+
+    The decimated grid for each zoom level is computed once for the whole
+    extent of the grid, and then clipped to each requested viewport.
+
+    Map shorelines get the same treatment, with Douglas-Peucker
+    simplification of their GeoJSON at the tolerance of a zoom level.
+"""
+import math
+
+import numpy as np
+
+max_level = 24
+
+
+def parse_bbox(value):
+    '''
+        Parse a bounding box in the form 'min_lon,min_lat,max_lon,max_lat'
+    '''
+    bbox = [float(v) for v in value.split(',')]
+
+    if len(bbox) != 4 or not all([math.isfinite(v) for v in bbox]):
+        raise ValueError(f'Invalid bounding box: {value}')
+
+    if bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError(f'Invalid bounding box: {value}')
+
+    return tuple(bbox)
+
+
+def level_resolution(level):
+    '''
+        The size in degrees of a 256 pixel map tile pixel at a zoom level.
+    '''
+    return 360.0 / (256 * 2 ** level)
+
+
+def resolution_level(resolution):
+    '''
+        Get the zoom level with the closest pixel size to a resolution in
+        degrees.  Our decimated levels are only computed for whole zoom
+        levels, so they can be shared by all our clients.
+    '''
+    if resolution <= 0.0:
+        raise ValueError(f'Invalid resolution: {resolution}')
+
+    level = int(round(math.log2(level_resolution(0) / resolution)))
+
+    return min(max(level, 0), max_level)
+
+
+def pack_lines(lengths, coords):
+    '''
+        Pack our lines into a single buffer, plus the info we need to
+        unpack them.
+    '''
+    info = (len(lengths), lengths.dtype.str, coords.dtype.str)
+
+    return lengths.tobytes() + coords.tobytes(), info
+
+
+def unpack_lines(buff, info):
+    num_lengths, lengths_dtype, coords_dtype = info
+
+    lengths = np.frombuffer(buff, dtype=lengths_dtype, count=num_lengths)
+    coords = np.frombuffer(buff, dtype=coords_dtype,
+                           offset=lengths.nbytes).reshape(-1, 2)
+
+    return lengths, coords
+
+
+def line_starts(lengths):
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    return starts
+
+
+def decimate_lines(lengths, coords, resolution):
+    '''
+        Decimate our lines by snapping their vertices to a raster with a
+        cell size of resolution, and keeping only the first vertex in each
+        cell.  The first and last vertices of a line are always kept.
+        Lines that fit entirely within a single cell are dropped.
+
+        :param lengths: The number of vertices in each line
+        :param coords: The vertices of all the lines, shape (N, 2)
+    '''
+    if len(lengths) == 0:
+        return lengths, coords
+
+    cells = np.floor(coords / resolution).astype(np.int64)
+    line_ids = np.repeat(np.arange(len(lengths)), lengths)
+
+    starts = line_starts(lengths)
+    ends = starts + lengths - 1
+
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = ((cells[1:] != cells[:-1]).any(axis=1) |
+                (line_ids[1:] != line_ids[:-1]))
+    keep[ends] = True
+
+    new_lengths = np.bincount(line_ids[keep], minlength=len(lengths))
+
+    visible = (cells[starts] != cells[ends]).any(axis=1) | (new_lengths > 2)
+    keep &= visible[line_ids]
+
+    return new_lengths[visible].astype(lengths.dtype), coords[keep]
+
+
+def clip_lines(lengths, coords, bbox):
+    '''
+        Keep only the lines that have any part within our bounding box.
+    '''
+    if len(lengths) == 0:
+        return lengths, coords
+
+    starts = line_starts(lengths)
+
+    min_x = np.minimum.reduceat(coords[:, 0], starts)
+    max_x = np.maximum.reduceat(coords[:, 0], starts)
+    min_y = np.minimum.reduceat(coords[:, 1], starts)
+    max_y = np.maximum.reduceat(coords[:, 1], starts)
+
+    visible = ((max_x >= bbox[0]) & (min_x <= bbox[2]) &
+               (max_y >= bbox[1]) & (min_y <= bbox[3]))
+
+    line_ids = np.repeat(np.arange(len(lengths)), lengths)
+
+    return lengths[visible], coords[visible[line_ids]]
+
+
+def decimate_points(points, resolution):
+    '''
+        Decimate our points by keeping only the first point in each cell
+        of a raster with a cell size of resolution.  The order of the
+        points is preserved.
+
+        :returns: The (indices, points) of the points we kept.
+    '''
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64), points
+
+    cells = np.floor(points / resolution).astype(np.int64)
+    _cells, first = np.unique(cells, axis=0, return_index=True)
+    indices = np.sort(first)
+
+    return indices, points[indices]
+
+
+def clip_points(points, bbox):
+    '''
+        Keep only the points that are within our bounding box.
+
+        :returns: The (indices, points) of the points we kept.
+    '''
+    inside = ((points[:, 0] >= bbox[0]) & (points[:, 0] <= bbox[2]) &
+              (points[:, 1] >= bbox[1]) & (points[:, 1] <= bbox[3]))
+    indices = np.flatnonzero(inside)
+
+    return indices, points[indices]
+
+
+def simplify_coords(coords, tolerance):
+    '''
+        Simplify a line with the Douglas-Peucker algorithm.  The first and
+        last points are always kept.
+
+        :param coords: The (N, 2) points of the line
+        :param tolerance: The maximum distance of a dropped point from the
+                          simplified line.
+        :returns: The (M, 2) points of the simplified line.
+    '''
+    coords = np.asarray(coords, dtype=np.float64)
+
+    if len(coords) < 3 or tolerance <= 0.0:
+        return coords
+
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(coords) - 1)]
+
+    while stack:
+        first, last = stack.pop()
+
+        if last - first < 2:
+            continue
+
+        points = coords[first + 1:last]
+        start, end = coords[first], coords[last]
+        seg = end - start
+        seg_len_sq = seg.dot(seg)
+
+        if seg_len_sq == 0.0:
+            dist_sq = ((points - start) ** 2).sum(axis=1)
+        else:
+            t = np.clip(((points - start) @ seg) / seg_len_sq, 0.0, 1.0)
+            dist_sq = ((points - (start + t[:, np.newaxis] * seg)) ** 2
+                       ).sum(axis=1)
+
+        i = int(dist_sq.argmax())
+
+        if dist_sq[i] > tolerance * tolerance:
+            split = first + 1 + i
+            keep[split] = True
+            stack.append((first, split))
+            stack.append((split, last))
+
+    return coords[keep]
+
+
+def simplify_ring(ring, tolerance):
+    '''
+        Simplify a closed polygon ring.  Returns None if the ring collapses
+        to less than a triangle at our tolerance.
+    '''
+    ring = simplify_coords(ring, tolerance)
+
+    if len(ring) < 4:
+        return None
+
+    return ring.tolist()
+
+
+def simplify_geometry(geometry, tolerance):
+    '''
+        Simplify a GeoJSON geometry.  Polygons whose outer ring collapses
+        are dropped, as are collapsed holes.  Returns None if nothing is
+        left of the geometry.
+    '''
+    geo_type = geometry['type']
+    coords = geometry.get('coordinates')
+
+    def polygon(rings):
+        outer = simplify_ring(rings[0], tolerance)
+
+        if outer is None:
+            return None
+
+        holes = [simplify_ring(r, tolerance) for r in rings[1:]]
+
+        return [outer] + [h for h in holes if h is not None]
+
+    if geo_type == 'Polygon':
+        new_coords = polygon(coords)
+    elif geo_type == 'MultiPolygon':
+        new_coords = [p for p in [polygon(rings) for rings in coords]
+                      if p is not None]
+    elif geo_type == 'LineString':
+        new_coords = simplify_coords(coords, tolerance).tolist()
+    elif geo_type == 'MultiLineString':
+        new_coords = [simplify_coords(c, tolerance).tolist()
+                      for c in coords]
+    elif geo_type == 'GeometryCollection':
+        geometries = [simplify_geometry(g, tolerance)
+                      for g in geometry['geometries']]
+        geometries = [g for g in geometries if g is not None]
+
+        return (dict(geometry, geometries=geometries)
+                if geometries else None)
+    else:
+        # Points stay as they are
+        return geometry
+
+    if not new_coords:
+        return None
+
+    return dict(geometry, coordinates=new_coords)
+
+
+def simplify_geojson(feature_collection, tolerance):
+    '''
+        Simplify the geometries of a GeoJSON FeatureCollection.  Features
+        with nothing left of their geometry are dropped.
+    '''
+    features = []
+
+    for f in feature_collection['features']:
+        if f.get('geometry') is None:
+            features.append(f)
+            continue
+
+        geometry = simplify_geometry(f['geometry'], tolerance)
+
+        if geometry is not None:
+            features.append(dict(f, geometry=geometry))
+
+    return dict(feature_collection, features=features)
+
+
+def quantize_geojson(feature_collection, quantization=100000):
+    '''
+        Encode the coordinates of a GeoJSON FeatureCollection the way
+        TopoJSON does.  The coordinates are quantized to integers on a
+        quantization x quantization grid over the extent of the collection,
+        and the positions within each line or ring are delta-encoded.
+        Points are only quantized.
+
+        The client gets back the original coordinates with the transform
+        that we add to the collection:
+
+            x = (sum of the deltas) * scale[0] + translate[0]
+    '''
+    def iter_positions(coords):
+        if len(coords) > 0 and isinstance(coords[0], (int, float)):
+            yield coords
+        else:
+            for c in coords:
+                yield from iter_positions(c)
+
+    def iter_geometry_coords(geometry):
+        if geometry is None:
+            return
+        elif geometry['type'] == 'GeometryCollection':
+            for g in geometry['geometries']:
+                yield from iter_geometry_coords(g)
+        else:
+            yield geometry['coordinates']
+
+    positions = np.array([p[:2]
+                          for f in feature_collection['features']
+                          for c in iter_geometry_coords(f.get('geometry'))
+                          for p in iter_positions(c)],
+                         dtype=np.float64).reshape(-1, 2)
+
+    if len(positions) == 0:
+        return dict(feature_collection)
+
+    translate = positions.min(axis=0)
+    extent = positions.max(axis=0) - translate
+    scale = np.where(extent > 0, extent / (quantization - 1), 1.0)
+
+    def quantize_line(coords, delta=True):
+        q = np.round((np.asarray(coords, dtype=np.float64)[:, :2] -
+                      translate) / scale).astype(np.int64)
+
+        if delta:
+            q[1:] -= q[:-1].copy()
+
+        return q.tolist()
+
+    def quantize_coords(coords, depth):
+        # depth is the nesting level of the lines of positions
+        if depth is None:
+            # points are quantized, but not delta-encoded
+            if len(coords) > 0 and isinstance(coords[0], (int, float)):
+                return quantize_line([coords])[0]
+
+            return quantize_line(coords, delta=False)
+        elif depth == 0:
+            return quantize_line(coords)
+
+        return [quantize_coords(c, depth - 1) for c in coords]
+
+    line_depths = {'Point': None, 'MultiPoint': None, 'LineString': 0,
+                   'MultiLineString': 1, 'Polygon': 1, 'MultiPolygon': 2}
+
+    def quantize_geometry(geometry):
+        if geometry is None:
+            return None
+        elif geometry['type'] == 'GeometryCollection':
+            return dict(geometry,
+                        geometries=[quantize_geometry(g)
+                                    for g in geometry['geometries']])
+        else:
+            return dict(geometry,
+                        coordinates=quantize_coords(
+                            geometry['coordinates'],
+                            line_depths[geometry['type']]
+                        ))
+
+    features = [dict(f, geometry=quantize_geometry(f.get('geometry')))
+                for f in feature_collection['features']]
+
+    return dict(feature_collection,
+                features=features,
+                transform={'scale': scale.tolist(),
+                           'translate': translate.tolist()})
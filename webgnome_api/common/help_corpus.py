@@ -0,0 +1,257 @@
+"""
+    A precompiled corpus of our help documentation.
+
+    Rendering reStructuredText with docutils is slow, so we render every
+    help file once, when we start up or when the help files change, and
+    serve the requested help from memory.  The rendered help is also saved
+    in an on-disk cache, so a restart only needs to render the files that
+    have changed.
+"""
+import os
+import time
+import hashlib
+import logging
+import threading
+from threading import RLock
+from os.path import sep, join
+
+import ujson
+
+from docutils.core import publish_parts
+
+from .indexing import iter_keywords, html_to_text, InvertedIndex
+from .system_resources import tree_signature
+
+log = logging.getLogger(__name__)
+
+
+def help_dir_from_settings(settings):
+    '''
+        Get the full path of our help dir from the app settings.
+    '''
+    help_dir = settings['help_dir']
+
+    if help_dir[0] == sep:
+        return help_dir
+    else:
+        return join(settings['install_path'], help_dir)
+
+
+class HelpCorpus(object):
+    def __init__(self, help_dir, cache_dir=None, refresh_interval=5.0):
+        self.help_dir = os.path.normpath(help_dir)
+        self.cache_dir = cache_dir
+        self.refresh_interval = refresh_interval
+
+        self._lock = RLock()
+        self._signature = None
+        self._checked_at = 0.0
+
+        self._docs = {}  # relative path without extension -> doc
+        self._dirs = {}  # relative dir path -> [relative doc paths]
+        self._aggregate_paths = []
+        self._aggregate = []
+        self._index = InvertedIndex()
+
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get_file(self, requested):
+        '''
+            Get a single help file.  The requested path is relative to our
+            help dir, and without the .rst extension.
+        '''
+        self.refresh_if_changed()
+        doc = self._docs.get(os.path.normpath(requested))
+
+        if doc is None:
+            return None
+        else:
+            return {'path': doc['path'], 'html': doc['html']}
+
+    def get_dir(self, requested):
+        '''
+            Get the aggregated html of the help files in a directory.
+        '''
+        self.refresh_if_changed()
+        requested = os.path.normpath(requested)
+        doc_paths = self._dirs.get(requested)
+
+        if doc_paths is None:
+            return None
+        else:
+            return {'path': join(self.help_dir, requested),
+                    'html': ''.join([self._docs[p]['html']
+                                     for p in doc_paths])}
+
+    def get_all(self):
+        '''
+            Get all our help files, excluding the location file user guides.
+        '''
+        self.refresh_if_changed()
+
+        return self._aggregate
+
+    def search(self, query, limit=10):
+        '''
+            Full-text search of our help files, excluding the location file
+            user guides.  Returns a ranked list of matching files with
+            a snippet of their text.
+        '''
+        self.refresh_if_changed()
+
+        return self._index.search(query, limit=limit)
+
+    def refresh_if_changed(self):
+        now = time.time()
+
+        if (self._signature is not None and
+                now - self._checked_at < self.refresh_interval):
+            return
+
+        with self._lock:
+            self._checked_at = now
+
+            if tree_signature(self.help_dir) != self._signature:
+                self.compile()
+
+    def compile_in_background(self):
+        thread = threading.Thread(target=self.refresh_if_changed,
+                                  name='HelpCorpusCompiler',
+                                  daemon=True)
+        thread.start()
+
+        return thread
+
+    def compile(self):
+        '''
+            Render all our help files.
+        '''
+        with self._lock:
+            begin = time.time()
+            signature = tree_signature(self.help_dir)
+
+            docs = {}
+            dirs = {}
+            aggregate_paths = []
+            rendered = 0
+
+            for path, dirnames, filenames in os.walk(self.help_dir):
+                dirnames.sort()
+
+                rel_dir = os.path.relpath(path, self.help_dir)
+                dirs[rel_dir] = []
+
+                for fname in sorted(filenames):
+                    if not fname.endswith('.rst'):
+                        continue
+
+                    rel_path = os.path.normpath(join(rel_dir, fname[:-4]))
+                    doc, was_rendered = self._load_doc(path, fname)
+
+                    if doc is None:
+                        continue
+
+                    rendered += was_rendered
+                    docs[rel_path] = doc
+                    dirs[rel_dir].append(rel_path)
+
+                    # exclude location file user guides
+                    if path.count(join('model', 'locations')) == 0:
+                        aggregate_paths.append(rel_path)
+
+            self._docs = docs
+            self._dirs = dirs
+            self._aggregate_paths = aggregate_paths
+            self._aggregate = [{'path': docs[p]['path'],
+                                'html': docs[p]['html'],
+                                'keywords': docs[p]['keywords']}
+                               for p in aggregate_paths]
+            self._index = self._build_index(docs, aggregate_paths)
+            self._signature = signature
+            self._checked_at = time.time()
+
+            log.info(f'compiled {len(docs)} help files ({rendered} rendered) '
+                     f'in {time.time() - begin:.2f} sec')
+
+    def _build_index(self, docs, doc_paths):
+        index = InvertedIndex()
+
+        for p in doc_paths:
+            doc = docs[p]
+            text = html_to_text(doc['html'])
+
+            index.add(p, text, doc['keywords'],
+                      info={'path': doc['path'],
+                            'keywords': doc['keywords']})
+
+        index.finalize()
+
+        return index
+
+    def _load_doc(self, path, fname):
+        file_path = join(path, fname)
+
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None, False
+
+        cache_path = self._cache_path(file_path)
+        doc = self._read_cache(cache_path, file_stat)
+
+        if doc is not None:
+            return doc, False
+
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+
+        doc = {
+            'path': join(path, fname[:-4]),
+            'html': publish_parts(text, writer_name='html')['html_body'],
+            'keywords': iter_keywords(publish_parts(text)['whole']),
+            'size': file_stat.st_size,
+            'mtime': file_stat.st_mtime_ns,
+        }
+
+        self._write_cache(cache_path, doc)
+
+        return doc, True
+
+    def _cache_path(self, file_path):
+        if self.cache_dir is None:
+            return None
+
+        digest = hashlib.sha1(file_path.encode('utf-8')).hexdigest()
+
+        return join(self.cache_dir, digest + '.json')
+
+    def _read_cache(self, cache_path, file_stat):
+        if cache_path is None:
+            return None
+
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                doc = ujson.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if (doc.get('size') == file_stat.st_size and
+                doc.get('mtime') == file_stat.st_mtime_ns):
+            return doc
+        else:
+            return None
+
+    def _write_cache(self, cache_path, doc):
+        if cache_path is None:
+            return
+
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                ujson.dump(doc, f, ensure_ascii=False)
+
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            log.warning(f'Could not write help cache {cache_path}: {e}')
@@ -1,5 +1,166 @@
+import re
+import html
+import math
+import bisect
+from collections import defaultdict
+
 import docutils.core
 
+token_re = re.compile(r'[a-z0-9]+')
+comment_re = re.compile(r'<!--.*?-->', re.DOTALL)
+tag_re = re.compile(r'<[^>]+>')
+space_re = re.compile(r'\s+')
+
+stop_words = frozenset(('a', 'an', 'and', 'are', 'as', 'at', 'be', 'by',
+                        'can', 'for', 'from', 'if', 'in', 'is', 'it', 'of',
+                        'on', 'or', 'that', 'the', 'this', 'to', 'will',
+                        'with', 'you', 'your'))
+
+
+def tokenize(text):
+    return [t for t in token_re.findall(text.lower())
+            if t not in stop_words]
+
+
+def html_to_text(html_body):
+    '''
+        Get the plain text of an html fragment, for indexing and snippets.
+    '''
+    text = tag_re.sub(' ', comment_re.sub(' ', html_body))
+
+    return space_re.sub(' ', html.unescape(text)).strip()
+
+
+class InvertedIndex(object):
+    '''
+        A small full-text index of our documents.
+
+        Documents are ranked with BM25.  Keywords count more than body text,
+        and a query term also matches the indexed terms that it is a prefix
+        of, at a reduced weight.
+    '''
+    k1 = 1.2
+    b = 0.75
+    keyword_boost = 3.0
+    prefix_weight = 0.5
+
+    def __init__(self):
+        self.documents = {}  # doc id -> (text, info)
+        self.postings = defaultdict(dict)  # term -> {doc id: term freq}
+        self.lengths = {}
+        self.terms = []  # sorted, for prefix matching
+
+    def add(self, doc_id, text, keywords='', info=None):
+        '''
+            Add a document to the index.  The info dict is returned along
+            with the document in our search results.
+        '''
+        tokens = tokenize(text)
+        freqs = defaultdict(float)
+
+        for t in tokens:
+            freqs[t] += 1.0
+
+        for t in tokenize(keywords):
+            freqs[t] += self.keyword_boost
+
+        for t, f in freqs.items():
+            self.postings[t][doc_id] = f
+
+        self.documents[doc_id] = (text, info or {})
+        self.lengths[doc_id] = len(tokens)
+
+    def finalize(self):
+        '''
+            Call this after adding all the documents.
+        '''
+        self.terms = sorted(self.postings)
+
+        if self.lengths:
+            self.avg_length = sum(self.lengths.values()) / len(self.lengths)
+        else:
+            self.avg_length = 0.0
+
+    def expand(self, term):
+        '''
+            Get the indexed terms matching a query term, with their weights.
+        '''
+        matches = {}
+
+        if term in self.postings:
+            matches[term] = 1.0
+
+        i = bisect.bisect_left(self.terms, term)
+
+        while i < len(self.terms) and self.terms[i].startswith(term):
+            matches.setdefault(self.terms[i], self.prefix_weight)
+            i += 1
+
+        return matches
+
+    def search(self, query, limit=10, snippet_size=160):
+        num_docs = len(self.documents)
+        scores = defaultdict(float)
+        matched_terms = defaultdict(set)
+
+        for q in set(tokenize(query)):
+            for term, weight in self.expand(q).items():
+                postings = self.postings[term]
+                idf = math.log(1.0 + (num_docs - len(postings) + 0.5) /
+                               (len(postings) + 0.5))
+
+                for doc_id, freq in postings.items():
+                    norm = self.k1 * (1.0 - self.b + self.b *
+                                      self.lengths[doc_id] /
+                                      (self.avg_length or 1.0))
+
+                    scores[doc_id] += (weight * idf * freq * (self.k1 + 1.0) /
+                                       (freq + norm))
+                    matched_terms[doc_id].add(term)
+
+        ranked = sorted(scores.items(), key=lambda i: (-i[1], i[0]))[:limit]
+        results = []
+
+        for doc_id, score in ranked:
+            text, info = self.documents[doc_id]
+            result = dict(info)
+            result.update({
+                'score': round(score, 4),
+                'snippet': make_snippet(text, matched_terms[doc_id],
+                                        snippet_size),
+            })
+            results.append(result)
+
+        return results
+
+
+def make_snippet(text, terms, size=160):
+    '''
+        Get a snippet of text around the first occurrence of any of the terms.
+    '''
+    lower_text = text.lower()
+    positions = [m.start() for m in
+                 [re.search(r'\b' + re.escape(t), lower_text) for t in terms]
+                 if m is not None]
+
+    start = max(min(positions) - size // 4, 0) if positions else 0
+    end = start + size
+
+    if start > 0:
+        # don't start in the middle of a word
+        space = text.find(' ', start)
+        start = space + 1 if 0 <= space < start + 20 else start
+
+    snippet = text[start:end].strip()
+
+    if start > 0:
+        snippet = '...' + snippet
+
+    if end < len(text):
+        snippet = snippet + '...'
+
+    return snippet
+
 
 def iter_keywords(buff):
     lines = buff.splitlines()
@@ -0,0 +1,260 @@
+"""
+    Process-wide caching of our location files.
+
+    The listing of our locations is kept in a LocationIndex, which is built
+    once and only rebuilt when the location folders change.
+
+    Selecting a location used to load the location's model with
+    Model.load() every time, re-reading every JSON and data file in the
+    location's save folder.  Instead, we load each location model once and
+    keep its serialized form as a template.  Each session gets its own
+    copy of the model, deserialized from the template.  This saves
+    re-parsing the save folder's JSON files, but the Gnome objects may
+    still read their own data files when they are deserialized.
+
+    Deserializing a template is not guaranteed to give the same model as
+    Model.load(), so each new template is checked against the model it was
+    made from.  A location whose template doesn't reproduce its model is
+    always loaded with Model.load().
+"""
+import os
+import copy
+import time
+import logging
+import threading
+from threading import Lock
+from collections import defaultdict
+
+import ujson
+import slugify
+from geojson import FeatureCollection, Feature, Point
+
+from gnome.model import Model
+
+from .system_resources import tree_signature
+from .common_object import ObjectContentHash
+
+log = logging.getLogger(__name__)
+
+
+def iter_location_dirs(locations_dir):
+    '''
+        Generate the (location folder, save folder) pairs of the location
+        files in our locations dir.  A location folder is identified by its
+        compiled.json file.  A missing locations dir has no location files.
+    '''
+    try:
+        names = sorted(os.listdir(locations_dir))
+    except FileNotFoundError:
+        return
+
+    for name in names:
+        path = os.path.join(locations_dir, name)
+
+        if os.path.isfile(os.path.join(path, 'compiled.json')):
+            yield path, os.path.join(path, name + '_save')
+
+
+class LocationIndex(object):
+    '''
+        An in-memory index of our location files.  We keep a lookup table
+        of the locations by their slug, and the pre-rendered body of the
+        FeatureCollection that lists them all.
+
+        We check whether the location folders have changed at most once
+        every refresh_interval seconds, and rebuild the index if they have.
+        If the locations dir doesn't exist (yet), the index is empty until
+        it does.
+    '''
+    def __init__(self, locations_dir, refresh_interval=5.0):
+        self.locations_dir = locations_dir
+        self.refresh_interval = refresh_interval
+
+        self._lock = Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._locations = {}  # slug -> (compiled json, save folder)
+        self._feature_collection = b''
+
+        self.refresh()
+
+    @property
+    def feature_collection(self):
+        '''
+            The JSON encoded FeatureCollection of all our locations.
+        '''
+        self.refresh_if_changed()
+
+        return self._feature_collection
+
+    def get(self, slug):
+        '''
+            Get the (compiled json, save folder) of a location by its slug,
+            or None if there is no such location.
+        '''
+        self.refresh_if_changed()
+
+        return self._locations.get(slug)
+
+    def _get_signature(self):
+        try:
+            signature = [os.stat(self.locations_dir).st_mtime_ns]
+        except FileNotFoundError:
+            return None
+
+        for path, _location_file in iter_location_dirs(self.locations_dir):
+            compiled_json = os.path.join(path, 'compiled.json')
+
+            try:
+                signature.append((path, os.stat(compiled_json).st_mtime_ns))
+            except FileNotFoundError:
+                # removed since we listed it
+                pass
+
+        return tuple(signature)
+
+    def refresh_if_changed(self):
+        now = time.time()
+
+        if now - self._checked_at < self.refresh_interval:
+            return
+
+        self._checked_at = now
+
+        if self._get_signature() != self._signature:
+            self.refresh()
+
+    def refresh(self):
+        with self._lock:
+            signature = self._get_signature()
+            locations = {}
+            features = []
+
+            if signature is None:
+                log.warning(f'locations dir {self.locations_dir} does not '
+                            'exist, no locations are available')
+
+            for path, location_file in iter_location_dirs(self.locations_dir):
+                try:
+                    with open(os.path.join(path, 'compiled.json'), 'r',
+                              encoding='utf-8') as f:
+                        content = ujson.load(f)
+                except FileNotFoundError:
+                    continue
+
+                slug = slugify.slugify_url(content['name'])
+
+                if slug in locations:
+                    log.warning(f'Duplicate location slug {slug} in {path}')
+                    continue
+
+                locations[slug] = (content, location_file)
+                features.append(
+                    Feature(geometry=Point(content['geometry']['coordinates']),
+                            properties={'title': content['name'],
+                                        'slug': slug,
+                                        'content': content['steps']
+                                        })
+                )
+
+            self._locations = locations
+            self._feature_collection = (ujson.dumps(FeatureCollection(features))
+                                        .encode('utf-8'))
+            self._signature = signature
+            self._checked_at = time.time()
+
+            log.info(f'indexed {len(locations)} locations '
+                     f'in {self.locations_dir}')
+
+
+class LocationModelCache(object):
+    def __init__(self):
+        self._lock = Lock()
+        self._load_locks = defaultdict(Lock)
+        # save folder -> (signature, model json), with a model json of None
+        # if the location must be loaded with Model.load()
+        self._templates = {}
+
+    def _load_lock(self, location_file):
+        with self._lock:
+            return self._load_locks[location_file]
+
+    def get_template(self, location_file):
+        '''
+            Get the serialized template for a location, (re)loading it if
+            the location's save folder has changed since we last loaded it.
+            Returns None if the location can't be copied from a template.
+        '''
+        signature = tree_signature(location_file)
+
+        with self._load_lock(location_file):
+            entry = self._templates.get(location_file)
+
+            if entry is None or entry[0] != signature:
+                log.info(f'loading location template: {location_file}')
+
+                entry = (signature, self._make_template(location_file))
+                self._templates[location_file] = entry
+
+        return entry[1]
+
+    def _make_template(self, location_file):
+        '''
+            Serialize a location's model, and check that deserializing it
+            gives us the same model.
+        '''
+        model = Model.load(location_file)
+        template = model.serialize(options={'raw_paths': True})
+
+        try:
+            copied = Model.deserialize(copy.deepcopy(template), refs={})
+            same_model = (ObjectContentHash(copied) ==
+                          ObjectContentHash(model))
+        except Exception:
+            log.warning(f'Could not deserialize the template of '
+                        f'{location_file}, it will be loaded with '
+                        'Model.load() instead', exc_info=True)
+            return None
+
+        if not same_model:
+            log.warning(f'The template of {location_file} does not '
+                        'reproduce its model, it will be loaded with '
+                        'Model.load() instead')
+            return None
+
+        return template
+
+    def get_model(self, location_file):
+        '''
+            Get a new copy of a location's model.
+        '''
+        template = self.get_template(location_file)
+
+        if template is not None:
+            try:
+                return Model.deserialize(copy.deepcopy(template), refs={})
+            except Exception:
+                log.warning(f'Could not copy the template of '
+                            f'{location_file}, loading it instead',
+                            exc_info=True)
+
+        return Model.load(location_file)
+
+    def warm(self, locations_dir):
+        '''
+            Load the templates for all our locations.
+        '''
+        for _path, location_file in iter_location_dirs(locations_dir):
+            try:
+                self.get_template(location_file)
+            except Exception as e:
+                log.warning(f'Could not warm location {location_file}: {e}')
+
+    def warm_in_background(self, locations_dir):
+        thread = threading.Thread(target=self.warm,
+                                  args=(locations_dir,),
+                                  name='LocationCacheWarmer',
+                                  daemon=True)
+        thread.start()
+
+        return thread
@@ -0,0 +1,204 @@
+"""
+    A cheap lookup of the metadata of our NetCDF files.
+
+    Uploaded files and GOODS outputs used to be opened again and again,
+    just to find out whether they were NetCDF, or whether their longitudes
+    needed shifting.  Instead, we probe a file once for its dimensions,
+    variables, time range, grid type and bounding box, and keep the result
+    keyed by the file's path, modification time and size.  If the file
+    changes, it is probed again.
+"""
+import os
+import logging
+from threading import Lock
+from collections import OrderedDict
+
+import numpy as np
+from netCDF4 import Dataset, num2date
+
+log = logging.getLogger(__name__)
+
+# The names of the (lon, lat) coordinate variables of the grids we know
+coordinate_names = (('lon', 'lat'),
+                    ('lonc', 'latc'),
+                    ('lon_rho', 'lat_rho'),
+                    ('longitude', 'latitude'),
+                    ('nav_lon', 'nav_lat'))
+
+# The longitude variables of the FVCOM grids, at their nodes and centers
+lon_varnames = ('lon', 'lonc')
+
+
+def find_time_variable(nc):
+    for name, var in nc.variables.items():
+        if len(var.dimensions) != 1:
+            continue
+
+        if (name == 'time' or
+                getattr(var, 'standard_name', None) == 'time' or
+                getattr(var, 'axis', None) == 'T'):
+            return var
+
+    return None
+
+
+def get_time_range(nc):
+    '''
+        Get the first & last times, and the number of times, of a NetCDF
+        file.  Only the first & last values are read.
+    '''
+    var = find_time_variable(nc)
+
+    if var is None or var.size == 0:
+        return None
+
+    values = [var[0], var[-1]]
+
+    try:
+        times = num2date(values, var.units,
+                         calendar=getattr(var, 'calendar', 'standard'))
+        times = [t.isoformat() for t in times]
+    except Exception:
+        times = [float(v) for v in values]
+
+    return {'variable': var.name,
+            'start': times[0],
+            'end': times[1],
+            'num_times': var.size}
+
+
+def get_grid_type(nc):
+    variables = nc.variables
+    cf_roles = set([getattr(v, 'cf_role', None) for v in variables.values()])
+
+    if 'mesh_topology' in cf_roles or 'nv' in variables:
+        return 'ugrid'
+
+    if 'grid_topology' in cf_roles or 'lon_rho' in variables:
+        return 'sgrid'
+
+    for lon_name, lat_name in coordinate_names:
+        if lon_name in variables and lat_name in variables:
+            if len(variables[lon_name].dimensions) == 1:
+                return 'rgrid'
+            else:
+                return 'curvilinear'
+
+    return None
+
+
+def get_bbox(nc):
+    '''
+        Get the (min_lon, min_lat, max_lon, max_lat) of the first
+        coordinate variables we recognize.
+    '''
+    for lon_name, lat_name in coordinate_names:
+        if lon_name in nc.variables and lat_name in nc.variables:
+            lon = np.ma.masked_invalid(nc.variables[lon_name][:])
+            lat = np.ma.masked_invalid(nc.variables[lat_name][:])
+
+            if lon.count() == 0 or lat.count() == 0:
+                return None
+
+            return [float(lon.min()), float(lat.min()),
+                    float(lon.max()), float(lat.max())]
+
+    return None
+
+
+def probe_netcdf(path):
+    '''
+        Read the metadata of a NetCDF file.  A file that is not NetCDF
+        gets {'is_netcdf': False}.
+    '''
+    try:
+        nc = Dataset(path, 'r')
+    except Exception as e:
+        return {'is_netcdf': False, 'error': str(e)}
+
+    try:
+        variables = {}
+
+        for name, var in nc.variables.items():
+            info = {'dimensions': list(var.dimensions),
+                    'shape': list(var.shape),
+                    'dtype': str(var.dtype)}
+
+            for attr in ('units', 'standard_name', 'long_name'):
+                if attr in var.ncattrs():
+                    info[attr] = str(var.getncattr(attr))
+
+            variables[name] = info
+
+        return {'is_netcdf': True,
+                'dimensions': {d: len(dim)
+                               for d, dim in nc.dimensions.items()},
+                'variables': variables,
+                'time_range': get_time_range(nc),
+                'grid_type': get_grid_type(nc),
+                'bbox': get_bbox(nc)}
+    finally:
+        nc.close()
+
+
+def lon_needs_shift(metadata):
+    '''
+        Does a file, by its probed metadata, have FVCOM longitudes in the
+        range 0-360?  Only FVCOM files, which have both lon and lonc, are
+        shifted.  Other grids, like the 1-D global rectilinear ones, are
+        0-360 on purpose, and shifting them would leave their longitudes
+        out of order.
+    '''
+    if metadata is None or not metadata['is_netcdf']:
+        return False
+
+    bbox = metadata['bbox']
+
+    return (bbox is not None and bbox[2] > 180 and
+            all([n in metadata['variables'] for n in lon_varnames]))
+
+
+class NetCDFProbeCache(object):
+    '''
+        The probed metadata of our NetCDF files, keyed by their path,
+        modification time and size.  We keep up to max_entries of them,
+        dropping the least recently used.
+    '''
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+
+        self._lock = Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def probe(self, path):
+        '''
+            Get the metadata of a file, probing it only if we haven't seen
+            this version of it.  Returns None if there is no such file.
+        '''
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            return None
+
+        key = (os.path.realpath(path), file_stat.st_mtime_ns,
+               file_stat.st_size)
+
+        with self._lock:
+            metadata = self._entries.get(key)
+
+            if metadata is not None:
+                self._entries.move_to_end(key)
+                return metadata
+
+        metadata = probe_netcdf(path)
+
+        with self._lock:
+            self._entries[key] = metadata
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return metadata
@@ -0,0 +1,54 @@
+"""
+    Tiles of the land-water raster of our maps.
+
+    A high resolution map raster can be large, so the client can show it
+    progressively, fetching a coarse overview first and then the tiles it
+    needs at full resolution.
+
+    A raster level is the raster downsampled by a factor of 2 ** level.
+    Each pixel of a downsampled level is the maximum of the pixels it
+    covers, so land is never lost to the downsampling.  A tile is a window
+    of tile_size x tile_size pixels of a level, indexed by (row, col).
+"""
+import numpy as np
+
+max_raster_level = 12
+
+
+def downsample_raster(raster, factor):
+    '''
+        Downsample a 2D raster by a factor, taking the maximum of each
+        block of factor x factor pixels.
+    '''
+    if factor <= 1:
+        return np.ascontiguousarray(raster)
+
+    rows, cols = raster.shape
+    pad_rows = -rows % factor
+    pad_cols = -cols % factor
+
+    if pad_rows or pad_cols:
+        raster = np.pad(raster, ((0, pad_rows), (0, pad_cols)),
+                        mode='edge')
+
+    blocks = raster.reshape(raster.shape[0] // factor, factor,
+                            raster.shape[1] // factor, factor)
+
+    return np.ascontiguousarray(blocks.max(axis=(1, 3)))
+
+
+def tile_window(shape, row, col, tile_size):
+    '''
+        Get the (row_start, col_start, row_end, col_end) pixel window of a
+        tile in a raster of our shape.  Tiles along the edges of the raster
+        can be smaller than tile_size.
+    '''
+    rows, cols = shape
+    row_start, col_start = row * tile_size, col * tile_size
+
+    if not (0 <= row_start < rows and 0 <= col_start < cols):
+        raise ValueError(f'Tile ({row}, {col}) is outside the raster')
+
+    return (row_start, col_start,
+            min(row_start + tile_size, rows),
+            min(col_start + tile_size, cols))
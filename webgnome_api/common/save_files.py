@@ -0,0 +1,238 @@
+"""
+    Ingest of model save files.
+
+    A save file is a zip archive of the model's JSON files and data files.
+    We used to validate the archive, and then have the loader open and read
+    it all over again.  And old (version 0) save files were read twice more
+    to be rewritten as a new archive.
+
+    Instead, we go through the archive once.  Each member is checked for an
+    unsafe path, its size and its compression ratio, and streamed into a
+    folder, with the version 0 objects upgraded on the way.  The loader then
+    reads the model from that folder.
+"""
+import os
+import stat
+import shutil
+import zipfile
+import logging
+import posixpath
+
+import ujson
+
+from .helpers import substance_from_element_type
+
+log = logging.getLogger(__name__)
+
+# Members smaller than this can't do much harm, whatever their compression
+# ratio is.
+min_ratio_check_size = 64 * 1024
+
+
+class SaveFileError(ValueError):
+    '''
+        A save file that we won't load.
+    '''
+    pass
+
+
+def safe_member_path(name):
+    '''
+        Get the relative path of an archive member, or raise a
+        SaveFileError if it is an absolute path or goes up out of the
+        archive.
+    '''
+    path = name.replace('\\', '/')
+
+    if (path.startswith('/') or
+            (len(path) > 1 and path[1] == ':') or
+            '..' in path.split('/')):
+        raise SaveFileError(f'Unsafe path in save file: {name}')
+
+    path = posixpath.normpath(path)
+
+    if path in ('.', ''):
+        raise SaveFileError(f'Unsafe path in save file: {name}')
+
+    return path
+
+
+def check_member(info, max_item_size, max_compress_ratio):
+    if stat.S_ISLNK(info.external_attr >> 16):
+        raise SaveFileError(f'Symbolic link in save file: {info.filename}')
+
+    if info.filename.endswith('.json') and info.file_size > max_item_size:
+        raise SaveFileError(f'{info.filename} is too big '
+                            f'({info.file_size} bytes)')
+
+    if (info.file_size > min_ratio_check_size and
+            info.file_size > info.compress_size * max_compress_ratio):
+        raise SaveFileError(f'{info.filename} is compressed too much '
+                            f'({info.file_size} bytes '
+                            f'from {info.compress_size})')
+
+
+class SaveFileUpgrade(object):
+    '''
+        Collects the objects of a save file that need upgrading if it turns
+        out to be a version 0 save file, before the Spill refactor.
+        Version 0 had element types, which are now substances.
+
+        A save file without a version.txt is taken to be version 0.
+    '''
+    def __init__(self):
+        self.version = '0'  # no version.txt means version 0
+        self.water = None
+        self.element_type = None
+        self.deferred = []  # (path, json, bytes) of the objects we may upgrade
+
+    def take(self, path, json_, buffer):
+        '''
+            Take a member's JSON, and its original bytes, if we may need to
+            upgrade it.  Returns False if the member can be written as it
+            is.
+        '''
+        if self.version != '0' or not isinstance(json_, dict):
+            return False
+
+        obj_type = str(json_.get('obj_type', ''))
+
+        if ('Water' in obj_type and 'environment' in obj_type and
+                self.water is None):
+            self.water = json_
+
+        if 'element_type' in obj_type and self.element_type is None:
+            self.element_type = (path, json_, buffer)
+            return True
+
+        if ('gnome.spills.spill.Spill' in obj_type or
+                'initializers' in obj_type):
+            self.deferred.append((path, json_, buffer))
+            return True
+
+        return False
+
+    def finish(self, write_json, write_bytes):
+        if self.version != '0' or self.element_type is None:
+            # nothing to upgrade, the objects are written as they were
+            if self.element_type is not None:
+                path, _json, buffer = self.element_type
+                write_bytes(path, buffer)
+
+            for path, _json, buffer in self.deferred:
+                write_bytes(path, buffer)
+
+            return
+
+        log.info('upgrading save file from v0 to v1 (Spill Refactor)')
+
+        substance = substance_from_element_type(self.element_type[1],
+                                                self.water)
+        substance_fn = substance['name'] + '.json'
+        write_json(substance_fn, substance)
+
+        for path, json_, _buffer in self.deferred:
+            if 'gnome.spills.spill.Spill' in json_['obj_type']:
+                json_.pop('element_type', None)
+                json_['substance'] = substance_fn
+            else:
+                json_['obj_type'] = (json_['obj_type']
+                                     .replace('.elements.', '.'))
+
+            write_json(path, json_)
+
+
+def ingest_save_file(zip_path, extract_dir,
+                     max_item_size, max_compress_ratio, max_total_size,
+                     chunk_size=1024 * 1024):
+    '''
+        Check a save file, and extract it into extract_dir, in a single
+        pass over its members.  If it is a version 0 save file, it is
+        upgraded as well.
+
+        :param max_item_size: The largest JSON member we accept.
+        :param max_compress_ratio: The largest compression ratio we accept
+                                   for any member.
+        :param max_total_size: The most bytes we extract.
+        :raises SaveFileError: If we won't load the save file.  Nothing is
+                               left in extract_dir.
+    '''
+    try:
+        zf = zipfile.ZipFile(zip_path, 'r')
+    except (zipfile.BadZipFile, OSError) as e:
+        raise SaveFileError(f'Not a valid zip file: {e}') from e
+
+    upgrade = SaveFileUpgrade()
+    total_size = 0
+
+    def out_path(path):
+        dest = os.path.join(extract_dir, *path.split('/'))
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        return dest
+
+    def write_json(path, json_):
+        with open(out_path(path), 'w', encoding='utf-8') as fd:
+            ujson.dump(json_, fd, indent=True)
+
+    def write_bytes(path, buffer):
+        with open(out_path(path), 'wb') as fd:
+            fd.write(buffer)
+
+    try:
+        with zf:
+            os.makedirs(extract_dir, exist_ok=True)
+
+            for info in zf.infolist():
+                path = safe_member_path(info.filename)
+
+                if info.is_dir():
+                    os.makedirs(os.path.join(extract_dir, *path.split('/')),
+                                exist_ok=True)
+                    continue
+
+                check_member(info, max_item_size, max_compress_ratio)
+
+                total_size += info.file_size
+
+                if total_size > max_total_size:
+                    raise SaveFileError('Save file contents are too big '
+                                        f'(over {max_total_size} bytes)')
+
+                if path == 'version.txt' or path.endswith('.json'):
+                    # small members that we may need to look at
+                    buffer = zf.read(info)
+
+                    if path == 'version.txt':
+                        upgrade.version = (buffer.decode('utf-8', 'replace')
+                                           .strip())
+                    elif upgrade.version == '0':
+                        # we may need to upgrade it
+                        try:
+                            json_ = ujson.loads(buffer)
+                        except ValueError:
+                            json_ = None
+
+                        if (json_ is not None and
+                                upgrade.take(path, json_, buffer)):
+                            continue
+
+                    write_bytes(path, buffer)
+                else:
+                    with zf.open(info) as src, open(out_path(path),
+                                                    'wb') as fd:
+                        shutil.copyfileobj(src, fd, chunk_size)
+
+            upgrade.finish(write_json, write_bytes)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile, EOFError,
+            NotImplementedError, RuntimeError) as e:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        raise SaveFileError(f'Not a valid save file: {e}') from e
+    except Exception:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        raise
+
+    log.info(f'Extracted save file {zip_path} to {extract_dir}, '
+             f'{total_size} bytes, version {upgrade.version}')
+
+    return extract_dir
@@ -3,13 +3,36 @@
     operating environment.
 """
 import os
+import io
 import stat
+import mmap
 import platform
 import ctypes
 import shutil
+import uuid
 import errno
+import logging
+from threading import Lock
+from collections import Counter
+
 import gevent
 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+# The Linux ioctl that clones a file's extents (a reflink), on the file
+# systems that support it, like btrfs and xfs.
+FICLONE = 0x40049409
+
+# The errors we get from a copy method that our platform or file system
+# doesn't support.  We fall back to the next one.
+unsupported_errnos = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF,
+                      errno.EPERM, errno.ENOTTY, errno.EOPNOTSUPP}
+
 
 def get_free_space(path):
     if platform.system() == 'Windows':
@@ -39,26 +62,230 @@ def get_size_of_open_file(fd):
     return size
 
 
-def write_to_file(file_in, out_path):
-    if isinstance(file_in, str):
-        file_in = open(file_in, 'rb')
+def write_to_file(file_in, out_path, hasher=None):
+    transfer_file(file_in, out_path, hasher=hasher)
+
+
+class TransferStats(object):
+    '''
+        Counts of our file transfers, and the bytes they actually copied,
+        by the method they used.  Renames, links and reflinks don't copy
+        any bytes.
+    '''
+    def __init__(self):
+        self._lock = Lock()
+        self.transfers = Counter()
+        self.bytes_copied = Counter()
+
+    def record(self, method, bytes_copied):
+        with self._lock:
+            self.transfers[method] += 1
+            self.bytes_copied[method] += bytes_copied
+
+    def to_dict(self):
+        with self._lock:
+            return {m: {'transfers': n,
+                        'bytes_copied': self.bytes_copied[m]}
+                    for m, n in self.transfers.items()}
+
+
+def transfer_file(src, out_path, move=False, link=False, hasher=None,
+                  stats=None):
+    '''
+        Get the contents of a file to out_path, the cheapest way we can:
+
+        - rename the source, if we can consume it
+        - hard link to the source, if out_path can share it
+        - clone the source's extents (a reflink)
+        - copy in the kernel, with copy_file_range() or sendfile()
+        - copy through python, if all else fails
+
+        :param src: The path of the source file, or an open file, like an
+                    uploaded temp file.  An open file is read from its
+                    start, and its position is left alone.
+        :param move: The source path can be removed.
+        :param link: out_path can be a hard link to the source path.  Only
+                     for files that are never modified in place.
+        :param hasher: A hasher, like a hashlib.sha256(), to update with
+                       the contents of the file.
+        :param stats: A TransferStats to record the transfer in.
+        :returns: The method used, and the number of bytes it copied.
+    '''
+    if isinstance(src, (str, os.PathLike)):
+        method, bytes_copied = _transfer_path(src, out_path, move, link)
+    else:
+        method, bytes_copied = _transfer_open_file(src, out_path)
+
+    if hasher is not None:
+        hash_file_into(hasher, out_path)
+
+    if stats is not None:
+        stats.record(method, bytes_copied)
+
+    log.info(f'Transferred {out_path} by {method}, '
+             f'{bytes_copied} bytes copied')
+
+    return method, bytes_copied
+
+
+def _transfer_path(src_path, out_path, move, link):
+    if move:
+        try:
+            os.rename(src_path, out_path)
+            return 'rename', 0
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    if link:
+        ret = _link_path(src_path, out_path)
+
+        if move:
+            os.remove(src_path)
+
+        return ret
+
+    with open(src_path, 'rb') as fd:
+        ret = _transfer_open_file(fd, out_path)
+
+    if move:
+        os.remove(src_path)
+
+    return ret
+
+
+def _link_path(src_path, out_path):
+    '''
+        Hard link out_path to the source, or copy it if we can't.  Like
+        our other transfers, this replaces a file that is already at
+        out_path.  The new file is made under a temporary name, and then
+        renamed over out_path, so a file that shares its contents with
+        out_path is not touched.
+    '''
+    out_dir, out_name = os.path.split(out_path)
+    tmp_path = os.path.join(out_dir, f'.{out_name}.{uuid.uuid4().hex}.tmp')
+
+    try:
+        try:
+            os.link(src_path, tmp_path)
+            ret = 'link', 0
+        except OSError as e:
+            if e.errno not in unsupported_errnos | {errno.EMLINK}:
+                raise
+
+            with open(src_path, 'rb') as fd:
+                ret = _transfer_open_file(fd, tmp_path)
+
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
 
-    gl = gevent.spawn(write_fd_to_file, file_in, out_path)
-    gl.join()
+    return ret
 
 
-def write_fd_to_file(fd, out_path, chunk_size=1024*1024*10):
+def _transfer_open_file(fd, out_path, chunk_size=64 * 1024 * 1024):
+    try:
+        fd.flush()
+        in_fd = fd.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        in_fd = None
+
+    with open(out_path, 'wb') as out_file:
+        if in_fd is None:
+            # an in-memory file, like a small upload in a BytesIO
+            if hasattr(fd, 'getbuffer'):
+                with fd.getbuffer() as buff:
+                    return 'buffer', out_file.write(buff)
+
+            return 'copy', _copy_through_python(fd, out_file, chunk_size)
+
+        out_fd = out_file.fileno()
+        size = os.fstat(in_fd).st_size
+
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(out_fd, FICLONE, in_fd)
+                return 'reflink', 0
+            except OSError as e:
+                if e.errno not in unsupported_errnos:
+                    raise
+
+        for method, copy_func in (('copy_file_range', _copy_file_range),
+                                  ('sendfile', _sendfile)):
+            if not hasattr(os, method):
+                continue
+
+            try:
+                copy_func(in_fd, out_fd, size, chunk_size)
+                return method, size
+            except OSError as e:
+                if e.errno not in unsupported_errnos:
+                    raise
+
+                os.ftruncate(out_fd, 0)
+                os.lseek(out_fd, 0, os.SEEK_SET)
+
+        return 'copy', _copy_through_python(fd, out_file, chunk_size)
+
+
+def _copy_file_range(in_fd, out_fd, size, chunk_size):
+    offset = 0
+
+    while offset < size:
+        copied = os.copy_file_range(in_fd, out_fd,
+                                    min(chunk_size, size - offset),
+                                    offset, offset)
+        if copied == 0:
+            break
+
+        offset += copied
+        gevent.sleep(0)
+
+
+def _sendfile(in_fd, out_fd, size, chunk_size):
+    offset = 0
+
+    while offset < size:
+        copied = os.sendfile(out_fd, in_fd, offset,
+                             min(chunk_size, size - offset))
+        if copied == 0:
+            break
+
+        offset += copied
+        gevent.sleep(0)
+
+
+def _copy_through_python(fd, out_file, chunk_size):
     curr_position = fd.tell()
     fd.seek(0)
 
-    with open(out_path, 'wb') as output_file:
-        written = 1  # any positive number will do initially
-        while written > 0:
-            written = output_file.write(fd.read(chunk_size))
-            gevent.sleep(0.001)
+    copied = 0
 
-    # Set file to original position so we don't produce any side effects.
-    fd.seek(curr_position)
+    try:
+        for data in iter(lambda: fd.read(chunk_size), b''):
+            copied += out_file.write(data)
+            gevent.sleep(0)
+    finally:
+        fd.seek(curr_position)
+
+    return copied
+
+
+def hash_file_into(hasher, path, chunk_size=16 * 1024 * 1024):
+    '''
+        Update a hasher with the contents of a file.  The file is mapped
+        into memory, so it is read straight from the page cache.
+    '''
+    with open(path, 'rb') as fd:
+        if os.fstat(fd.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with memoryview(mapped) as view:
+                for start in range(0, len(view), chunk_size):
+                    hasher.update(view[start:start + chunk_size])
+                    gevent.sleep(0)
 
 
 def write_bufread_to_file(bf, out_path):
@@ -108,6 +335,28 @@ def remove_file_or_dir(file_name):
             os.rmdir(file_name)
 
 
+def tree_signature(folder):
+    '''
+        A cheap signature of the contents of a folder tree.  It will change
+        if any file in the tree is added, removed or modified, and only
+        needs a stat() of each file to compute.
+    '''
+    count = total_size = max_mtime = 0
+
+    for path, _dirnames, filenames in os.walk(folder):
+        for f in filenames:
+            try:
+                file_stat = os.stat(os.path.join(path, f))
+            except OSError:
+                continue
+
+            count += 1
+            total_size += file_stat.st_size
+            max_mtime = max(max_mtime, file_stat.st_mtime_ns)
+
+    return (count, total_size, max_mtime)
+
+
 def list_files(folder, show_hidden=False):
     '''
         List the files of a directory.
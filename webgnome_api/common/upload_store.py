@@ -0,0 +1,262 @@
+"""
+    A content-addressed store of the data files our users upload.
+
+    Many users upload the same files, like the same operational forecast
+    hindcast, and each upload used to land as its own copy in its session
+    folder.  Now, an uploaded file is hashed as it is written, and the
+    session file becomes a hard link to a single blob in our store, named
+    by its SHA-256, so the same file only takes up disk space once.
+
+    We only ever link a blob into a session with a hash that we computed
+    ourselves from an uploaded file.  Linking a blob for a hash that a
+    client sends us would give away the file to anyone who knows its hash.
+
+    A blob's link count is its reference count.  When all the sessions
+    that uploaded it are cleaned up, only the store's link is left, and
+    the blob can be collected.  We keep the most recently used of these
+    unreferenced blobs, up to a size budget, for the next user who uploads
+    the same file.
+
+    When a blob was last used is kept as the modification time of a
+    sidecar file next to it.  We can't touch the blob itself, because it
+    is the same inode as the session files that link to it, and caches
+    that are keyed by a file's modification time would see them change.
+
+    Blobs must never be modified.  Anything that needs to modify an
+    uploaded file in place has to unshare it first.
+"""
+import os
+import re
+import shutil
+import hashlib
+import logging
+from threading import Lock, Timer
+
+log = logging.getLogger(__name__)
+
+digest_pattern = re.compile(r'^[0-9a-f]{64}$')
+blob_name_pattern = re.compile(r'^[0-9a-f]{62}$')
+
+# the suffix of the sidecar file that holds when a blob was last used
+used_suffix = '.used'
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
+
+    with open(path, 'rb') as fd:
+        for data in iter(lambda: fd.read(chunk_size), b''):
+            hasher.update(data)
+
+    return hasher.hexdigest()
+
+
+def unshare_file(path):
+    '''
+        Make sure that a file is not shared with our store, or with any
+        other session, so it can be modified in place.  A shared file is
+        replaced with a private, writable copy.
+    '''
+    if os.stat(path).st_nlink <= 1:
+        return
+
+    log.info(f'Unsharing file {path}')
+
+    tmp_path = f'{path}.unshare-{os.getpid()}'
+
+    try:
+        shutil.copyfile(path, tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class UploadStore(object):
+    '''
+        :param root: The folder that holds our blobs.  It should be on the
+                     same file system as the session folders, or we can't
+                     link to them.
+        :param max_size: The total size of the unreferenced blobs we keep.
+        :param gc_delay: How long collect_garbage_later() waits, so that a
+                         burst of requests is served by one collection.
+    '''
+    def __init__(self, root, max_size, gc_delay=60.0):
+        self.root = root
+        self.max_size = max_size
+        self.gc_delay = gc_delay
+
+        self._gc_lock = Lock()
+        self._timer_lock = Lock()
+        self._gc_timer = None
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def blob_path(self, digest):
+        digest = digest.lower()
+
+        if digest_pattern.match(digest) is None:
+            raise ValueError(f'Invalid SHA-256: {digest}')
+
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def has(self, digest):
+        try:
+            return os.path.isfile(self.blob_path(digest))
+        except ValueError:
+            return False
+
+    def link_to(self, digest, dest_path, size=None):
+        '''
+            Link a blob into a session as dest_path.  Returns False if we
+            don't have the blob, or it is not of the expected size.
+
+            The digest must be one we computed from the session's own
+            upload, never one we were sent.
+        '''
+        try:
+            blob_path = self.blob_path(digest)
+
+            if size is not None and os.path.getsize(blob_path) != size:
+                return False
+
+            os.link(blob_path, dest_path)
+        except (ValueError, FileNotFoundError):
+            return False
+
+        self._touch(blob_path)
+
+        log.info(f'Linked blob {digest} to {dest_path}')
+
+        return True
+
+    def add(self, path, digest):
+        '''
+            Add a file that was just uploaded, with its SHA-256, to our
+            store.  If we already have the blob, the file is replaced by a
+            link to it, and its disk space is freed.  Otherwise, the file
+            becomes the blob.
+
+            If the file can't be linked, we leave it as a private file.
+        '''
+        blob_path = self.blob_path(digest)
+
+        try:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+
+            try:
+                os.link(path, blob_path)
+                log.info(f'Stored new blob {digest} from {path}')
+            except FileExistsError:
+                tmp_path = f'{path}.link-{os.getpid()}'
+
+                if self.link_to(digest, tmp_path, os.path.getsize(path)):
+                    os.replace(tmp_path, path)
+                    log.info(f'Deduplicated {path} to blob {digest}')
+        except OSError as e:
+            log.warning(f'Could not store {path} as blob {digest}: {e}')
+
+    def _touch(self, blob_path):
+        '''
+            Mark a blob as used now, with its sidecar file.
+        '''
+        try:
+            with open(blob_path + used_suffix, 'a'):
+                pass
+
+            os.utime(blob_path + used_suffix)
+        except OSError:
+            pass
+
+    def last_used(self, blob_path, blob_stat):
+        '''
+            When a blob was last used.  A blob that hasn't been used since
+            it was stored has no sidecar, and was last used when it was
+            written.
+        '''
+        try:
+            return os.stat(blob_path + used_suffix).st_mtime
+        except FileNotFoundError:
+            return blob_stat.st_mtime
+
+    def iter_blobs(self):
+        '''
+            Generate the (path, stat) of our blobs.
+        '''
+        for dirpath, _dirnames, filenames in os.walk(self.root):
+            for f in filenames:
+                if blob_name_pattern.match(f) is None:
+                    continue
+
+                path = os.path.join(dirpath, f)
+
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    pass
+
+    def collect_garbage_later(self):
+        '''
+            Collect our garbage in gc_delay seconds, in the background.
+            Any more calls until then are served by the same collection,
+            so a burst of expired sessions only walks our store once.
+        '''
+        with self._timer_lock:
+            if self._gc_timer is not None:
+                return
+
+            self._gc_timer = Timer(self.gc_delay, self._collect_scheduled)
+            self._gc_timer.daemon = True
+            self._gc_timer.start()
+
+    def _collect_scheduled(self):
+        with self._timer_lock:
+            self._gc_timer = None
+
+        try:
+            self.collect_garbage()
+        except Exception:
+            log.exception('Upload store garbage collection failed')
+
+    def collect_garbage(self):
+        '''
+            Remove the least recently used of our unreferenced blobs, until
+            they fit in our size budget.  A blob is unreferenced if our
+            link to it is the only one left.
+
+            :returns: The number of bytes freed.
+        '''
+        with self._gc_lock:
+            unreferenced = sorted([(self.last_used(path, s), s.st_size, path)
+                                   for path, s in self.iter_blobs()
+                                   if s.st_nlink <= 1],
+                                  reverse=True)
+
+            kept_size = 0
+            freed = 0
+
+            for _last_used, size, path in unreferenced:
+                if kept_size + size <= self.max_size:
+                    kept_size += size
+                    continue
+
+                # a session may have linked to it since we looked
+                try:
+                    if os.stat(path).st_nlink > 1:
+                        continue
+
+                    os.remove(path)
+                    freed += size
+                except FileNotFoundError:
+                    pass
+
+                try:
+                    os.remove(path + used_suffix)
+                except FileNotFoundError:
+                    pass
+
+            if freed > 0:
+                log.info(f'Upload store freed {freed} bytes, '
+                         f'keeping {kept_size} unreferenced bytes')
+
+            return freed
@@ -0,0 +1,323 @@
+"""
+    Spatial tiles of gridded vector data (currents and winds).
+
+    The vector data of a large ocean model, for all its times and cells,
+    can be hundreds of megabytes.  Instead, the client can ask for the
+    vectors within a single map tile (the usual z/x/y web mercator tiles),
+    for a single time slice.
+
+    A tile contains the indices of its cells, as uint32, followed by the
+    float32 vectors of those cells.  The cell indices refer to the grid
+    centers or nodes that the vectors are located on, which the client
+    already has from the grid endpoints.
+
+    The vector data is only read from the data files one time slice at a
+    time, as the slices are asked for, and each slice is cached on its own.
+
+    The vector data can also be streamed one time slice at a time, so the
+    client can start animating after the first one.
+"""
+import math
+import struct
+
+import numpy as np
+
+from .blob_cache import file_signature, grid_signature
+
+
+def tile_bounds(z, x, y):
+    '''
+        Get the (min_lon, min_lat, max_lon, max_lat) of a web mercator tile
+    '''
+    num_tiles = 2 ** z
+
+    if not (0 <= z <= 24 and 0 <= x < num_tiles and 0 <= y < num_tiles):
+        raise ValueError(f'Invalid tile: {z}/{x}/{y}')
+
+    def tile_lat(y):
+        return math.degrees(math.atan(math.sinh(math.pi *
+                                                (1 - 2 * y / num_tiles))))
+
+    return (x / num_tiles * 360.0 - 180.0,
+            tile_lat(y + 1),
+            (x + 1) / num_tiles * 360.0 - 180.0,
+            tile_lat(y))
+
+
+def float_columns(values):
+    '''
+        Get an array with named fields, like the (u, v) velocities of our
+        C movers, as a 2D array with a column for each field.
+    '''
+    values = np.asarray(values)
+
+    if values.dtype.names is not None:
+        values = np.column_stack([values[n] for n in values.dtype.names])
+
+    return values
+
+
+def lon_lat_points(points):
+    '''
+        Get our points as an (N, 2) float array of longitude, latitude,
+        with the longitudes in the range [-180, 180).  Points with named
+        fields (longitude first) are also accepted.
+    '''
+    points = float_columns(points).astype(np.float64).reshape(-1, 2)
+    points[:, 0] = (points[:, 0] + 180.0) % 360.0 - 180.0
+
+    return points
+
+
+class VectorField(object):
+    '''
+        Vector data for a time series of values located on a set of points.
+
+        :param positions: The (N, 2) longitude, latitude of our points.
+        :param data: The vector data.  Axis 0 is time, and cell_axis is
+                     the axis of length N.  Anything with a shape that
+                     gives us an array for a time index will do, like a
+                     TimeSlices.
+    '''
+    def __init__(self, positions, data, cell_axis):
+        self.positions = positions
+        self.data = data
+        self.cell_axis = cell_axis
+
+    @property
+    def num_times(self):
+        return self.data.shape[0]
+
+    def tile(self, time_index, z, x, y):
+        '''
+            Get the (cell indices, vectors) of a tile for a time slice.
+        '''
+        if not (0 <= time_index < self.num_times):
+            raise ValueError(f'Invalid time index: {time_index}')
+
+        bbox = tile_bounds(z, x, y)
+        lon, lat = self.positions[:, 0], self.positions[:, 1]
+
+        # include the west & south edges, exclude the east & north ones,
+        # so no point falls in two tiles.
+        inside = ((lon >= bbox[0]) & (lon < bbox[2]) &
+                  (lat >= bbox[1]) & (lat < bbox[3]))
+        indices = np.flatnonzero(inside).astype('<u4')
+
+        values = np.take(self.data[time_index], indices,
+                         axis=self.cell_axis - 1)
+
+        return indices, np.ascontiguousarray(values, dtype='<f4')
+
+    def compressed_tile(self, codec, time_index, z, x, y):
+        '''
+            Get the compressed bytes of a tile, plus the shape of its
+            vectors.
+        '''
+        indices, values = self.tile(time_index, z, x, y)
+
+        return (codec.compress(indices.tobytes() + values.tobytes()),
+                values.shape)
+
+
+class TimeSlices(object):
+    '''
+        Vector data that is read one time slice at a time, when it is
+        asked for.
+
+        :param shape: The shape of all our data, time first.
+        :param read_slice: A function that reads the array of a time index.
+    '''
+    def __init__(self, shape, read_slice):
+        self.shape = tuple(shape)
+        self.read_slice = read_slice
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, time_index):
+        if not (0 <= time_index < self.shape[0]):
+            raise IndexError(f'Invalid time index: {time_index}')
+
+        return self.read_slice(time_index)
+
+
+def find_cell_axis(shape, num_points):
+    '''
+        Find the axis of our data (not counting the time axis) that
+        indexes our points.  Returns None if there isn't one.
+    '''
+    for axis in range(1, len(shape)):
+        if shape[axis] == num_points:
+            return axis
+
+    return None
+
+
+def read_vector_slice(obj, time_index):
+    '''
+        Read the vector data of a gridded environment object, like a
+        GridCurrent or GridWind, for a single time index.  Only that time
+        slice is read from the object's data files.
+
+        Like get_data_vectors(), we take the surface layer of 3D data, and
+        average the components of a staggered (ROMS style) grid onto its
+        cell centers.  Returns an (N, num_components) float32 array.
+    '''
+    grid_ndim = np.ndim(obj.grid.node_lon)
+    surface_index = getattr(getattr(obj, 'depth', None), 'surface_index', 0)
+    components = []
+
+    for var in obj.variables:
+        values = np.ma.filled(var.data[time_index], 0)
+
+        if values.ndim > grid_ndim:
+            values = values[surface_index]
+
+        components.append(values)
+
+    if (len(components) == 2 and grid_ndim == 2 and
+            components[0].shape != components[1].shape):
+        u, v = components
+        components = [(u[:-1, :] + u[1:, :]) / 2,
+                      (v[:, :-1] + v[:, 1:]) / 2]
+
+    return np.column_stack([np.ravel(c) for c in components]).astype('<f4')
+
+
+def gridded_field_signature(obj):
+    '''
+        Generate a signature for the vector data of a gridded environment
+        object, like a GridCurrent or GridWind.  Objects that are loaded
+        from the same files have the same data, so they can share cached
+        tiles.  Otherwise our tiles are specific to the object.
+    '''
+    data_sig = file_signature(getattr(obj, 'data_file', None))
+
+    if data_sig is None:
+        return ('object', obj.id)
+
+    varnames = [getattr(v, 'varname', None)
+                for v in getattr(obj, 'variables', [])]
+
+    return (obj.__class__.__name__,
+            tuple(varnames),
+            data_sig,
+            grid_signature(obj.grid))
+
+
+def gridded_vector_field(obj, read_slice=None):
+    '''
+        Get the VectorField of a gridded environment object.  Its vectors
+        can be located on either the grid centers or the grid nodes.
+
+        The data is read one time slice at a time, as it is needed, with
+        read_slice(time_index).  By default, straight from the object.
+        We only read the first slice here, to see where the vectors are.
+    '''
+    if read_slice is None:
+        def read_slice(time_index):
+            return read_vector_slice(obj, time_index)
+
+    first_slice = read_slice(0)
+    shape = (obj.variables[0].data.shape[0],) + first_slice.shape
+
+    for get_points in (obj.grid.get_centers, obj.grid.get_nodes):
+        positions = lon_lat_points(get_points())
+        cell_axis = find_cell_axis(shape, len(positions))
+
+        if cell_axis is not None:
+            return VectorField(positions, TimeSlices(shape, read_slice),
+                               cell_axis)
+
+    raise ValueError(f'Vector data of shape {shape} '
+                     'does not match the grid')
+
+
+def cached_vector_field(blob_cache, obj):
+    '''
+        Get the VectorField of a gridded environment object, with the
+        positions of its vectors and each of its time slices kept in our
+        blob cache.  So each time slice only needs to be read once, and
+        only when it is asked for.
+    '''
+    signature = gridded_field_signature(obj)
+
+    def read_slice(time_index):
+        def create_slice():
+            values = read_vector_slice(obj, time_index)
+            values.flags.writeable = False
+
+            return values, None
+
+        return blob_cache.get_or_create(signature + ('vector_slice',
+                                                     time_index),
+                                        create_slice)[0]
+
+    def create_field():
+        field = gridded_vector_field(obj, read_slice)
+        return field.positions, (field.data.shape, field.cell_axis)
+
+    positions, (shape, cell_axis) = blob_cache.get_or_create(
+        signature + ('vector_positions',), create_field
+    )
+
+    return VectorField(positions, TimeSlices(shape, read_slice), cell_axis)
+
+
+def cached_tile(blob_cache, obj, codec, time_index, z, x, y):
+    '''
+        Get the compressed bytes of a tile of a gridded environment
+        object's vector data, plus the shape of its vectors.
+
+        Both the tiles and the vector data they are cut from are kept in
+        our blob cache.
+    '''
+    def create_tile():
+        return (cached_vector_field(blob_cache, obj)
+                .compressed_tile(codec, time_index, z, x, y))
+
+    key = (gridded_field_signature(obj) +
+           ('tile', codec.name, time_index, z, x, y))
+
+    return blob_cache.get_or_create(key, create_tile)
+
+
+def time_slice(time_range, num_times):
+    '''
+        Check a requested (start, stop) range of time indexes against the
+        number of times in our data.  A stop of None means all the
+        remaining times.  Returns a slice.
+    '''
+    start, stop = time_range
+    stop = num_times if stop is None else stop
+
+    if not (0 <= start < stop <= num_times):
+        raise ValueError(f'Invalid time range: {time_range}, '
+                         f'data has {num_times} times')
+
+    return slice(start, stop)
+
+
+def iter_time_slices(data, times, codec, lock=None):
+    '''
+        Generate our vector data one time slice at a time.  Each slice is
+        compressed separately with our codec, and framed by its compressed
+        size as a little-endian uint32.
+
+        :param data: Vector data with time as axis 0, like a TimeSlices.
+                     Each slice is only read when it is its turn.
+        :param times: A slice of the time indexes to generate
+        :param lock: A lock to hold while we read each slice, like the
+                     session lock of the object the data comes from.
+    '''
+    for t in range(*times.indices(data.shape[0])):
+        if lock is None:
+            values = data[t]
+        else:
+            with lock:
+                values = data[t]
+
+        chunk = codec.compress(np.ascontiguousarray(values))
+
+        yield struct.pack('<I', len(chunk)) + chunk
@@ -6,6 +6,7 @@ import sys
 import traceback
 import ujson
 import uuid
+import hashlib
 import logging
 
 from threading import current_thread
@@ -13,7 +14,7 @@ from string import Template
 
 from pyramid.settings import asbool
 from pyramid.interfaces import ISessionFactory
-from pyramid.response import FileResponse
+from pyramid.response import Response, FileResponse
 from pyramid.httpexceptions import (HTTPBadRequest,
                                     HTTPNotFound,
                                     HTTPInsufficientStorage,
@@ -25,7 +26,8 @@ from webob import html_escape as _html_escape
 
 from .system_resources import (get_free_space,
                                get_size_of_open_file,
-                               write_to_file)
+                               transfer_file,
+                               list_files)
 from .helpers import (JSONImplementsOneOf,
                       FQNamesToList,
                       PyClassFromName)
@@ -39,6 +41,11 @@ from .common_object import (CreateObject,
                             get_session_dir,
                             get_persistent_dir)
 
+from .vector_tiles import time_slice, iter_time_slices
+from .codecs import negotiate_codec, iter_compressed
+from .netcdf_probe import probe_netcdf, lon_needs_shift
+from .folder_index import sort_files, filter_files, page_of
+
 from .session_management import (get_session_objects,
                                  get_session_object,
                                  acquire_session_lock)
@@ -202,6 +209,134 @@ def cors_file_response(request, path):
     return file_response
 
 
+def get_codec(request):
+    '''
+        Get the codec to use for a binary array response, from the codec
+        query parameter or the Accept-Encoding header.
+    '''
+    try:
+        return negotiate_codec(request.GET.get('codec'),
+                               request.headers.get('Accept-Encoding'))
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+
+def cors_array_response(request, body, codec, headers=None):
+    '''
+        Build the response for an array that was compressed with a codec.
+        Any extra headers we add are exposed to the client, along with the
+        name of the codec.
+
+        Note: The content encoding is always explicit, so the gzip filter
+              leaves our response alone.
+    '''
+    resp = Response(content_type='arraybuffer', body=body)
+    resp.content_encoding = codec.content_encoding
+
+    return cors_response(request, add_array_headers(resp, codec, headers))
+
+
+def cors_array_stream_response(request, arrays, codec, headers=None):
+    '''
+        Build a response that streams the compressed bytes of our arrays,
+        as if they were concatenated.  The arrays are compressed a chunk at
+        a time as the response is sent, so they are never duplicated in
+        memory.
+
+        Note: the arrays are read after our view returns, and so after our
+              session lock is released.  Don't pass arrays that the session
+              could modify in place.
+    '''
+    resp = Response(content_type='arraybuffer',
+                    app_iter=iter_compressed(codec, arrays))
+    resp.content_encoding = codec.content_encoding
+
+    return cors_response(request, add_array_headers(resp, codec, headers))
+
+
+def add_array_headers(resp, codec, headers=None):
+    headers = dict(headers or {})
+    headers['codec'] = codec.name
+
+    resp.headers.add('Access-Control-Expose-Headers', ', '.join(headers))
+    resp.headers.add('Vary', 'Accept-Encoding')
+
+    for k, v in headers.items():
+        resp.headers.add(k, str(v))
+
+    return resp
+
+
+def binary_requested(request):
+    '''
+        Does the client want an array endpoint's binary form instead of
+        JSON?  Either with format=binary, or by accepting
+        application/octet-stream.
+    '''
+    if request.GET.get('format') == 'binary':
+        return True
+
+    return 'application/octet-stream' in request.headers.get('Accept', '')
+
+
+def get_time_range(request):
+    '''
+        Get the (start, stop) time indexes requested for time-sliced
+        vector data, or None if the client wants all of it in one piece.
+
+        - time_index=<n>: a single time slice
+        - time_range=<start>,<stop>: the time slices from start up to,
+          but not including, stop.
+        - stream=true: all the time slices
+    '''
+    try:
+        if 'time_index' in request.GET:
+            start = int(request.GET['time_index'])
+            return (start, start + 1)
+        elif 'time_range' in request.GET:
+            start, stop = [int(v) for v in
+                           request.GET['time_range'].split(',')]
+            return (start, stop)
+        elif asbool(request.GET.get('stream', False)):
+            return (0, None)
+        else:
+            return None
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+
+def time_sliced_response(request, data, time_range, lock=None):
+    '''
+        Stream our vector data one compressed time slice per chunk.
+        The shape header has the shape of the requested data, and the
+        time_range header has the (start, stop) of its time indexes.
+
+        Each slice is read as it is streamed, holding lock (if any) while
+        it is read.
+
+        Note: each chunk is compressed separately with our codec, so the
+              content encoding is identity, and the client decodes the
+              chunks.
+    '''
+    codec = get_codec(request)
+
+    try:
+        times = time_slice(time_range, data.shape[0])
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+    resp = Response(content_type='arraybuffer',
+                    app_iter=iter_time_slices(data, times, codec, lock))
+    resp.content_encoding = 'identity'
+
+    add_array_headers(resp, codec, {
+        'shape': (times.stop - times.start,) + tuple(data.shape[1:]),
+        'time_range': f'{times.start},{times.stop}',
+    })
+
+    return cors_response(request, resp)
+
+
 def get_object(request, implemented_types):
     '''Returns a Gnome object in JSON.'''
     obj_id = obj_id_from_url(request)
@@ -314,6 +449,25 @@ def update_object(request, implemented_types):
     return obj.serialize(options=web_ser_opts)
 
 
+def get_tile_request(request):
+    '''
+        Get the (time_index, z, x, y) of a vector tile request,
+        <obj_id>/tiles/<z>/<x>/<y>?time_index=<n>
+    '''
+    content_requested = request.matchdict.get('obj_id')
+
+    try:
+        if len(content_requested) != 5:
+            raise ValueError('tile requests need a z/x/y')
+
+        z, x, y = [int(v) for v in content_requested[2:]]
+        time_index = int(request.GET.get('time_index', 0))
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+    return time_index, z, x, y
+
+
 def switch_to_existing_session(request):
     '''
     For some reason, the multipart form does not contain
@@ -396,7 +550,10 @@ def process_upload(request, field_name):
             'Not enough space to save the file'
         ))
 
-    write_to_file(input_file, file_path)
+    hasher = hashlib.sha256()
+    transfer_file(input_file, file_path, hasher=hasher,
+                  stats=get_transfer_stats(request))
+    store_upload(request, file_path, hasher.hexdigest())
 
     log.info('Successfully uploaded file "{0}"'.format(file_path))
 
@@ -411,11 +568,111 @@ def process_upload(request, field_name):
 
         persistent_path = os.path.join(upload_dir, file_name)
 
-        write_to_file(input_file, persistent_path)
+        # uploaded files are never modified in place, so the persistent
+        # file can share the session file.
+        transfer_file(file_path, persistent_path, link=True,
+                      stats=get_transfer_stats(request))
+        invalidate_folder_index(request, persistent_path)
 
     return file_path, file_name
 
 
+def get_netcdf_metadata(request, path):
+    '''
+        Get the probed metadata of a NetCDF file, from our probe cache if
+        we have one.
+    '''
+    netcdf_probes = request.registry.settings.get('netcdf_probes')
+
+    if netcdf_probes is None:
+        return probe_netcdf(path) if os.path.exists(path) else None
+
+    return netcdf_probes.probe(path)
+
+
+def get_transfer_stats(request):
+    return request.registry.settings.get('transfer_stats')
+
+
+def store_upload(request, file_path, digest):
+    '''
+        Add an uploaded file in our session folder to the shared upload
+        store, so that other sessions uploading the same file can share it.
+
+        FVCOM files with longitudes in the range 0-360 are kept out of the
+        store.  A C mover shifts their longitudes in place, which it could
+        only do to a shared file after copying all of it.
+    '''
+    upload_store = request.registry.settings.get('upload_store')
+
+    if upload_store is None:
+        return
+
+    if lon_needs_shift(get_netcdf_metadata(request, file_path)):
+        log.info(f'Not storing {file_path}, its longitudes may be shifted')
+        return
+
+    upload_store.add(file_path, digest)
+
+
+def list_folder(request, folder):
+    '''
+        List the files of one of our persistent folders, from our folder
+        index if we have one.  Without one, the folder is listed and then
+        sorted, filtered and paged in the same way.
+
+        - sort=<name|size|type>, order=<asc|desc>: the order of the files
+        - filter=<text>: only the files with the text in their name
+        - page=<n>, page_size=<n>: a page of the files, with the paging
+          info.  Without these, we respond with all the files.
+
+        Like list_files(), we raise an OSError if the folder can't be
+        listed.
+    '''
+    folder_index = request.registry.settings.get('folder_index')
+    params = request.GET
+
+    try:
+        sort = params.get('sort', 'name')
+        order = params.get('order', 'asc')
+        name_filter = params.get('filter')
+
+        if order not in ('asc', 'desc'):
+            raise ValueError(f'Can not order by {order}')
+
+        reverse = order == 'desc'
+
+        if folder_index is None:
+            files = filter_files(sort_files(list_files(folder), sort,
+                                            reverse),
+                                 name_filter=name_filter)
+        else:
+            files = folder_index.list_files(folder, sort=sort,
+                                            reverse=reverse,
+                                            name_filter=name_filter)
+
+        if 'page' in params or 'page_size' in params:
+            return page_of(files,
+                           int(params.get('page', 1)),
+                           int(params.get('page_size', 100)))
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest,
+                             explanation=str(e)) from e
+
+    return files
+
+
+def invalidate_folder_index(request, *paths):
+    '''
+        Let our folder index know that we have modified the given paths
+        of our persistent folders.
+    '''
+    folder_index = request.registry.settings.get('folder_index')
+
+    if folder_index is not None:
+        folder_index.invalidate(*paths)
+
+
 def activate_uploaded(request):
     '''
         This view is intended to activate a file that has already been
@@ -445,12 +702,14 @@ def activate_uploaded(request):
     log.info('File size: {}'.format(size))
 
     if size >= get_free_space(session_dir):
-        # basically we need to make a copy of the file to activate it.
+        # we link to the file if we can, but we may need to make a copy
+        # of the file to activate it.
         raise cors_response(request,
                             HTTPInsufficientStorage('Not enough space '
                                                     'to activate the file'))
 
-    write_to_file(src_path, dest_path)
+    transfer_file(src_path, dest_path, link=True,
+                  stats=get_transfer_stats(request))
 
     log.info('Successfully activated file "{0}"'.format(dest_path))
 
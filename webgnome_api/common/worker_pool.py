@@ -0,0 +1,335 @@
+"""
+    A pool of warm worker processes for our long running jobs, like GOODS
+    subsets, that we don't want to run in the server process.
+
+    We used to start a new process for every job.  Each one had to get
+    its libraries going again, and a burst of requests could start any
+    number of them at once.  Instead, we keep a fixed number of worker
+    processes, which run one job after another.  Jobs wait in a bounded
+    queue, and are served round-robin by session, so that a session with
+    many jobs can't hold up everybody else's.
+
+    A job is run in a worker as func(*args, conn), where conn is the
+    worker's end of a duplex Pipe.  The job uses it to talk to the thread
+    in the server that leased the worker.  When the job is done, the
+    worker sends ('job_done', job_id) and waits for its next job.
+"""
+import logging
+import multiprocessing
+from uuid import uuid4
+from threading import Lock, Condition
+from collections import OrderedDict, deque
+
+log = logging.getLogger(__name__)
+
+
+class WorkerPoolFull(Exception):
+    '''
+        There is no room in the queue for another job.
+    '''
+    pass
+
+
+def worker_main(conn):
+    '''
+        The main loop of a worker process.  A job of None stops it.
+    '''
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+
+        if job is None:
+            return
+
+        job_id, func, args = job
+
+        try:
+            func(*args, conn)
+        except Exception as e:
+            log.exception(f'Job {job_id} failed')
+            conn.send(('error', repr(e)))
+
+        conn.send(('job_done', job_id))
+
+
+class Worker(object):
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+
+        self.process = multiprocessing.Process(target=worker_main,
+                                               args=(child_conn,),
+                                               daemon=True)
+        self.process.start()
+
+        child_conn.close()
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def run(self, job):
+        self.conn.send((job.job_id, job.func, job.args))
+
+    def drain(self, job_id, timeout):
+        '''
+            Read what is left of a job's messages, until the worker tells
+            us it is done.  Returns False if it is not done within timeout
+            seconds.
+        '''
+        try:
+            while self.conn.poll(timeout):
+                msg = self.conn.recv()
+
+                if isinstance(msg, tuple) and msg == ('job_done', job_id):
+                    return True
+        except (EOFError, OSError):
+            pass
+
+        return False
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+
+        self.process.join(5)
+        self.conn.close()
+
+
+class PoolJob(object):
+    def __init__(self, session_id, func, args):
+        self.job_id = uuid4().hex
+        self.session_id = session_id
+        self.func = func
+        self.args = args
+
+        self.worker = None  # the worker running the job
+        self.cancelled = False
+        self.done = False
+
+
+class WorkerPool(object):
+    '''
+        :param num_workers: The number of worker processes.
+        :param max_queued: The most jobs waiting for a worker.
+        :param max_session_queued: The most jobs of a session waiting for
+                                   a worker.
+        :param drain_timeout: How long to wait for a worker to finish a
+                              job we have stopped following, before we
+                              replace it.
+
+        The worker processes are started on the first job, or with start().
+        Worker processes are only ever started, or waited for, without our
+        lock held, so a slow fork doesn't hold up the server threads that
+        are queueing or following jobs.
+    '''
+    def __init__(self, num_workers=2, max_queued=32, max_session_queued=4,
+                 drain_timeout=10.0):
+        self.num_workers = num_workers
+        self.max_queued = max_queued
+        self.max_session_queued = max_session_queued
+        self.drain_timeout = drain_timeout
+
+        self._lock = Lock()
+        self._cond = Condition(self._lock)
+        self._workers = []
+        self._idle = []
+        self._starting = 0  # the workers being started
+        self._queues = OrderedDict()  # session id -> deque of jobs
+
+    @property
+    def num_queued(self):
+        return sum([len(q) for q in self._queues.values()])
+
+    def start(self):
+        '''
+            Start new workers until we have num_workers of them, and give
+            them to the waiting jobs.
+        '''
+        while True:
+            with self._lock:
+                missing = (self.num_workers - len(self._workers) -
+                           self._starting)
+
+                if missing <= 0:
+                    return
+
+                self._starting += missing
+
+            new_workers = []
+
+            try:
+                for _i in range(missing):
+                    new_workers.append(Worker())
+            finally:
+                with self._lock:
+                    self._starting -= missing
+                    self._workers.extend(new_workers)
+                    self._idle.extend(new_workers)
+                    self._dispatch()
+
+    def stop(self):
+        with self._lock:
+            workers = self._workers
+
+            self._workers = []
+            self._idle = []
+
+        for worker in workers:
+            worker.stop()
+
+    def submit(self, session_id, func, args=()):
+        '''
+            Queue a job for the next available worker.
+
+            :raises WorkerPoolFull: If the queue, or the session's share
+                                    of it, is full.
+        '''
+        job = PoolJob(session_id, func, args)
+
+        with self._lock:
+            session_queue = self._queues.get(session_id, ())
+
+            if self.num_queued >= self.max_queued:
+                raise WorkerPoolFull(f'{self.num_queued} jobs are already '
+                                     'waiting for a worker')
+
+            if len(session_queue) >= self.max_session_queued:
+                raise WorkerPoolFull(f'{len(session_queue)} jobs of this '
+                                     'session are already waiting for a '
+                                     'worker')
+
+            self._queues.setdefault(session_id, deque()).append(job)
+            self._dispatch()
+
+        self.start()
+
+        return job
+
+    def wait(self, job, timeout=None):
+        '''
+            Wait up to timeout seconds for a job to get its worker.
+            Returns the worker, or None if the job is still waiting, or
+            was cancelled while it was waiting.
+
+            Whoever gets the worker must release() it, even if the job is
+            cancelled afterwards.
+        '''
+        with self._cond:
+            if job.worker is None and not job.cancelled:
+                self._cond.wait(timeout)
+
+            return job.worker
+
+    def position(self, job):
+        '''
+            The number of jobs that will get a worker before this one,
+            or None if it is not waiting for one.
+        '''
+        with self._lock:
+            queues = list(self._queues.items())
+
+            for idx, (session_id, queue) in enumerate(queues):
+                if session_id != job.session_id:
+                    continue
+
+                if job not in queue:
+                    return None
+
+                # we are served round-robin, starting with the first
+                # session.
+                i = queue.index(job)
+
+                return (i +
+                        sum([min(len(q), i + 1) for _s, q in queues[:idx]]) +
+                        sum([min(len(q), i) for _s, q in queues[idx + 1:]]))
+
+            return None
+
+    def cancel(self, job):
+        '''
+            Take a job out of the queue, or stop its worker if it has one.
+        '''
+        with self._cond:
+            job.cancelled = True
+
+            queue = self._queues.get(job.session_id)
+
+            if queue is not None and job in queue:
+                queue.remove(job)
+
+                if not queue:
+                    del self._queues[job.session_id]
+
+            if job.worker is not None and not job.done:
+                log.info(f'Stopping the worker of job {job.job_id}')
+                job.worker.process.terminate()
+
+            self._cond.notify_all()
+
+    def release(self, worker, job):
+        '''
+            Give a job's worker back to the pool.  If the worker doesn't
+            finish the job in time, or has died, it is replaced by a new
+            one.
+        '''
+        done = worker.drain(job.job_id, self.drain_timeout)
+
+        if not done:
+            log.info(f'Replacing the worker of job {job.job_id}')
+            worker.stop()
+
+        with self._lock:
+            job.done = True
+
+            if done:
+                self._idle.append(worker)
+            else:
+                self._remove(worker)
+
+            self._dispatch()
+
+        self.start()
+
+    def _remove(self, worker):
+        '''
+            Forget a worker that we can't use anymore.  start() replaces
+            it.  Must be called with our lock held.
+        '''
+        self._workers = [w for w in self._workers if w is not worker]
+        self._idle = [w for w in self._idle if w is not worker]
+
+    def _dispatch(self):
+        '''
+            Give our idle workers to the waiting jobs, one session at a
+            time.  Must be called with our lock held.
+        '''
+        while self._idle and self._queues:
+            worker = self._idle.pop()
+
+            if not worker.is_alive():
+                # it has already exited, so stopping it doesn't wait.
+                # It is replaced by the next start().
+                worker.stop()
+                self._remove(worker)
+                continue
+
+            session_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+
+            if queue:
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+
+            job.worker = worker
+            worker.run(job)
+
+        self._cond.notify_all()
+
+    def to_dict(self):
+        with self._lock:
+            return {'num_workers': len(self._workers),
+                    'idle_workers': len(self._idle),
+                    'queued': self.num_queued,
+                    'sessions_queued': len(self._queues)}
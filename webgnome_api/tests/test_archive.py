@@ -0,0 +1,69 @@
+"""
+Tests of the archive writer for our export zipfiles
+"""
+import os
+import shutil
+import zipfile
+import tempfile
+from unittest import TestCase, mock
+
+from webgnome_api.common import archive
+from webgnome_api.common.archive import write_archive
+
+
+class WriteArchiveTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.contents = {
+            'spills.json': b'{"spill": 1}\n' * 10000,
+            'empty.txt': b'',
+            'mixed.csv': os.urandom(1000) + b'1,2,3\n' * 50000,
+            'currents.nc': os.urandom(5000),
+        }
+        self.members = []
+
+        for name, data in self.contents.items():
+            path = os.path.join(self.tmp_dir, name)
+
+            with open(path, 'wb') as fd:
+                fd.write(data)
+
+            self.members.append((path, name))
+
+        self.zip_path = os.path.join(self.tmp_dir, 'output.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def check_archive(self):
+        with zipfile.ZipFile(self.zip_path) as zf:
+            assert zf.testzip() is None
+            assert zf.namelist() == [name for _path, name in self.members]
+
+            for name, data in self.contents.items():
+                assert zf.read(name) == data
+
+            assert (zf.getinfo('currents.nc').compress_type ==
+                    zipfile.ZIP_STORED)
+            assert (zf.getinfo('spills.json').compress_type ==
+                    zipfile.ZIP_DEFLATED)
+
+    def test_parallel(self):
+        # a small chunk size, so members are deflated in many pieces
+        write_archive(self.zip_path, self.members, max_workers=4,
+                      chunk_size=4096)
+
+        self.check_archive()
+
+    def test_serial(self):
+        write_archive(self.zip_path, self.members, max_workers=1)
+
+        self.check_archive()
+
+    def test_without_zipfile_internals(self):
+        with mock.patch.object(archive, '_can_write_deflated',
+                               return_value=False):
+            write_archive(self.zip_path, self.members, max_workers=4)
+
+        self.check_archive()
@@ -0,0 +1,233 @@
+"""
+Functional tests for the resumable, chunked upload API
+"""
+import io
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+from unittest import TestCase, mock
+
+from webgnome_api.common.chunked_upload import (ChunkedUpload,
+                                                InsufficientSpace,
+                                                list_uploads,
+                                                remove_stale_uploads,
+                                                remove_stale_session_uploads,
+                                                upload_dir_name)
+
+from .base import FunctionalTestBase
+
+
+class ChunkedUploadTest(FunctionalTestBase):
+    '''
+        Tests out the chunked upload API
+    '''
+    data = os.urandom(2500)
+
+    def start_upload(self, **params):
+        params.setdefault('filename', 'test_upload.nc')
+        params.setdefault('size', len(self.data))
+
+        resp = self.testapp.post_json('/chunked_upload', params=params)
+
+        assert resp.json_body['offset'] == 0
+
+        return resp.json_body['upload_id']
+
+    def append(self, upload_id, offset, chunk, status=200, **headers):
+        return self.testapp.put(f'/chunked_upload/{upload_id}'
+                                f'?offset={offset}',
+                                params=chunk,
+                                headers=dict(headers, **{
+                                    'Content-Type': 'application/octet-stream'
+                                }),
+                                status=status)
+
+    def test_upload(self):
+        upload_id = self.start_upload(
+            sha256=hashlib.sha256(self.data).hexdigest()
+        )
+
+        for offset in range(0, len(self.data), 1000):
+            chunk = self.data[offset:offset + 1000]
+            resp = self.append(upload_id, offset, chunk,
+                               **{'X-Chunk-SHA256':
+                                  hashlib.sha256(chunk).hexdigest()})
+
+            assert resp.json_body['offset'] == offset + len(chunk)
+
+        resp = self.testapp.post(f'/chunked_upload/{upload_id}/commit')
+        file_path, file_name = resp.json_body
+
+        assert file_name == 'test_upload.nc'
+
+        with open(file_path, 'rb') as fd:
+            assert fd.read() == self.data
+
+        self.testapp.get(f'/chunked_upload/{upload_id}', status=404)
+
+    def test_resume(self):
+        upload_id = self.start_upload()
+
+        self.append(upload_id, 0, self.data[:1000])
+
+        # a chunk that doesn't match its checksum is not kept
+        self.append(upload_id, 1000, self.data[1000:2000], status=400,
+                    **{'X-Chunk-SHA256': '0' * 64})
+
+        # a chunk at the wrong offset tells us where to resume
+        resp = self.append(upload_id, 2000, self.data[2000:], status=409)
+        assert resp.json_body['offset'] == 1000
+
+        resp = self.testapp.get(f'/chunked_upload/{upload_id}')
+        assert resp.json_body['offset'] == 1000
+
+        # we can't commit an incomplete upload
+        self.testapp.post(f'/chunked_upload/{upload_id}/commit', status=400)
+
+        self.append(upload_id, 1000, self.data[1000:])
+        self.testapp.post(f'/chunked_upload/{upload_id}/commit')
+
+    def test_too_big(self):
+        max_upload_size = eval(self.settings['max_upload_size'])
+
+        self.testapp.post_json('/chunked_upload',
+                               params={'filename': 'test_upload.nc',
+                                       'size': max_upload_size + 1},
+                               status=400)
+
+        # chunks can't go past the declared size
+        upload_id = self.start_upload()
+
+        self.append(upload_id, 0, self.data + b'extra', status=400)
+
+    def test_too_many_uploads(self):
+        upload_ids = [self.start_upload() for _i in range(4)]
+
+        self.testapp.post_json('/chunked_upload',
+                               params={'filename': 'test_upload.nc',
+                                       'size': len(self.data)},
+                               status=429)
+
+        # a finished or abandoned upload makes room for another
+        self.testapp.delete(f'/chunked_upload/{upload_ids[0]}')
+        self.start_upload()
+
+    def test_bad_upload_id(self):
+        self.testapp.get('/chunked_upload/bogus', status=404)
+        self.testapp.get('/chunked_upload/' + '0' * 32, status=404)
+
+    def test_stored_upload(self):
+        data = os.urandom(2500)
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        upload_id = self.start_upload(sha256=sha256)
+        self.append(upload_id, 0, data)
+        resp = self.testapp.post(f'/chunked_upload/{upload_id}/commit')
+        first_path, _file_name = resp.json_body
+
+        # the same file, sent again, is shared with the stored one once
+        # we have received and hashed it.
+        upload_id = self.start_upload(sha256=sha256)
+        self.append(upload_id, 0, data)
+        resp = self.testapp.post(f'/chunked_upload/{upload_id}/commit')
+        file_path, file_name = resp.json_body
+
+        assert file_name == 'test_upload.nc'
+        assert file_path != first_path
+        assert os.path.samefile(file_path, first_path)
+
+    def test_sha256_grants_nothing(self):
+        data = os.urandom(2500)
+        sha256 = hashlib.sha256(data).hexdigest()
+
+        upload_id = self.start_upload(sha256=sha256)
+        self.append(upload_id, 0, data)
+        resp = self.testapp.post(f'/chunked_upload/{upload_id}/commit')
+        stored_path, _file_name = resp.json_body
+
+        # Knowing the hash of a stored file doesn't get us the file, or
+        # tell us that it is stored.  We have to send all of its bytes.
+        resp = self.testapp.post_json('/chunked_upload',
+                                      params={'filename': 'stolen.nc',
+                                              'size': len(data),
+                                              'sha256': sha256})
+
+        assert resp.json_body['offset'] == 0
+        assert 'file' not in resp.json_body
+
+        upload_id = resp.json_body['upload_id']
+
+        # and bytes that don't match the hash don't get us the file either
+        self.append(upload_id, 0, os.urandom(len(data)))
+        self.testapp.post(f'/chunked_upload/{upload_id}/commit', status=400)
+
+        session_dir = os.path.dirname(stored_path)
+
+        for f in os.listdir(session_dir):
+            path = os.path.join(session_dir, f)
+
+            if os.path.isfile(path) and path != stored_path:
+                assert not os.path.samefile(path, stored_path)
+
+
+class UploadLimitTest(TestCase):
+    '''
+        Tests of the limits on the uploads in progress
+    '''
+    data = os.urandom(2500)
+
+    def setUp(self):
+        self.session_dir = tempfile.mkdtemp()
+        self.upload_dir = os.path.join(self.session_dir, 'session_1',
+                                       upload_dir_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.session_dir, ignore_errors=True)
+
+    def start_upload(self):
+        return ChunkedUpload.create(self.upload_dir, 'test_upload.nc',
+                                    len(self.data))
+
+    def test_free_space(self):
+        upload = self.start_upload()
+        upload.append(io.BytesIO(self.data[:1000]), 0, length=1000)
+
+        # the space is checked as the chunks arrive, whether or not we
+        # know how big they are.
+        with mock.patch('webgnome_api.common.chunked_upload.get_free_space',
+                        return_value=1000):
+            for length in (1000, None):
+                with self.assertRaises(InsufficientSpace):
+                    upload.append(io.BytesIO(self.data[1000:2000]), 1000,
+                                  length=length)
+
+                assert upload.offset == 1000
+
+        upload.append(io.BytesIO(self.data[1000:]), 1000)
+        assert upload.remaining == 0
+
+    def test_remove_stale(self):
+        stale = self.start_upload()
+        fresh = self.start_upload()
+
+        old = time.time() - 120
+
+        for path in (stale.part_path, stale.state_path):
+            os.utime(path, (old, old))
+
+        assert remove_stale_uploads(self.upload_dir, 60) == 1
+
+        assert [u.upload_id for u in list_uploads(self.upload_dir)] == [
+            fresh.upload_id
+        ]
+        assert not stale.exists()
+        assert not os.path.exists(stale.part_path)
+
+        # and across all the sessions
+        for path in (fresh.part_path, fresh.state_path):
+            os.utime(path, (old, old))
+
+        assert remove_stale_session_uploads(self.session_dir, 60) == 1
+        assert list_uploads(self.upload_dir) == []
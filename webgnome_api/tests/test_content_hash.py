@@ -0,0 +1,64 @@
+"""
+Tests of the content hashes that key our caches of model exports and
+saved model files
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from webgnome_api.common.common_object import ObjectContentHash
+
+
+class FakeModel(object):
+    '''
+        Just enough of a Gnome object to be hashed
+    '''
+    def __init__(self, obj_id, filename):
+        self.obj_id = obj_id
+        self.filename = filename
+
+    def serialize(self, options=None):
+        return {'obj_type': 'gnome.model.Model',
+                'id': self.obj_id,
+                'movers': [{'obj_type': 'gnome.movers.PyCurrentMover',
+                            'id': self.obj_id + '-mover',
+                            'filename': self.filename}]}
+
+
+class ContentHashTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        self.session_a = os.path.join(self.tmp_dir, 'a')
+        self.session_b = os.path.join(self.tmp_dir, 'b')
+
+        for d in (self.session_a, self.session_b):
+            os.mkdir(d)
+            self.write(os.path.join(d, 'currents.nc'), b'current data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, path, data):
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+    def test_same_data_in_two_sessions(self):
+        model_a = FakeModel('1', os.path.join(self.session_a, 'currents.nc'))
+        model_b = FakeModel('2', os.path.join(self.session_b, 'currents.nc'))
+
+        assert (ObjectContentHash(model_a, by_file_content=True) ==
+                ObjectContentHash(model_b, by_file_content=True))
+
+    def test_replaced_data_file(self):
+        filename = os.path.join(self.session_a, 'currents.nc')
+        model = FakeModel('1', filename)
+
+        before = ObjectContentHash(model, by_file_content=True)
+
+        # the same path, but new contents, must not hit the cache
+        os.remove(filename)
+        self.write(filename, b'other current data')
+
+        assert ObjectContentHash(model, by_file_content=True) != before
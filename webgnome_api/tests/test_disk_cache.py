@@ -0,0 +1,56 @@
+"""
+Tests of our on-disk file cache
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from webgnome_api.common.disk_cache import DiskCache
+
+
+class DiskCacheTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = DiskCache(os.path.join(self.tmp_dir, 'cache'), 100)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+        return path
+
+    def test_put_links(self):
+        path = self.write('export.zip', b'x' * 60)
+        key = self.cache.make_key('export', 1)
+
+        cached_path = self.cache.put(key, path)
+
+        # the file isn't written twice
+        assert os.path.samefile(path, cached_path)
+        assert self.cache.size == 60
+
+        os.remove(path)
+        dest_path = os.path.join(self.tmp_dir, 'fetched.zip')
+
+        assert self.cache.fetch(key, dest_path)
+
+        with open(dest_path, 'rb') as fd:
+            assert fd.read() == b'x' * 60
+
+    def test_put_evicts(self):
+        first = self.cache.make_key('export', 1)
+        second = self.cache.make_key('export', 2)
+
+        self.cache.put(first, self.write('first.zip', b'x' * 60))
+        self.cache.put(second, self.write('second.zip', b'y' * 60))
+
+        assert first not in self.cache
+        assert second in self.cache
+
+        assert self.cache.put(first, self.write('big.zip', b'z' * 200)) is None
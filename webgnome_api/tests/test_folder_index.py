@@ -0,0 +1,157 @@
+"""
+Tests of the index of our persistent upload folders, and the folder
+listings we make with it
+"""
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from pyramid import testing
+from pyramid.httpexceptions import HTTPBadRequest
+
+from webgnome_api.common.folder_index import FolderIndex, page_of
+from webgnome_api.common.views import list_folder
+
+
+class FolderTestBase(TestCase):
+    files = (('b.nc', 300), ('a.txt', 100), ('C.json', 200),
+             ('.hidden', 10))
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+        for name, size in self.files:
+            self.write(name, size)
+
+        os.mkdir(os.path.join(self.folder, 'sub'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def write(self, name, size):
+        with open(os.path.join(self.folder, name), 'wb') as fd:
+            fd.write(b'x' * size)
+
+
+class FolderIndexTest(FolderTestBase):
+    def setUp(self):
+        super().setUp()
+        self.index = FolderIndex()
+
+    def names(self, **kwargs):
+        return [f['name'] for f in self.index.list_files(self.folder,
+                                                         **kwargs)]
+
+    def test_sort(self):
+        assert self.names() == ['C.json', 'a.txt', 'b.nc', 'sub']
+        assert self.names(reverse=True) == ['sub', 'b.nc', 'a.txt', 'C.json']
+
+        assert self.names(sort='type') == ['sub', 'C.json', 'a.txt', 'b.nc']
+
+        sizes = [f['size'] for f in self.index.list_files(self.folder,
+                                                          sort='size')]
+        assert sizes == sorted(sizes)
+
+        with self.assertRaises(ValueError):
+            self.index.list_files(self.folder, sort='mtime')
+
+    def test_filter(self):
+        assert self.names(name_filter='N') == ['C.json', 'b.nc']
+        assert self.names(name_filter='nothing') == []
+
+        assert '.hidden' in self.names(show_hidden=True)
+
+    def test_missing_folder(self):
+        with self.assertRaises(OSError):
+            self.index.list_files(os.path.join(self.folder, 'missing'))
+
+        with self.assertRaises(OSError):
+            self.index.list_files(os.path.join(self.folder, 'a.txt'))
+
+    def test_cached(self):
+        listing = self.index.get_listing(self.folder)
+
+        assert self.index.get_listing(self.folder) is listing
+
+    def test_invalidate_after_delete(self):
+        self.names()
+
+        path = os.path.join(self.folder, 'a.txt')
+        os.remove(path)
+        self.index.invalidate(path)
+
+        assert self.names() == ['C.json', 'b.nc', 'sub']
+
+    def test_invalidate_after_rename(self):
+        self.names()
+
+        old_path = os.path.join(self.folder, 'a.txt')
+        new_path = os.path.join(self.folder, 'sub', 'z.txt')
+        os.rename(old_path, new_path)
+        self.index.invalidate(old_path, new_path)
+
+        assert self.names() == ['C.json', 'b.nc', 'sub']
+        assert ([f['name'] for f in
+                 self.index.list_files(os.path.join(self.folder, 'sub'))] ==
+                ['z.txt'])
+
+    def test_max_folders(self):
+        index = FolderIndex(max_folders=1)
+
+        index.get_listing(self.folder)
+        index.get_listing(os.path.join(self.folder, 'sub'))
+
+        assert len(index) == 1
+
+    def test_page_of(self):
+        files = [{'name': str(i)} for i in range(25)]
+
+        page = page_of(files, 3, 10)
+
+        assert [f['name'] for f in page['files']] == [str(i)
+                                                     for i in range(20, 25)]
+        assert page['num_pages'] == 3
+        assert page['total'] == 25
+
+        assert page_of(files, 4, 10)['files'] == []
+        assert page_of([], 1, 10)['num_pages'] == 0
+
+        for page, page_size in ((0, 10), (1, 0), (-1, 10)):
+            with self.assertRaises(ValueError):
+                page_of(files, page, page_size)
+
+
+class ListFolderTest(FolderTestBase):
+    '''
+        Tests of the listing parameters, with and without a folder index.
+    '''
+    def tearDown(self):
+        testing.tearDown()
+        super().tearDown()
+
+    def list_folder(self, folder_index, **params):
+        config = testing.setUp(settings={'folder_index': folder_index})
+        request = testing.DummyRequest(params=params)
+        request.registry = config.registry
+
+        return list_folder(request, self.folder)
+
+    def test_same_listing(self):
+        for params in ({},
+                       {'sort': 'size', 'order': 'desc'},
+                       {'filter': 'N'},
+                       {'sort': 'type', 'page': '2', 'page_size': '2'}):
+            assert (self.list_folder(FolderIndex(), **params) ==
+                    self.list_folder(None, **params))
+
+    def test_bad_params(self):
+        for params in ({'page': '0'},
+                       {'page': 'x'},
+                       {'page_size': '0'},
+                       {'page_size': '-5'},
+                       {'sort': 'mtime'},
+                       {'order': 'up'}):
+            for folder_index in (FolderIndex(), None):
+                with self.assertRaises(HTTPBadRequest):
+                    self.list_folder(folder_index, **params)
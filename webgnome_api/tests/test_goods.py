@@ -7,9 +7,16 @@ We really need more tests!
 
 """
 # we're using Unittest Tests, so the pytest-mock fixtures don't work right
-from unittest import mock
+import os
+import shutil
+import tempfile
+from unittest import mock, TestCase
 from pathlib import Path
 
+from webgnome_api.common.disk_cache import DiskCache
+from webgnome_api.views import goods
+from webgnome_api.views.goods import snap_bounds, snap_time
+
 from .base import FunctionalTestBase, MODELS_DIR
 
 import pytest
@@ -305,6 +312,197 @@ model_id=GFS
         assert meta['actual_end']
 
 
+class SnapTest(TestCase):
+    """
+    Tests of the snapping of subsets, so nearly the same subsets can share
+    a GOODS cache entry
+    """
+    def test_snap_bounds(self):
+        bounds = snap_bounds(-70.44, 41.03, -69.51, 41.97, 0.1)
+
+        assert bounds == ((-70.5, 41.0), (-70.5, 42.0),
+                          (-69.5, 42.0), (-69.5, 41.0))
+
+        # already snapped bounds stay as they are
+        assert snap_bounds(-70.5, 41.0, -69.5, 42.0, 0.1) == bounds
+
+    def test_snap_bounds_off(self):
+        assert (snap_bounds(-70.44, 41.03, -69.51, 41.97, 0) ==
+                ((-70.44, 41.03), (-70.44, 41.97),
+                 (-69.51, 41.97), (-69.51, 41.03)))
+
+    def test_snap_bounds_clamped(self):
+        (w, s), _nw, (e, n), _se = snap_bounds(-179.97, -89.97,
+                                               179.97, 89.97, 0.25)
+        assert (w, s, e, n) == (-180.0, -90.0, 180.0, 90.0)
+
+        (w, s), _nw, (e, n), _se = snap_bounds(0.03, 10.0, 359.97, 20.0,
+                                               0.25, cross_dateline=True)
+        assert (w, e) == (0.0, 360.0)
+
+    def test_snap_time(self):
+        assert snap_time('2026-03-18T16:20:00') == '2026-03-18T16:00:00'
+        assert (snap_time('2026-03-18T16:20:00', floor=False) ==
+                '2026-03-18T17:00:00')
+        assert (snap_time('2026-03-18T23:59:59', floor=False) ==
+                '2026-03-19T00:00:00')
+
+        # on the hour, or not a time, stays as it is
+        assert (snap_time('2026-03-18T16:00:00', floor=False) ==
+                '2026-03-18T16:00:00')
+        assert snap_time('yesterday') == 'yesterday'
+
+
+class GOODSCacheTest(TestCase):
+    """
+    Tests of the GOODS subset cache paths of create_goods_request(), with
+    the session, the worker pool and libgoods mocked out
+    """
+    params = {'WestLon': '-70.44',
+              'SouthLat': '41.03',
+              'EastLon': '-69.51',
+              'NorthLat': '41.97',
+              'cross_dateline': '0',
+              'request_type': 'surface currents',
+              'include_winds': 'false',
+              'model_id': 'CBOFS',
+              'start_time': '2026-03-18T16:20:00',
+              'end_time': '2026-03-20T16:20:00'}
+
+    metadata = {'is_netcdf': True,
+                'time_range': ['2026-03-18T16:00:00', '2026-03-20T17:00:00'],
+                'grid_type': 'sgrid',
+                'bbox': [-70.5, 41.0, -69.5, 42.0]}
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.session_dir = os.path.join(self.tmp_dir, 'session')
+        os.mkdir(self.session_dir)
+
+        self.goods_cache = DiskCache(os.path.join(self.tmp_dir, 'cache'),
+                                     1024 * 1024)
+
+        self.patches = [
+            mock.patch.object(goods, 'libgoods', create=True),
+            mock.patch.object(goods, 'get_session_dir',
+                              return_value=self.session_dir),
+            mock.patch.object(goods, 'get_session_objects', return_value={}),
+            mock.patch.object(goods, 'register_exportable_file'),
+            mock.patch.object(goods, 'get_netcdf_metadata',
+                              return_value=self.metadata),
+            mock.patch.object(goods.GOODSRequest, 'start'),
+        ]
+
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_request(self, goods_cache, snap='0.1', **params):
+        request = mock.Mock()
+        request.POST = dict(self.params, **params)
+        request.registry.settings = {'max_upload_size': '1024 * 1024',
+                                     'max_goods_request_size': '1024 * 1024',
+                                     'goods_cache': goods_cache,
+                                     'goods_pool': mock.Mock()}
+        request.session.session_id = 'test-session'
+
+        if snap is not None:
+            request.registry.settings['goods_cache.snap'] = snap
+
+        return request
+
+    def retrieve(self, goods_req):
+        """
+        What the worker does with a subset we didn't have: write it, and
+        add it to our cache.
+        """
+        with open(goods_req.outpath, 'wb') as fd:
+            fd.write(b'subset')
+
+        goods_req.cache_subset()
+
+    def test_no_cache(self):
+        goods_req = goods.create_goods_request(self.make_request(None))
+
+        # without a cache, we ask for exactly what we were asked for
+        args = goods_req.request_args
+        assert args['bounds'] == ((-70.44, 41.03), (-70.44, 41.97),
+                                  (-69.51, 41.97), (-69.51, 41.03))
+        assert args['start'] == '2026-03-18T16:20:00'
+        assert args['end'] == '2026-03-20T16:20:00'
+
+        assert goods_req.cache_key is None
+        goods.GOODSRequest.start.assert_called_once()
+
+    def test_cache_without_snap(self):
+        for snap in (None, '0'):
+            goods_req = goods.create_goods_request(
+                self.make_request(self.goods_cache, snap=snap)
+            )
+
+            # the subset is cached, but not widened
+            args = goods_req.request_args
+            assert args['bounds'] == ((-70.44, 41.03), (-70.44, 41.97),
+                                      (-69.51, 41.97), (-69.51, 41.03))
+            assert args['start'] == '2026-03-18T16:20:00'
+            assert args['end'] == '2026-03-20T16:20:00'
+
+            assert goods_req.cache_key is not None
+
+    def test_cache_hit(self):
+        goods_req = goods.create_goods_request(
+            self.make_request(self.goods_cache)
+        )
+
+        assert goods_req.request_args['bounds'][0] == (-70.5, 41.0)
+        assert goods_req.request_args['start'] == '2026-03-18T16:00:00'
+        goods.GOODSRequest.start.assert_called_once()
+
+        self.retrieve(goods_req)
+
+        # nearly the same subset is served from our cache
+        cached_req = goods.create_goods_request(
+            self.make_request(self.goods_cache, WestLon='-70.41',
+                              end_time='2026-03-20T16:50:00')
+        )
+
+        goods.GOODSRequest.start.assert_called_once()
+
+        assert cached_req.cache_key == goods_req.cache_key
+        assert cached_req.from_cache
+        assert cached_req.state == 'finished'
+        assert cached_req.outpath != goods_req.outpath
+
+        with open(cached_req.outpath, 'rb') as fd:
+            assert fd.read() == b'subset'
+
+    def test_cache_bad_entry(self):
+        goods_req = goods.create_goods_request(
+            self.make_request(self.goods_cache)
+        )
+        self.retrieve(goods_req)
+
+        assert goods_req.cache_key in self.goods_cache
+
+        # the cached subset turns out not to be usable, so it is dropped,
+        # and we go get the subset after all.
+        with mock.patch.object(goods, 'get_netcdf_metadata',
+                               return_value=None):
+            bad_req = goods.create_goods_request(
+                self.make_request(self.goods_cache)
+            )
+
+        assert goods.GOODSRequest.start.call_count == 2
+        assert not bad_req.from_cache
+        assert bad_req.state == 'preparing'
+        assert goods_req.cache_key not in self.goods_cache
+        assert not os.path.exists(bad_req.outpath)
+
 
 MOCK_MAP = \
 """"Map Bounds", "2", 4
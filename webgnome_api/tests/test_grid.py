@@ -0,0 +1,57 @@
+"""
+Tests of the level-of-detail grid lines and nodes
+"""
+from unittest import TestCase
+
+import numpy as np
+
+from webgnome_api.common.blob_cache import BlobCache
+from webgnome_api.common.geometry import clip_points
+from webgnome_api.views.grid import get_lines_level, get_nodes_level
+
+
+class FakeGrid(object):
+    def __init__(self, nodes, lines=()):
+        self.nodes = np.asarray(nodes, dtype=np.float64).reshape(-1, 2)
+        self.faces = None
+        self.lines = [np.asarray(l, dtype=np.float64) for l in lines]
+
+    def get_nodes(self):
+        return self.nodes
+
+    def get_lines(self):
+        return (np.array([len(l) for l in self.lines], dtype=np.int32),
+                self.lines)
+
+
+class GridLevelTest(TestCase):
+    def setUp(self):
+        self.cache = BlobCache(1024 * 1024)
+
+        lon, lat = np.meshgrid(np.linspace(-72.0, -71.0, 11),
+                               np.linspace(41.0, 42.0, 11))
+        self.grid = FakeGrid(np.column_stack((lon.ravel(), lat.ravel())))
+
+    def test_nodes_indices(self):
+        indices, nodes = get_nodes_level(self.cache, self.grid, None)
+
+        assert indices.dtype == np.dtype('<u4')
+        assert np.array_equal(indices, np.arange(len(self.grid.nodes)))
+
+        indices, nodes = get_nodes_level(self.cache, self.grid, 2)
+
+        assert 0 < len(indices) < len(self.grid.nodes)
+        assert np.allclose(nodes, self.grid.nodes[indices])
+
+        # clipping keeps the indices of the nodes in the full grid
+        kept, clipped = clip_points(nodes, (-71.5, 41.5, -71.0, 42.0))
+
+        assert len(clipped) > 0
+        assert np.allclose(clipped, self.grid.nodes[indices[kept]])
+
+    def test_no_lines(self):
+        for level in (None, 5):
+            lengths, coords = get_lines_level(self.cache, self.grid, level)
+
+            assert len(lengths) == 0
+            assert coords.shape == (0, 2)
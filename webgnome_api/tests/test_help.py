@@ -0,0 +1,48 @@
+"""
+Functional tests for the Help Documentation Web API
+"""
+from .base import FunctionalTestBase
+
+
+class HelpTest(FunctionalTestBase):
+    '''
+        Tests out the help documentation API
+    '''
+    def test_get_all(self):
+        resp = self.testapp.get('/help')
+
+        assert len(resp.json_body) > 0
+
+        for h in resp.json_body:
+            assert 'path' in h
+            assert 'html' in h
+            assert 'keywords' in h
+
+            assert 'locations' not in h['path']
+
+    def test_get_file(self):
+        resp = self.testapp.get('/help/views/form/water')
+
+        assert resp.json_body['path'].endswith('water')
+        assert len(resp.json_body['html']) > 0
+
+    def test_get_dir(self):
+        resp = self.testapp.get('/help/views/form/spill')
+
+        assert resp.json_body['path'].endswith('spill')
+        assert len(resp.json_body['html']) > 0
+
+    def test_get_invalid(self):
+        self.testapp.get('/help/bogus', status=404)
+
+    def test_search(self):
+        resp = self.testapp.get('/help/search', params={'q': 'salin'})
+
+        assert len(resp.json_body) > 0
+        assert resp.json_body[0]['path'].endswith('water')
+
+        scores = [r['score'] for r in resp.json_body]
+        assert scores == sorted(scores, reverse=True)
+
+    def test_search_no_query(self):
+        self.testapp.get('/help/search', status=400)
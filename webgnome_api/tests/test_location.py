@@ -1,7 +1,75 @@
 """
 Functional tests for the Gnome Location object Web API
 """
-from .base import FunctionalTestBase
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import ujson
+
+from gnome.model import Model
+
+from webgnome_api.common.common_object import ObjectContentHash
+from webgnome_api.common.location_cache import (LocationIndex,
+                                                LocationModelCache)
+
+from .base import GnomeTestCase, FunctionalTestBase
+
+
+class LocationIndexTest(TestCase):
+    '''
+        Tests that the location index copes with a missing locations dir.
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.locations_dir = os.path.join(self.tmp_dir, 'location_files')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def add_location(self, name):
+        path = os.path.join(self.locations_dir, name)
+        os.makedirs(path)
+
+        with open(os.path.join(path, 'compiled.json'), 'w') as f:
+            ujson.dump({'name': name,
+                        'geometry': {'coordinates': [-72.0, 41.0]},
+                        'steps': []}, f)
+
+    def test_missing_locations_dir(self):
+        index = LocationIndex(self.locations_dir, refresh_interval=0.0)
+
+        assert index.get('somewhere') is None
+        assert ujson.loads(index.feature_collection)['features'] == []
+
+        self.add_location('somewhere')
+
+        assert index.get('somewhere') is not None
+        assert len(ujson.loads(index.feature_collection)['features']) == 1
+
+
+class LocationModelCacheTest(GnomeTestCase):
+    '''
+        Tests that a location model copied from its cached template is the
+        model we would have loaded.
+    '''
+    def test_cached_model_is_loaded_model(self):
+        settings = self.get_settings()
+        index = LocationIndex(settings['locations_dir'])
+
+        _content, location_file = index.get('central-long-island-sound-ny')
+
+        cache = LocationModelCache()
+        model1 = cache.get_model(location_file)
+        model2 = cache.get_model(location_file)
+
+        assert cache.get_template(location_file) is not None
+        assert model1 is not model2
+
+        loaded = Model.load(location_file)
+        assert ObjectContentHash(model1) == ObjectContentHash(loaded)
+        assert ObjectContentHash(model2) == ObjectContentHash(loaded)
 
 
 class LocationTest(FunctionalTestBase):
@@ -25,6 +93,15 @@ class LocationTest(FunctionalTestBase):
             assert 'slug' in f['properties']
             assert 'content' in f['properties']
 
+    def test_get_no_id_is_indexed(self):
+        resp1 = self.testapp.get('/location')
+        resp2 = self.testapp.get('/location')
+
+        assert resp1.body == resp2.body
+
+        slugs = [f['properties']['slug'] for f in resp1.json_body['features']]
+        assert 'central-long-island-sound-ny' in slugs
+
     def test_get_invalid_id(self):
         self.testapp.get('/location/bogus', status=404)
 
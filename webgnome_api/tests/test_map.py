@@ -130,6 +130,34 @@ class MapTestBase(FunctionalTestBase):
         error: Error -3 while decompressing data: invalid stored block lengths
         '''
 
+        # But we can ask for it uncompressed
+        resp2 = self.testapp.get('/map/{0}/raster'.format(obj_id),
+                                 params={'codec': 'raw'})
+
+        assert resp2.headers['codec'] == 'raw'
+        assert resp2.headers['Content-Encoding'] == 'identity'
+        assert len(resp2.body) > 0
+
+        self.testapp.get('/map/{0}/raster'.format(obj_id),
+                         params={'codec': 'bogus'}, status=400)
+
+    def test_get_raster_tile(self):
+        self.setup_map_file()
+        resp1 = self.testapp.post_json('/map', params=self.req_data)
+        obj_id = resp1.json_body['id']
+
+        resp2 = self.testapp.get('/map/{0}/raster/1/0/0'.format(obj_id),
+                                 params={'codec': 'raw', 'tile_size': 128})
+
+        window = [int(w) for w in resp2.headers['window'].split(',')]
+        assert window[:2] == [0, 0]
+        num_pixels = (window[2] - window[0]) * (window[3] - window[1])
+        assert len(resp2.body) > 0
+        assert len(resp2.body) % num_pixels == 0
+
+        self.testapp.get('/map/{0}/raster/1/1000/1000'.format(obj_id),
+                         params={'codec': 'raw'}, status=400)
+
     def perform_updates(self, json_obj):
         '''
             We can overload this function when subclassing our tests
@@ -313,6 +341,44 @@ class MapGeoJsonTest(FunctionalTestBase):
                     assert False
 """
 
+class MapGeoJsonLevelsTest(FunctionalTestBase):
+    '''
+        Tests out the simplified and quantized map GeoJSON
+    '''
+    req_data = {'obj_type': 'gnome.maps.map.MapFromBNA',
+                'filename': 'Test.bna',
+                'refloat_halflife': 1.0
+                }
+
+    def test_simplified(self):
+        self.setup_map_file()
+        resp = self.testapp.post_json('/map', params=self.req_data)
+        map1 = resp.json_body
+
+        full = self.testapp.get('/map/{0}/geojson'.format(map1['id']))
+        simple = self.testapp.get('/map/{0}/geojson'.format(map1['id']),
+                                  params={'zoom': 2})
+
+        assert simple.json_body['type'] == 'FeatureCollection'
+        assert len(simple.body) <= len(full.body)
+
+    def test_quantized(self):
+        self.setup_map_file()
+        resp = self.testapp.post_json('/map', params=self.req_data)
+        map1 = resp.json_body
+
+        resp = self.testapp.get('/map/{0}/geojson'.format(map1['id']),
+                                params={'format': 'quantized'})
+        geo_json = resp.json_body
+
+        assert geo_json['type'] == 'FeatureCollection'
+        assert len(geo_json['transform']['scale']) == 2
+        assert len(geo_json['transform']['translate']) == 2
+
+        self.testapp.get('/map/{0}/geojson'.format(map1['id']),
+                         params={'format': 'bogus'}, status=400)
+
+
 class ParamMapTest(FunctionalTestBase):
     '''
         Tests out the Gnome Map object API
@@ -1,8 +1,21 @@
 """
 Functional tests for the Mover Web API
 """
+import os
 import time
+import shutil
+import hashlib
+import tempfile
+from unittest import TestCase
+
 import pytest
+import numpy as np
+from netCDF4 import Dataset
+
+from pyramid import testing
+
+from webgnome_api.views.mover import normalize_lon, shift_lon_time
+
 from .base import FunctionalTestBase, MODELS_DIR
 
 
@@ -526,6 +539,15 @@ class CurrentInfoTests(FunctionalTestBase):
         for r in current_info:
             assert len(r) == 6  # each row contains 3 flattened coordinates
 
+        # step 3: the same grid in binary form
+        resp = self.testapp.get('/mover/{0}/{1}'.format(mover_id, 'grid'),
+                                params={'codec': 'raw'},
+                                headers={'Accept':
+                                         'application/octet-stream'})
+
+        assert resp.headers['shape'] == str((len(current_info), 6))
+        assert len(resp.body) == len(current_info) * 6 * 4
+
     def test_get_wrong_mover(self):
         '''
             Test the attempt to get a current grid from a mover that is
@@ -887,6 +909,86 @@ class PyMoverTests(FunctionalTestBase):
             assert resp2.json_body[a] == resp1.json_body[a]
 
 
+class NormalizeLonTests(TestCase):
+    '''
+        Tests of which uploaded files get their longitudes normalized
+    '''
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+        config = testing.setUp(settings={})
+        self.request = testing.DummyRequest()
+        self.request.registry = config.registry
+
+    def tearDown(self):
+        testing.tearDown()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write_file(self, name, variables):
+        '''
+            Write a NetCDF file of 1-D (dimension, values) variables.
+        '''
+        path = os.path.join(self.tmp_dir, name)
+
+        with Dataset(path, 'w') as nc:
+            for var_name, (dim, values) in variables.items():
+                if dim not in nc.dimensions:
+                    nc.createDimension(dim, len(values))
+
+                nc.createVariable(var_name, 'f8', (dim,))[:] = values
+
+        return path
+
+    def digest(self, path):
+        with open(path, 'rb') as fd:
+            return hashlib.sha256(fd.read()).hexdigest()
+
+    def test_rectilinear_unchanged(self):
+        # a global GFS or HYCOM style grid, which is 0-360 on purpose
+        path = self.write_file('global.nc',
+                               {'lon': ('lon', np.arange(0.0, 360.0, 10.0)),
+                                'lat': ('lat', np.arange(-80.0, 90.0, 10.0))})
+        digest = self.digest(path)
+
+        for is_py_mover in (True, False):
+            assert normalize_lon(self.request, [path], is_py_mover) is None
+
+        assert self.digest(path) == digest
+        assert os.listdir(self.tmp_dir) == ['global.nc']
+
+    def test_fvcom(self):
+        lon = np.array([280.0, 281.0, 282.0])
+        path = self.write_file('fvcom.nc',
+                               {'lon': ('node', lon),
+                                'lat': ('node', [40.0, 41.0, 42.0]),
+                                'lonc': ('nele', lon[:2] + 0.5),
+                                'latc': ('nele', [40.5, 41.5])})
+
+        grid_file = normalize_lon(self.request, [path], True)
+
+        with Dataset(grid_file) as nc:
+            assert np.allclose(nc.variables['lon'][:], lon - 360)
+            assert np.allclose(nc.variables['lonc'][:], lon[:2] - 359.5)
+
+        normalize_lon(self.request, [path], False)
+
+        with Dataset(path) as nc:
+            assert np.allclose(nc.variables['lon'][:], lon - 360)
+
+    def test_shift_keeps_shared_file(self):
+        # a file that doesn't need shifting is not copied, even when it is
+        # shared.
+        path = self.write_file('global.nc',
+                               {'lon': ('lon', np.arange(0.0, 360.0, 10.0)),
+                                'lat': ('lat', np.arange(-80.0, 90.0, 10.0))})
+        link_path = os.path.join(self.tmp_dir, 'shared.nc')
+        os.link(path, link_path)
+
+        shift_lon_time(path)
+
+        assert os.path.samefile(path, link_path)
+
+
 # class UploadMoverTests(FunctionalTestBase):
 #     '''
 #         Tests out the API for uploading a mover
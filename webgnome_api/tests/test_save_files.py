@@ -0,0 +1,136 @@
+"""
+Tests of the checks and upgrade of model save files as they are ingested
+"""
+import os
+import stat
+import shutil
+import zipfile
+import tempfile
+from unittest import TestCase
+
+import ujson
+
+from webgnome_api.common.save_files import SaveFileError, ingest_save_file
+
+
+class IngestSaveFileTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.zip_path = os.path.join(self.tmp_dir, 'model.gnome')
+        self.extract_dir = os.path.join(self.tmp_dir, 'model')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def make_save_file(self, members):
+        '''
+            Write a save file of (name or ZipInfo, data) members.
+        '''
+        with zipfile.ZipFile(self.zip_path, 'w',
+                             zipfile.ZIP_DEFLATED) as zf:
+            for name, data in members:
+                zf.writestr(name, data)
+
+    def ingest(self, max_total_size=1024 * 1024):
+        return ingest_save_file(self.zip_path, self.extract_dir,
+                                max_item_size=64 * 1024,
+                                max_compress_ratio=54,
+                                max_total_size=max_total_size)
+
+    def assert_rejected(self, members, **kwargs):
+        self.make_save_file(members)
+
+        with self.assertRaises(SaveFileError):
+            self.ingest(**kwargs)
+
+        # nothing is left behind, inside or outside of our folder
+        assert not os.path.exists(self.extract_dir)
+        assert sorted(os.listdir(self.tmp_dir)) == ['model.gnome']
+
+    def test_parent_path(self):
+        self.assert_rejected([('Model.json', b'{}'), ('../x', b'evil')])
+
+    def test_nested_parent_path(self):
+        self.assert_rejected([('data/../../x', b'evil')])
+
+    def test_absolute_path(self):
+        self.assert_rejected([('/tmp/x', b'evil')])
+
+    def test_drive_path(self):
+        self.assert_rejected([('C:x', b'evil')])
+        self.assert_rejected([('C:\\x', b'evil')])
+
+    def test_symlink(self):
+        link = zipfile.ZipInfo('link')
+        link.external_attr = (stat.S_IFLNK | 0o777) << 16
+
+        self.assert_rejected([('Model.json', b'{}'), (link, '/etc/passwd')])
+
+    def test_zip_bomb(self):
+        self.assert_rejected([('data.nc', b'\0' * (16 * 1024 * 1024))],
+                             max_total_size=64 * 1024 * 1024)
+
+    def test_too_big_json(self):
+        self.assert_rejected([('Model.json',
+                               ujson.dumps({'name': 'x' * 100 * 1024}))])
+
+    def test_over_total_size(self):
+        # no member is too big on its own, but together they are.
+        members = [(f'data_{i}.nc', os.urandom(40 * 1024))
+                   for i in range(4)]
+
+        self.assert_rejected(members, max_total_size=100 * 1024)
+
+    def test_extract(self):
+        data = os.urandom(100 * 1024)
+
+        self.make_save_file([('version.txt', b'1'),
+                             ('Model.json', b'{"obj_type": "x"}'),
+                             ('data/currents.nc', data)])
+
+        model_dir = self.ingest()
+
+        with open(os.path.join(model_dir, 'data', 'currents.nc'),
+                  'rb') as fd:
+            assert fd.read() == data
+
+    def test_current_version_unchanged(self):
+        # objects that a version 0 file would have upgraded are written
+        # byte for byte as they were, wherever version.txt is.
+        spill = b'{"obj_type":  "gnome.spills.spill.Spill",\n "id": "1"}'
+        element_type = (b'{"obj_type": "gnome.spills.elements.element_type.'
+                        b'ElementType", "substance": "oil"}')
+
+        for order in ((0, 1, 2), (1, 2, 0)):
+            members = [('version.txt', b'1\n'),
+                       ('Spill0.json', spill),
+                       ('ElementType0.json', element_type)]
+
+            self.make_save_file([members[i] for i in order])
+            model_dir = self.ingest()
+
+            for name, data in members[1:]:
+                with open(os.path.join(model_dir, name), 'rb') as fd:
+                    assert fd.read() == data
+
+            shutil.rmtree(self.extract_dir)
+
+    def test_upgrade_version_0(self):
+        self.make_save_file([
+            ('Spill0.json',
+             ujson.dumps({'obj_type': 'gnome.spills.spill.Spill',
+                          'element_type': 'ElementType0.json'})),
+            ('ElementType0.json',
+             ujson.dumps({'obj_type': ('gnome.spills.elements.'
+                                       'element_type.ElementType')})),
+        ])
+
+        model_dir = self.ingest()
+
+        with open(os.path.join(model_dir, 'Spill0.json')) as fd:
+            spill = ujson.load(fd)
+
+        assert 'element_type' not in spill
+        assert spill['substance'] == 'NonWeatheringSubstance.json'
+        assert os.path.isfile(os.path.join(model_dir,
+                                           'NonWeatheringSubstance.json'))
@@ -0,0 +1,106 @@
+"""
+Tests of our file transfers, and of persisting uploaded files with them
+"""
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from pyramid import testing
+
+from webgnome_api.common.system_resources import transfer_file
+from webgnome_api.common.views import process_upload
+
+
+class TransferTestBase(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as fd:
+            return fd.read()
+
+
+class TransferFileTest(TransferTestBase):
+    def test_link(self):
+        src = self.write('src.nc', b'some data')
+        dest = os.path.join(self.tmp_dir, 'dest.nc')
+
+        assert transfer_file(src, dest, link=True) == ('link', 0)
+        assert os.path.samefile(src, dest)
+
+    def test_link_replaces(self):
+        old_src = self.write('old.nc', b'old data')
+        new_src = self.write('new.nc', b'new data')
+        dest = os.path.join(self.tmp_dir, 'dest.nc')
+
+        transfer_file(old_src, dest, link=True)
+        transfer_file(new_src, dest, link=True)
+
+        assert os.path.samefile(new_src, dest)
+
+        # the file that shared the old contents is left alone
+        assert self.read(old_src) == b'old data'
+        assert sorted(os.listdir(self.tmp_dir)) == ['dest.nc', 'new.nc',
+                                                    'old.nc']
+
+
+class PersistUploadTest(TransferTestBase):
+    '''
+        Tests of persisting an upload to our persistent folder
+    '''
+    def setUp(self):
+        super().setUp()
+
+        self.session_dir = os.path.join(self.tmp_dir, 'session')
+        self.persistent_dir = os.path.join(self.tmp_dir, 'persistent')
+        os.mkdir(self.session_dir)
+        os.mkdir(self.persistent_dir)
+
+        self.config = testing.setUp(settings={
+            'max_upload_size': '1024 * 1024',
+            'can_persist_uploads': 'true',
+        })
+
+        for name, value in (('switch_to_existing_session', None),
+                            ('get_session_dir', self.session_dir),
+                            ('get_persistent_dir', self.persistent_dir)):
+            patcher = mock.patch(f'webgnome_api.common.views.{name}',
+                                 return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        testing.tearDown()
+        super().tearDown()
+
+    def upload(self, file_name, data):
+        field = mock.Mock(file=io.BytesIO(data), filename=file_name)
+
+        request = testing.DummyRequest(post={'new_file': field,
+                                             'persist_upload': 'true'})
+        request.registry = self.config.registry
+
+        return process_upload(request, 'new_file')
+
+    def test_persist_twice(self):
+        first_path, _file_name = self.upload('currents.nc', b'first')
+        second_path, file_name = self.upload('currents.nc', b'second')
+
+        persistent_path = os.path.join(self.persistent_dir, file_name)
+
+        assert self.read(persistent_path) == b'second'
+        assert self.read(first_path) == b'first'
+        assert self.read(second_path) == b'second'
@@ -0,0 +1,180 @@
+"""
+Tests of the content-addressed store of uploaded files
+"""
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+from unittest import TestCase
+
+from netCDF4 import Dataset
+from pyramid import testing
+
+from webgnome_api.common.views import store_upload
+from webgnome_api.common.upload_store import (UploadStore,
+                                              hash_file,
+                                              unshare_file,
+                                              used_suffix)
+
+
+class UploadStoreTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.session_dir = os.path.join(self.tmp_dir, 'session')
+        os.mkdir(self.session_dir)
+
+        self.store = UploadStore(os.path.join(self.tmp_dir, 'store'),
+                                 max_size=100, gc_delay=0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def upload(self, name, data):
+        '''
+            Write a session file, and add it to the store like an upload.
+        '''
+        path = os.path.join(self.session_dir, name)
+
+        with open(path, 'wb') as fd:
+            fd.write(data)
+
+        digest = hashlib.sha256(data).hexdigest()
+        self.store.add(path, digest)
+
+        return path, digest
+
+    def test_add(self):
+        path, digest = self.upload('a.nc', b'some data')
+
+        assert self.store.has(digest)
+        assert os.path.samefile(path, self.store.blob_path(digest))
+        assert os.stat(path).st_nlink == 2
+
+    def test_add_duplicate(self):
+        path_a, digest = self.upload('a.nc', b'some data')
+        path_b, _digest = self.upload('b.nc', b'some data')
+
+        # the second upload is replaced by a link to the first
+        assert os.path.samefile(path_a, path_b)
+        assert os.stat(path_a).st_nlink == 3
+
+        with open(path_b, 'rb') as fd:
+            assert fd.read() == b'some data'
+
+    def test_link_to(self):
+        _path, digest = self.upload('a.nc', b'some data')
+        dest = os.path.join(self.session_dir, 'linked.nc')
+
+        assert not self.store.link_to(digest, dest, size=3)
+        assert not self.store.link_to('0' * 64, dest)
+        assert not self.store.link_to('bogus', dest)
+        assert not os.path.exists(dest)
+
+        assert self.store.link_to(digest, dest, size=9)
+        assert os.path.samefile(dest, self.store.blob_path(digest))
+
+    def test_link_to_keeps_mtime(self):
+        path, digest = self.upload('a.nc', b'some data')
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        time.sleep(0.01)
+        self.store.link_to(digest, os.path.join(self.session_dir, 'b.nc'))
+
+        # using a blob must not touch the files linked to it.
+        assert os.stat(path).st_mtime_ns == mtime_ns
+        assert os.path.exists(self.store.blob_path(digest) + used_suffix)
+
+    def test_collect_garbage(self):
+        path_a, digest_a = self.upload('a.nc', b'a' * 60)
+        path_b, digest_b = self.upload('b.nc', b'b' * 60)
+        path_c, digest_c = self.upload('c.nc', b'c' * 60)
+
+        # a is used later than b, and c is still in a session
+        time.sleep(0.01)
+        self.store.link_to(digest_a, os.path.join(self.session_dir, 'a2.nc'))
+
+        for f in os.listdir(self.session_dir):
+            if f != 'c.nc':
+                os.remove(os.path.join(self.session_dir, f))
+
+        # only one of the 60 byte unreferenced blobs fits in our budget
+        assert self.store.collect_garbage() == 60
+
+        assert self.store.has(digest_a)
+        assert not self.store.has(digest_b)
+        assert self.store.has(digest_c)
+
+        assert not os.path.exists(self.store.blob_path(digest_b) +
+                                  used_suffix)
+
+    def test_collect_garbage_later(self):
+        path, digest = self.upload('a.nc', b'a' * 200)
+        os.remove(path)
+
+        self.store.collect_garbage_later()
+        timer = self.store._gc_timer
+
+        # more requests are served by the same collection
+        self.store.collect_garbage_later()
+        assert self.store._gc_timer is timer
+
+        timer.join(5)
+
+        assert not self.store.has(digest)
+        assert self.store._gc_timer is None
+
+    def test_unshare(self):
+        path, digest = self.upload('a.nc', b'some data')
+
+        unshare_file(path)
+
+        assert os.stat(path).st_nlink == 1
+        assert not os.path.samefile(path, self.store.blob_path(digest))
+
+        with open(path, 'r+b') as fd:
+            fd.write(b'SOME')
+
+        with open(self.store.blob_path(digest), 'rb') as fd:
+            assert fd.read() == b'some data'
+
+        # a private file is left as it is
+        inode = os.stat(path).st_ino
+        unshare_file(path)
+        assert os.stat(path).st_ino == inode
+
+    def test_store_upload_skips_fvcom(self):
+        config = testing.setUp(settings={'upload_store': self.store})
+        request = testing.DummyRequest()
+        request.registry = config.registry
+
+        try:
+            path = os.path.join(self.session_dir, 'fvcom.nc')
+
+            with Dataset(path, 'w') as nc:
+                nc.createDimension('node', 2)
+
+                for name, values in (('lon', [280.0, 281.0]),
+                                     ('lat', [40.0, 41.0]),
+                                     ('lonc', [280.5, 280.5])):
+                    nc.createVariable(name, 'f8', ('node',))[:] = values
+
+            # its longitudes may be shifted in place, so it isn't shared
+            digest = hash_file(path)
+            store_upload(request, path, digest)
+
+            assert not self.store.has(digest)
+            assert os.stat(path).st_nlink == 1
+
+            # any other file is
+            path = os.path.join(self.session_dir, 'a.txt')
+
+            with open(path, 'wb') as fd:
+                fd.write(b'some data')
+
+            digest = hash_file(path)
+            store_upload(request, path, digest)
+
+            assert self.store.has(digest)
+        finally:
+            testing.tearDown()
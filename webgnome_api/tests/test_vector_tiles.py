@@ -0,0 +1,105 @@
+"""
+Tests of the time sliced reading of gridded vector data
+"""
+from threading import Lock
+from unittest import TestCase
+
+import numpy as np
+
+from webgnome_api.common.blob_cache import BlobCache
+from webgnome_api.common.codecs import default_codec
+from webgnome_api.common.vector_tiles import (cached_vector_field,
+                                              iter_time_slices)
+
+
+class RecordedData(object):
+    '''
+        A data variable that records the time slices that are read from it
+    '''
+    def __init__(self, values):
+        self.values = values
+        self.shape = values.shape
+        self.read = []
+
+    def __getitem__(self, time_index):
+        self.read.append(time_index)
+        return self.values[time_index]
+
+
+class FakeVariable(object):
+    def __init__(self, values):
+        self.data = RecordedData(values)
+
+
+class FakeGrid(object):
+    def __init__(self, ny, nx):
+        lon, lat = np.meshgrid(np.linspace(-72.0, -71.0, nx),
+                               np.linspace(41.0, 42.0, ny))
+        self.node_lon = lon
+        self.node_lat = lat
+
+    def get_nodes(self):
+        return np.column_stack((self.node_lon.ravel(),
+                                self.node_lat.ravel()))
+
+    def get_centers(self):
+        return (self.get_nodes().reshape(self.node_lon.shape + (2,))
+                [1:, 1:].reshape(-1, 2))
+
+
+class FakeCurrent(object):
+    def __init__(self, num_times=4, ny=3, nx=5):
+        self.id = 'fake-current'
+        self.grid = FakeGrid(ny, nx)
+
+        shape = (num_times, ny, nx)
+        self.u = np.arange(np.prod(shape), dtype=np.float64).reshape(shape)
+        self.v = -self.u
+
+        self.variables = [FakeVariable(self.u), FakeVariable(self.v)]
+
+    def reads(self):
+        return [v.data.read for v in self.variables]
+
+
+class VectorSliceTest(TestCase):
+    def setUp(self):
+        self.cache = BlobCache(1024 * 1024)
+        self.obj = FakeCurrent()
+
+    def test_reads_one_slice_per_request(self):
+        field = cached_vector_field(self.cache, self.obj)
+
+        # only the first slice, to see where the vectors are.
+        assert self.obj.reads() == [[0], [0]]
+        assert field.data.shape == (4, 15, 2)
+
+        indices, values = field.tile(2, 0, 0, 0)
+
+        assert self.obj.reads() == [[0, 2], [0, 2]]
+        assert np.array_equal(values[:, 0], self.obj.u[2].ravel()[indices])
+        assert np.array_equal(values[:, 1], self.obj.v[2].ravel()[indices])
+
+        # the slice is cached now, for this and any other field of the
+        # same data.
+        field = cached_vector_field(self.cache, self.obj)
+        field.tile(2, 0, 0, 0)
+
+        assert self.obj.reads() == [[0, 2], [0, 2]]
+
+    def test_streamed_slices(self):
+        field = cached_vector_field(self.cache, self.obj)
+        lock = Lock()
+        chunks = iter_time_slices(field.data, slice(1, 3), default_codec,
+                                  lock)
+
+        # nothing is read until its chunk is generated, and the lock is
+        # only held while we read.
+        assert self.obj.reads() == [[0], [0]]
+
+        next(chunks)
+        assert self.obj.reads() == [[0, 1], [0, 1]]
+        assert not lock.locked()
+
+        next(chunks)
+        assert self.obj.reads() == [[0, 1, 2], [0, 1, 2]]
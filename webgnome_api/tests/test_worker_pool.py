@@ -0,0 +1,119 @@
+"""
+Tests of our pool of worker processes
+"""
+import time
+from unittest import TestCase
+
+from webgnome_api.common.worker_pool import WorkerPool
+
+
+def echo_job(value, conn):
+    conn.send(('echo', value))
+
+
+def sleep_job(seconds, conn):
+    time.sleep(seconds)
+
+
+class WorkerPoolTest(TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(num_workers=1, drain_timeout=0.2)
+        self.pool.start()
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def wait(self, job, timeout=10.0):
+        '''
+            Wait for a job to get its worker.
+        '''
+        end = time.time() + timeout
+
+        while time.time() < end:
+            worker = self.pool.wait(job, 0.1)
+
+            if worker is not None:
+                return worker
+
+        self.fail(f'job {job.job_id} got no worker')
+
+    def run_echo(self, value):
+        job = self.pool.submit('echo', echo_job, (value,))
+        worker = self.wait(job)
+
+        assert worker.conn.poll(10)
+        assert worker.conn.recv() == ('echo', value)
+
+        self.pool.release(worker, job)
+
+        return worker
+
+    def test_run(self):
+        worker = self.run_echo(1)
+
+        # the worker is kept for the next job
+        assert self.run_echo(2) is worker
+        assert self.pool.to_dict()['idle_workers'] == 1
+
+    def test_position(self):
+        running = self.pool.submit('a', sleep_job, (10,))
+        worker = self.wait(running)
+
+        a1 = self.pool.submit('a', echo_job, (1,))
+        a2 = self.pool.submit('a', echo_job, (2,))
+        b1 = self.pool.submit('b', echo_job, (3,))
+
+        # the sessions take turns
+        assert self.pool.position(a1) == 0
+        assert self.pool.position(b1) == 1
+        assert self.pool.position(a2) == 2
+        assert self.pool.position(running) is None
+
+        self.pool.cancel(running)
+        self.pool.release(worker, running)
+
+        for job in (a1, b1, a2):
+            worker = self.wait(job)
+            self.pool.release(worker, job)
+
+    def test_cancel_queued(self):
+        running = self.pool.submit('a', sleep_job, (10,))
+        worker = self.wait(running)
+
+        queued = self.pool.submit('b', echo_job, (1,))
+        self.pool.cancel(queued)
+
+        assert self.pool.position(queued) is None
+        assert self.pool.wait(queued, 0.1) is None
+        assert self.pool.to_dict()['queued'] == 0
+
+        self.pool.cancel(running)
+        self.pool.release(worker, running)
+
+        assert queued.worker is None
+
+    def test_cancel_running(self):
+        job = self.pool.submit('a', sleep_job, (10,))
+        worker = self.wait(job)
+
+        self.pool.cancel(job)
+        worker.process.join(5)
+        assert not worker.is_alive()
+
+        self.pool.release(worker, job)
+
+        # the worker is replaced, and the pool still runs jobs
+        assert self.run_echo(1) is not worker
+        assert self.pool.to_dict()['num_workers'] == 1
+
+    def test_replace_on_drain_timeout(self):
+        job = self.pool.submit('a', sleep_job, (10,))
+        worker = self.wait(job)
+
+        # we stop following the job without cancelling it, and it is
+        # still running when the drain times out.
+        self.pool.release(worker, job)
+
+        assert not worker.is_alive()
+        assert self.run_echo(1) is not worker
+        assert self.pool.to_dict()['num_workers'] == 1
@@ -0,0 +1,270 @@
+"""
+Views for the resumable, chunked upload of large data files.
+
+    POST   /chunked_upload                   start an upload
+                                             {filename, size[, sha256]}
+                                             The sha256, if given, is
+                                             checked when the upload is
+                                             committed.
+    GET    /chunked_upload/<upload_id>       get the offset of an upload
+    PUT    /chunked_upload/<upload_id>?offset=N
+                                             append a chunk.  The body is
+                                             the raw bytes of the chunk,
+                                             with an optional X-Chunk-SHA256
+                                             header.
+    POST   /chunked_upload/<upload_id>/commit
+                                             finish an upload
+    DELETE /chunked_upload/<upload_id>       abandon an upload
+"""
+import os
+import logging
+
+import ujson
+
+from pyramid.response import Response
+from pyramid.httpexceptions import (HTTPNotFound,
+                                    HTTPConflict,
+                                    HTTPBadRequest,
+                                    HTTPTooManyRequests,
+                                    HTTPInsufficientStorage)
+
+from cornice import Service
+
+from webgnome_api.common.chunked_upload import (ChunkedUpload,
+                                                UploadError,
+                                                OffsetMismatch,
+                                                InsufficientSpace,
+                                                get_max_upload_age,
+                                                list_uploads,
+                                                remove_stale_uploads,
+                                                upload_dir_name)
+from webgnome_api.common.common_object import get_session_dir
+from webgnome_api.common.system_resources import get_free_space
+from webgnome_api.common.session_management import get_session_objects
+from webgnome_api.common.views import (cors_exception,
+                                       cors_policy,
+                                       cors_response,
+                                       gen_unique_filename,
+                                       store_upload)
+
+log = logging.getLogger(__name__)
+
+chunked_upload_policy = cors_policy.copy()
+chunked_upload_policy['headers'] = (cors_policy['headers'] +
+                                    ('X-Chunk-SHA256',))
+
+chunked_upload = Service(name='chunked_upload', path='/chunked_upload*obj_id',
+                         description="Resumable Chunked File Upload API",
+                         cors_policy=chunked_upload_policy)
+
+
+def get_upload_dir(request):
+    return os.path.join(get_session_dir(request), upload_dir_name)
+
+
+def get_uploads(request):
+    '''
+        The uploads of our session that this process has seen, by id.
+        Keeping them around saves us from rehashing their part files.
+    '''
+    objects = get_session_objects(request)
+
+    return objects.setdefault('chunked_uploads', {})
+
+
+def get_upload(request):
+    '''
+        Get the upload that our request is for, loading it from its state
+        file if we haven't seen it yet.
+    '''
+    obj_id = request.matchdict['obj_id']
+
+    if len(obj_id) == 0:
+        raise cors_exception(request, HTTPNotFound)
+
+    uploads = get_uploads(request)
+    upload_id = obj_id[0]
+    upload = uploads.get(upload_id)
+
+    if upload is not None and not upload.exists():
+        # it was abandoned, and removed
+        del uploads[upload_id]
+        upload = None
+
+    if upload is None:
+        upload = ChunkedUpload.load(get_upload_dir(request), upload_id)
+
+        if upload is None:
+            raise cors_exception(request, HTTPNotFound,
+                                 explanation=f'No upload {upload_id}')
+
+        upload = uploads.setdefault(upload_id, upload)
+
+    return upload
+
+
+@chunked_upload.get()
+def get_upload_status(request):
+    '''
+        Returns the offset of an upload, so a client can resume it.
+    '''
+    return get_upload(request).to_dict()
+
+
+@chunked_upload.post()
+def start_or_commit_upload(request):
+    obj_id = request.matchdict['obj_id']
+
+    if len(obj_id) == 0:
+        return start_upload(request)
+    elif len(obj_id) == 2 and obj_id[1] == 'commit':
+        return commit_upload(request)
+    else:
+        raise cors_exception(request, HTTPNotFound)
+
+
+def start_upload(request):
+    '''
+        Start an upload.  We check the declared size of the file against
+        our upload limit up front, and against our free space, less what
+        the session's other uploads still need.  A session can only have
+        a few uploads in progress, so it can't start any number of them
+        that each fit on their own.  The free space is checked again as
+        the chunks arrive.
+    '''
+    log_prefix = f'req({id(request)}): start_upload():'
+    log.info(f'>> {log_prefix}')
+
+    try:
+        params = ujson.loads(request.body)
+        filename = str(params['filename'])
+        size = int(params['size'])
+        sha256 = params.get('sha256')
+        sha256 = None if sha256 is None else str(sha256)
+    except Exception:
+        raise cors_exception(request, HTTPBadRequest,
+                             explanation='filename and size are required')
+
+    settings = request.registry.settings
+    max_upload_size = eval(settings['max_upload_size'])
+    max_uploads = int(settings.get('chunked_upload.max_uploads', 4))
+    upload_dir = get_upload_dir(request)
+
+    if size > max_upload_size:
+        raise cors_response(request, HTTPBadRequest(
+            f'file is too big!  Max size = {max_upload_size}'
+        ))
+
+    remove_stale_uploads(upload_dir, get_max_upload_age(settings))
+    in_progress = list_uploads(upload_dir)
+
+    if len(in_progress) >= max_uploads:
+        raise cors_response(request, HTTPTooManyRequests(
+            f'{len(in_progress)} uploads are already in progress'
+        ))
+
+    needed = size + sum([u.remaining for u in in_progress])
+
+    if needed >= get_free_space(get_session_dir(request)):
+        raise cors_response(request, HTTPInsufficientStorage(
+            'Not enough space to save the file'
+        ))
+
+    try:
+        upload = ChunkedUpload.create(upload_dir, filename, size, sha256)
+    except UploadError as e:
+        raise cors_exception(request, HTTPBadRequest, explanation=str(e))
+
+    get_uploads(request)[upload.upload_id] = upload
+
+    log.info(f'<< {log_prefix} {upload.upload_id}: {filename}, {size} bytes')
+
+    return upload.to_dict()
+
+
+@chunked_upload.put()
+def append_chunk(request):
+    '''
+        Append a chunk to an upload.  The chunk is streamed from the
+        request body straight into the upload's part file, and can't go
+        past the declared size of the file, which is within our upload
+        limit.  If we don't have the space for it anymore, we respond with
+        a 507 Insufficient Storage.
+
+        A chunk at the wrong offset gets a 409 Conflict with the upload's
+        offset, so the client can resume from there.
+    '''
+    upload = get_upload(request)
+
+    try:
+        offset = int(request.GET['offset'])
+    except (KeyError, ValueError):
+        raise cors_exception(request, HTTPBadRequest,
+                             explanation='offset is required')
+
+    try:
+        new_offset = upload.append(request.body_file, offset,
+                                   length=request.content_length,
+                                   chunk_sha256=request.headers.get(
+                                       'X-Chunk-SHA256'
+                                   ))
+    except OffsetMismatch as e:
+        raise cors_response(request, HTTPConflict(
+            json_body=dict(upload.to_dict(), error=str(e)),
+            content_type='application/json'
+        ))
+    except InsufficientSpace as e:
+        raise cors_response(request, HTTPInsufficientStorage(str(e)))
+    except UploadError as e:
+        raise cors_exception(request, HTTPBadRequest, explanation=str(e))
+
+    return {'upload_id': upload.upload_id,
+            'size': upload.size,
+            'offset': new_offset}
+
+
+def commit_upload(request):
+    '''
+        Finish an upload, moving the file into our session folder.
+        Like our other uploads, we respond with the path of the file and
+        its original name.
+
+        The file is then added to the upload store, which replaces it with
+        a link to the stored copy if we already have the same file.  We
+        only do this with the hash of the bytes we were actually sent,
+        never with a hash that the client claims, or anyone could link any
+        stored file into their session by its hash.
+    '''
+    log_prefix = f'req({id(request)}): commit_upload():'
+    log.info(f'>> {log_prefix}')
+
+    upload = get_upload(request)
+    session_dir = os.path.relpath(get_session_dir(request))
+
+    file_name, unique_name = gen_unique_filename(upload.filename, session_dir)
+    file_path = os.path.join(session_dir, unique_name)
+
+    try:
+        digest = upload.commit(file_path)
+    except UploadError as e:
+        raise cors_exception(request, HTTPBadRequest, explanation=str(e))
+
+    get_uploads(request).pop(upload.upload_id, None)
+    store_upload(request, file_path, digest)
+
+    log.info(f'<< {log_prefix} "{file_path}", sha256: {digest}')
+
+    return cors_response(request, Response(ujson.dumps([file_path,
+                                                        file_name])))
+
+
+@chunked_upload.delete()
+def abandon_upload(request):
+    upload = get_upload(request)
+
+    with upload.lock:
+        upload.remove()
+
+    get_uploads(request).pop(upload.upload_id, None)
+
+    return {'upload_id': upload.upload_id}
@@ -24,6 +24,14 @@ def get_diagnostic_info(request):
             '         <p>'
             f'{get_server_environmental_info(request)}'
             '         </p>'
+            '         <h2>File Transfers</h2>'
+            '         <p>'
+            f'{get_file_transfer_info(request)}'
+            '         </p>'
+            '         <h2>GOODS Subset Workers</h2>'
+            '         <p>'
+            f'{get_goods_pool_info(request)}'
+            '         </p>'
             '    </body>'
             '</html>'
             )
@@ -40,6 +48,28 @@ def get_server_environmental_info(request):
     return to_table(['Key', 'Value'], request.environ.items())
 
 
+def get_file_transfer_info(request):
+    """
+    Get the counts of our file transfers, and the bytes they copied
+    """
+    transfer_stats = request.registry.settings.get('transfer_stats')
+    stats = {} if transfer_stats is None else transfer_stats.to_dict()
+
+    return to_table(['Method', 'Transfers', 'Bytes Copied'],
+                    [(m, s['transfers'], s['bytes_copied'])
+                     for m, s in sorted(stats.items())])
+
+
+def get_goods_pool_info(request):
+    """
+    Get the state of our GOODS subset workers, and their queue
+    """
+    goods_pool = request.registry.settings.get('goods_pool')
+    info = {} if goods_pool is None else goods_pool.to_dict()
+
+    return to_table(['Key', 'Value'], info.items())
+
+
 def to_table(header_items, row_items):
     header = to_table_row(header_items, header=True)
     rows = ''.join([to_table_row(r) for r in row_items])
@@ -4,14 +4,15 @@ This currently includes Wind and Tide objects.
 """
 import ujson
 import logging
-import zlib
 import numpy as np
 from threading import current_thread
 
 from pyramid.settings import asbool
 from pyramid.response import Response
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPNotFound, HTTPNotImplemented
+from pyramid.httpexceptions import (HTTPNotFound,
+                                    HTTPNotImplemented,
+                                    HTTPBadRequest)
 
 from cornice import Service
 
@@ -26,10 +27,19 @@ from webgnome_api.common.views import (get_object,
                                        process_upload,
                                        can_persist,
                                        switch_to_existing_session,
-                                       activate_uploaded)
+                                       activate_uploaded,
+                                       get_tile_request,
+                                       get_time_range,
+                                       time_sliced_response,
+                                       get_codec,
+                                       cors_array_response,
+                                       cors_array_stream_response)
 
 from webgnome_api.common.session_management import (get_session_object,
                                                     acquire_session_lock)
+from webgnome_api.common.blob_cache import grid_signature
+from webgnome_api.common.vector_tiles import (cached_tile,
+                                              cached_vector_field)
 
 log = logging.getLogger(__name__)
 
@@ -65,13 +75,24 @@ def get_environment(request):
         route = content_requested[1] if len(content_requested) > 1 else None
 
         if route == 'grid':
-            resp.body = get_grid(request)
-            return cors_response(request, resp)
+            codec = get_codec(request)
+            return cors_array_response(request, get_grid(request, codec),
+                                       codec)
         if route == 'vectors':
-            resp.body, dshape = get_vector_data(request)
-            resp.headers.add('Access-Control-Expose-Headers', 'shape')
-            resp.headers.add('shape', str(dshape))
-            return cors_response(request, resp)
+            time_range = get_time_range(request)
+
+            if time_range is not None:
+                return get_vector_slices(request, time_range)
+
+            codec = get_codec(request)
+            vec_data = get_vector_data(request)
+            return cors_array_stream_response(request, [vec_data], codec,
+                                              {'shape': vec_data.shape})
+        if route == 'tiles':
+            codec = get_codec(request)
+            body, dshape = get_vector_tile(request, codec)
+            return cors_array_response(request, body, codec,
+                                       {'shape': dshape})
         if route == 'nodes':
             resp.body = get_nodes(request)
             return cors_response(request, resp)
@@ -150,7 +171,7 @@ def activate_environment(request):
     return cors_response(request, resp)
 
 
-def get_grid(request):
+def get_grid(request, codec):
     '''
         Outputs the object's grid cells in binary format
     '''
@@ -165,9 +186,15 @@ def get_grid(request):
         obj = get_session_object(obj_id, request)
 
         if obj is not None and isinstance(obj, (GridCurrent, GridWind)):
-            cells = obj.grid.get_cells()
+            def compress_cells():
+                cells = obj.grid.get_cells()
+                return codec.compress(cells.astype(np.float32)), None
 
-            return zlib.compress(cells.astype(np.float32).tobytes())
+            grid_cache = request.registry.settings['grid_cache']
+
+            return grid_cache.get_or_create(grid_signature(obj.grid) +
+                                            ('cells', codec.name),
+                                            compress_cells)[0]
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -193,7 +220,7 @@ def get_vector_data(request):
         if obj is not None and isinstance(obj, (GridCurrent, GridWind)):
             vec_data = obj.get_data_vectors()
 
-            return zlib.compress(vec_data.tobytes()), vec_data.shape
+            return vec_data
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -205,18 +232,29 @@ def get_vector_data(request):
     log.info('<<' + log_prefix)
 
 
-def get_metadata(request):
-    log_prefix = 'req({0}): get_current_info():'.format(id(request))
+def get_vector_tile(request, codec):
+    '''
+        Outputs the object's vector data within a map tile for a single
+        time slice, in binary format
+    '''
+    log_prefix = 'req({0}): get_vector_tile():'.format(id(request))
     log.info('>>' + log_prefix)
 
+    time_index, z, x, y = get_tile_request(request)
+
     session_lock = acquire_session_lock(request)
     log.info('  {} session lock acquired (sess:{}, thr_id: {})'
              .format(log_prefix, id(session_lock), current_thread().ident))
     try:
         obj_id = request.matchdict.get('obj_id')[0]
         obj = get_session_object(obj_id, request)
-        if obj is not None:
-            return obj.get_metadata()
+
+        if obj is not None and isinstance(obj, (GridCurrent, GridWind)):
+            try:
+                return cached_tile(request.registry.settings['grid_cache'],
+                                   obj, codec, time_index, z, x, y)
+            except ValueError as e:
+                raise cors_exception(request, HTTPBadRequest) from e
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -228,17 +266,59 @@ def get_metadata(request):
     log.info('<<' + log_prefix)
 
 
-def get_grid_signature(obj):
+def get_vector_slices(request, time_range):
     '''
-        Here we are trying to get an n-dimensional signature of our
-        grid data.
-        There may be a better way to do this, but for now we will get the
-        euclidian distances between all sequential points and sum them.
+        Streams the object's vector data for a range of times, one time
+        slice at a time
     '''
-    points = obj.get_points()
+    log_prefix = 'req({0}): get_vector_slices():'.format(id(request))
+    log.info('>>' + log_prefix)
 
-    dtype = points[0].dtype.descr
-    raw_points = points.view(dtype='<f8').reshape(-1, len(dtype))
-    point_diffs = raw_points[1:] - raw_points[:-1]
+    session_lock = acquire_session_lock(request)
+    log.info('  {} session lock acquired (sess:{}, thr_id: {})'
+             .format(log_prefix, id(session_lock), current_thread().ident))
+    try:
+        obj_id = request.matchdict.get('obj_id')[0]
+        obj = get_session_object(obj_id, request)
+
+        if obj is not None and isinstance(obj, (GridCurrent, GridWind)):
+            # Only the positions of the vectors are read here.  The time
+            # slices are read as they are streamed, after the session lock
+            # is released, taking the lock again for each read.
+            field = cached_vector_field(request.registry.settings['grid_cache'],
+                                        obj)
+        else:
+            exc = cors_exception(request, HTTPNotFound)
+            raise exc
+    finally:
+        session_lock.release()
+        log.info('  {} session lock released (sess:{}, thr_id: {})'
+                 .format(log_prefix, id(session_lock), current_thread().ident))
+
+    log.info('<<' + log_prefix)
+    return time_sliced_response(request, field.data, time_range,
+                                session_lock)
+
+
+def get_metadata(request):
+    log_prefix = 'req({0}): get_current_info():'.format(id(request))
+    log.info('>>' + log_prefix)
+
+    session_lock = acquire_session_lock(request)
+    log.info('  {} session lock acquired (sess:{}, thr_id: {})'
+             .format(log_prefix, id(session_lock), current_thread().ident))
+    try:
+        obj_id = request.matchdict.get('obj_id')[0]
+        obj = get_session_object(obj_id, request)
+        if obj is not None:
+            return obj.get_metadata()
+        else:
+            exc = cors_exception(request, HTTPNotFound)
+            raise exc
+    finally:
+        session_lock.release()
+        log.info('  {} session lock released (sess:{}, thr_id: {})'
+                 .format(log_prefix, id(session_lock), current_thread().ident))
+
+    log.info('<<' + log_prefix)
 
-    return abs(point_diffs.view(dtype=np.complex)).sum()
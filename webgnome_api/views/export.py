@@ -4,7 +4,6 @@ Views for file download operations.
 from os import walk
 from os.path import isfile, isdir, basename, join, sep
 import logging
-import zipfile
 
 from pyramid.view import view_config
 from pyramid.response import FileResponse
@@ -12,6 +11,7 @@ from pyramid.httpexceptions import HTTPNotFound
 
 from cornice import Service
 
+from webgnome_api.common.archive import write_archive, archive_settings
 from webgnome_api.common.common_object import get_session_dir
 from webgnome_api.common.session_management import get_active_model
 from webgnome_api.common.views import cors_policy, cors_response
@@ -48,16 +48,17 @@ def download_file(request):
         short_dirname = basename(output_path).split('.')[-1]
         output_zip_path = "{0}_{1}.zip".format(model_name, short_dirname)
         zip_path = join(output_path, output_zip_path)
-        zf = zipfile.ZipFile(zip_path, "w")
+        members = []
 
         for dirname, _subdirs, files in walk(output_path):
             for filename in files:
                 if (not filename.endswith(output_zip_path) and
                         not isdir(filename)):
                     zipfile_path = join(dirname, filename)
-                    zf.write(zipfile_path, basename(zipfile_path))
+                    members.append((zipfile_path, basename(zipfile_path)))
 
-        zf.close()
+        write_archive(zip_path, members,
+                      **archive_settings(request.registry.settings))
 
         response = FileResponse(zip_path, request)
         response.headers['Content-Disposition'] = ("attachment; filename={0}"
@@ -2,12 +2,12 @@
 Views for the GOODS interface.
 """
 import os
+import math
 import time
 import datetime
 import logging
 import threading
 import multiprocessing
-from multiprocessing import Process
 from uuid import uuid1
 
 import ujson
@@ -15,6 +15,7 @@ import ujson
 from cornice import Service
 
 from pyramid.httpexceptions import (HTTPInsufficientStorage,
+                                    HTTPServiceUnavailable,
                                     HTTPBadRequest,
                                     HTTPNotFound)
 
@@ -22,10 +23,13 @@ from webgnome_api.common.system_resources import get_free_space
 from webgnome_api.common.common_object import get_session_dir
 from webgnome_api.common.session_management import (get_session_objects,
                                                     register_exportable_file)
+from webgnome_api.common.worker_pool import WorkerPoolFull
 from webgnome_api.common.views import (cors_policy,
                                        cors_response,
+                                       cors_exception,
                                        HTTPPythonError,
-                                       gen_unique_filename)
+                                       gen_unique_filename,
+                                       get_netcdf_metadata)
 
 from webgnome_api import supported_ocean_models, supported_met_models
 
@@ -325,6 +329,17 @@ def create_goods_request(request):
     _file_name, unique_name = gen_unique_filename(fname, upload_dir)
     output_path = os.path.join(upload_dir, unique_name)
 
+    goods_cache = request.registry.settings.get('goods_cache')
+    snap = float(request.registry.settings.get('goods_cache.snap', 0))
+
+    if goods_cache is not None and snap > 0:
+        # We were told to widen subsets, so we request the snapped subset,
+        # which can serve anybody asking for nearly the same subset.
+        # Otherwise, we ask for exactly what we were asked for, which only
+        # the very same subset can share.
+        subset_bounds = snap_bounds(w, s, e, n, snap, cross_dateline)
+        start, end = snap_time(start, floor=True), snap_time(end, floor=False)
+
     session_objs = get_session_objects(request)
     request_id = str(uuid1())
     goods_req = GOODSRequest(
@@ -348,11 +363,76 @@ def create_goods_request(request):
     )
 
     session_objs[request_id] = goods_req
+
+    if goods_cache is not None:
+        goods_req.cache_key = goods_cache.make_key(
+            'goods_subset',
+            params['model_id'],
+            subset_bounds,
+            start,
+            end,
+            cross_dateline,
+            sorted(request_type if isinstance(request_type, list)
+                   else [request_type]),
+        )
+
+        if goods_cache.fetch(goods_req.cache_key, output_path):
+            if goods_req.finish(from_cache=True):
+                log.info(f'{log_prefix} subset found in our cache')
+                return goods_req
+
+            # a bad cache entry, so we go get the subset after all
+            goods_cache.remove(goods_req.cache_key)
+            os.remove(output_path)
+
     goods_req.start()
 
+    if goods_req.error_type == 'queue_full':
+        del session_objs[request_id]
+        raise cors_exception(request, HTTPServiceUnavailable,
+                             explanation=goods_req.message)
+
     return goods_req
 
 
+def snap_bounds(w, s, e, n, snap, cross_dateline=False):
+    '''
+        Snap the edges of a subset outward to a multiple of snap degrees,
+        and return it as the polygon that libgoods wants.
+
+        Snapping never takes an edge past the range of the coordinates:
+        -90-90 for latitudes, and -180-180 for longitudes, or 0-360 for a
+        subset that crosses the dateline.
+    '''
+    min_lon, max_lon = (0.0, 360.0) if cross_dateline else (-180.0, 180.0)
+
+    if snap > 0:
+        w = round(max(math.floor(w / snap) * snap, min_lon), 6)
+        s = round(max(math.floor(s / snap) * snap, -90.0), 6)
+        e = round(min(math.ceil(e / snap) * snap, max_lon), 6)
+        n = round(min(math.ceil(n / snap) * snap, 90.0), 6)
+
+    return ((w, s), (w, n), (e, n), (e, s))
+
+
+def snap_time(time_str, floor=True):
+    '''
+        Snap a subset's start time down, or its end time up, to the hour.
+        A time we can't parse is left as it is.
+    '''
+    try:
+        t = datetime.datetime.fromisoformat(time_str)
+    except (TypeError, ValueError):
+        return time_str
+
+    snapped = t.replace(minute=0, second=0, microsecond=0)
+
+    if not floor and snapped != t:
+        snapped += datetime.timedelta(hours=1)
+
+    return snapped.isoformat()
+
+
 @goods_requests.post()
 def goods_request(request):
     '''
@@ -528,6 +608,14 @@ class GOODSRequest(object):
         self.error_type = ''
         self.subset_time = 0
         self.retrieve_time = 0
+        self.metadata = None  # probed from the output file when finished
+        self.cache_key = None  # key of our subset in the GOODS cache
+        self.from_cache = False
+
+        # Our subset is run by a worker of the GOODS worker pool
+        self.pool = self.orig_request.registry.settings['goods_pool']
+        self.session_id = self.orig_request.session.session_id
+        self.job = None
 
         # timezone shift retained for future use by webgnomeapi
         # self.tshift = float(tshift) if tshift != 'NaN' else None
@@ -570,8 +658,19 @@ class GOODSRequest(object):
                 'error_type': self.error_type,
                 'subset_time': self.subset_time,
                 'retrieve_time': self.retrieve_time,
+                'metadata': self.metadata,
+                'cached': self.from_cache,
+                'queue_position': self.queue_position,
                 }
 
+    @property
+    def queue_position(self):
+        '''
+            The number of subsets that will get a worker before ours, or
+            None if ours is not waiting for one.
+        '''
+        return None if self.job is None else self.pool.position(self.job)
+
     @property
     def subset_xr(self):
         if not self._subset_finished:
@@ -601,6 +700,17 @@ class GOODSRequest(object):
         #         self.orig_request.config.local_archive_dir is not None):
         #     raise EnvironmentError('libgoods archive directory not set '
         #                            '(main thread)')
+        try:
+            # self.outpath so that the worker also writes the file
+            self.job = self.pool.submit(self.session_id,
+                                        subset_process_func,
+                                        (self.request_args, self.outpath))
+        except WorkerPoolFull as e:
+            msg = f'Too many subset requests are waiting: {e}'
+            self.error('queue_full', msg)
+            return msg
+
+        self.message = 'Waiting for a subset worker'
         self.request_thread = threading.Thread(
             target=self._thread_request_func,
             args=(self.request_args, logger),
@@ -631,8 +741,8 @@ class GOODSRequest(object):
         self._request_finished = False
         self._subset_xr = None
         self._request_xr = None
-        if self.subset_process:
-            self.subset_process.terminate()
+        if self.job:
+            self.pool.cancel(self.job)
         if self.request_process:
             self.request_process.terminate()
         if self.request_thread:
@@ -659,8 +769,8 @@ class GOODSRequest(object):
         else:
             self.state = 'dead'
         self.message = 'Request cancelled by user'
-        if self.subset_process:
-            self.subset_process.terminate()
+        if self.job:
+            self.pool.cancel(self.job)
         if self.request_process:
             self.request_process.terminate()
         if self.request_thread:
@@ -677,27 +787,48 @@ class GOODSRequest(object):
     def _thread_request_func(self, request_args, logger):
         if (not hasattr(libgoods.config, 'archive_dir') and
                 self.orig_request.config.local_archive_dir is not None):
+            self.pool.cancel(self.job)
             raise EnvironmentError('libgoods archive directory not set '
                                    '(worker thread)')
         logger.info('START')
-        main_pipe, sub_pipe = multiprocessing.Pipe()
-        # STEP 1: Subset process to query libgoods for model subset
+        job = self.job
+        # STEP 1: Wait in the pool's queue for a subset worker
+        worker = None
+        while worker is None:
+            worker = self.pool.wait(job, timeout=2)
+            if worker is None and job.cancelled:
+                logger.info('Request left the queue before getting a worker')
+                return
+
+        self.subset_process = worker.process
+        self.message = None
+        try:
+            retrieved = self._follow_subset(worker, job, logger)
+        finally:
+            # the worker goes back to the pool.  If it hasn't finished the
+            # subset by then, it is replaced.
+            self.pool.release(worker, job)
+            self.subset_process = None
+
+        if retrieved and self.finish():
+            self.cache_subset()
+
+    def _follow_subset(self, worker, job, logger):
+        '''
+        Follow the progress of our subset in its worker.  Returns True if
+        the subset was retrieved into our outpath.
+        '''
+        main_pipe = worker.conn
+        # STEP 2: Subset worker to query libgoods for model subset
         status = result = None
-        # use a subprocess
-        # self.outpath so that the subprocess also writes the file
-        #  - a bit of a hack, shold be rethought?
-        self.subset_process = Process(target=subset_process_func,
-                                        args=(request_args, sub_pipe, self.outpath),
-                                        daemon=True)
         counter = 180
         timeout = 180
-        self.subset_process.start()
         try:
             if (main_pipe.poll(60)):  # startup timeout (expected msg 'startup')
                 msg = main_pipe.recv()
                 logger.info('Startup message received from subset process: ' + str(msg))
             else:
-                if not self.cancel_event.is_set(): #cancelling sets this event, so only log if not cancelled
+                if not job.cancelled: #cancelling stops the worker, so only log if not cancelled
                     msg = f'Subset process failed to start within timeout for request {self.filename}'
                     self.error('startup_timeout', msg)
                 return
@@ -705,7 +836,7 @@ class GOODSRequest(object):
             counter = 0
             self.state = 'subsetting'
         except EOFError:
-            if not self.cancel_event.is_set(): #cancelling sets this event, so only log if not cancelled
+            if not job.cancelled: #cancelling stops the worker, so only log if not cancelled
                 msg = f'Process terminated before startup message received for request {self.filename}'
                 self.error('startup_termination', msg)
             return
@@ -729,13 +860,13 @@ class GOODSRequest(object):
                     elif self.state == 'preparing':
                         logger.info('Request has been retried. thread should be exiting.')
                         return
-                    elif hasattr(self.subset_process, 'exitcode') and self.subset_process.exitcode is not None:
-                        logger.info('Subset process has exited with exitcode ' + str(self.subset_process.exitcode) + '. Breaking progress loop.')
+                    elif worker.process.exitcode is not None:
+                        logger.info('Subset process has exited with exitcode ' + str(worker.process.exitcode) + '. Breaking progress loop.')
                         break
                     self.time_elapsed = counter
                     continue
             except EOFError:
-                if not self.cancel_event.is_set(): #cancelling sets this event, so only log if not cancelled
+                if not job.cancelled: #cancelling stops the worker, so only log if not cancelled
                     self.error('pipe_closed', f'Subprocess pipe closed for request {self.filename}')
                 return
             except Exception as e:
@@ -747,7 +878,6 @@ class GOODSRequest(object):
                 #next message is result or error message.
                 logger.info('leaving progress loop via break')
                 logger.info('Message: {0}'.format(msg))
-                logger.info('Joining subset process')
                 status = msg[0]
                 result = msg[1]
                 break
@@ -771,15 +901,14 @@ class GOODSRequest(object):
                 if msg:
                     logger.info('Message: {0}'.format(msg))
 
-        self.subset_process.join(10) # give it a few seconds to clean up if it finished while we were waiting for messages
-        if hasattr(self.subset_process, 'exitcode') and self.subset_process.exitcode is None and counter >= timeout:
-            # process still running (self.subset_process.exitcode is None), and timeout exceeded
+        if counter >= timeout:
+            # worker still subsetting, and timeout exceeded
             m = f'Subset process exceeded timeout of {timeout} seconds for request {self.filename}'
             self.error('subset_timeout', m)
             return
-        elif hasattr(self.subset_process, 'exitcode') and (self.subset_process.exitcode not in (0, -15) or status == 'error'):
+        elif worker.process.exitcode is not None or status == 'error':
             logger.info('SUBSET FAILED: '
-                        f'exitcode: {self.subset_process.exitcode}')
+                        f'exitcode: {worker.process.exitcode}')
             self.error('subprocess_error', 'Subset process reported error: ' + repr(result))
             return
 
@@ -790,11 +919,50 @@ class GOODSRequest(object):
             self.complete_event.set()
             return
         self._request_finished = True
+
+        return True
+
+    def finish(self, from_cache=False):
+        '''
+            Finish the request with the subset file at our outpath, which
+            we either retrieved or found in our cache.  Returns False if
+            the file is not usable.
+        '''
+        # make sure we got a usable file, and have its metadata ready for
+        # the views that will use it.
+        metadata = get_netcdf_metadata(self.orig_request, self.outpath)
+        if metadata is None or not metadata['is_netcdf']:
+            if not from_cache:
+                self.error('subset_error',
+                           'Subset output is not a readable NetCDF file')
+            return False
+        self.metadata = {'time_range': metadata['time_range'],
+                         'grid_type': metadata['grid_type'],
+                         'bbox': metadata['bbox']}
+
+        self.from_cache = from_cache
+        if from_cache:
+            self._subset_finished = self._request_finished = True
+            self.subset_size = os.path.getsize(self.outpath)
+            self.message = 'Subset retrieved from cache'
+
         self.state = 'finished'
         register_exportable_file(self.orig_request, self.filename, self.outpath)
         self.complete_event.set()
         # logger.close()
 
+        return True
+
+    def cache_subset(self):
+        '''
+            Add our finished subset to the GOODS cache, for the next
+            request for the same subset.
+        '''
+        goods_cache = self.orig_request.registry.settings.get('goods_cache')
+
+        if goods_cache is not None and self.cache_key is not None:
+            goods_cache.put(self.cache_key, self.outpath)
+
 
 class Tracker(Callback):
     def __init__(self, model, dt=1, timeout=60):
@@ -850,7 +1018,11 @@ class Tracker(Callback):
             self.model.elapsed = elapsed
 
 
-def subset_process_func(request_args, sub_pipe, outpath):
+def subset_process_func(request_args, outpath, sub_pipe):
+    '''
+    Run a subset in a worker of our GOODS worker pool.  It ends by sending
+    either ('success', outpath) or ('error', message) through sub_pipe.
+    '''
     sub_pipe.send('startup')  # startup sync message
 
     # Fixme: couldn't all this figure out the archive stuff be done ahead of time?
@@ -884,7 +1056,7 @@ def subset_process_func(request_args, sub_pipe, outpath):
                 sz = -1
         except Exception as e:
             sub_pipe.send(('error', 'Subset process failed to retrieve subset size: ' + repr(e)))
-            raise
+            return
         sub_pipe.send(('subset_complete', sz))
         try:
             if sub_pipe.poll(60):  # wait for reconfirmation with timeout
@@ -905,5 +1077,3 @@ def subset_process_func(request_args, sub_pipe, outpath):
         sub_pipe.send(('success', outpath))
     except Exception as e:
         sub_pipe.send(('error', repr(e)))
-        raise
-    sub_pipe.close()
@@ -4,14 +4,14 @@ This currently includes Wind and Tide objects.
 """
 import ujson
 import logging
-import zlib
 import numpy as np
 from threading import current_thread
 
 from pyramid.settings import asbool
-from pyramid.response import Response
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPNotFound, HTTPNotImplemented
+from pyramid.httpexceptions import (HTTPNotFound,
+                                    HTTPNotImplemented,
+                                    HTTPBadRequest)
 
 from gnome.environment.environment_objects import GridCurrent, GridWind
 
@@ -23,16 +23,31 @@ from webgnome_api.common.views import (get_object,
                                        cors_exception,
                                        process_upload,
                                        can_persist,
-                                       activate_uploaded)
+                                       activate_uploaded,
+                                       get_codec,
+                                       cors_array_response)
 
 from cornice import Service
 
 from ..common.session_management import (get_session_object,
                                          acquire_session_lock)
+from ..common.blob_cache import grid_signature
+from ..common.codecs import compress_arrays
+from ..common.geometry import (parse_bbox,
+                               level_resolution,
+                               resolution_level,
+                               pack_lines,
+                               unpack_lines,
+                               decimate_lines,
+                               clip_lines,
+                               decimate_points,
+                               clip_points,
+                               max_level)
 log = logging.getLogger(__name__)
 
 edited_cors_policy = cors_policy.copy()
-edited_cors_policy['headers'] = edited_cors_policy['headers'] + ('num_lengths',)
+edited_cors_policy['headers'] = (edited_cors_policy['headers'] +
+                                 ('num_lengths', 'num_nodes'))
 
 grid = Service(name='environment/grid', path='/grid*obj_id',
                description="Grid API",
@@ -48,23 +63,22 @@ implemented_types = ('gnome.environment.gridded_objects_base.Grid_U',
 def get_grid(request):
     '''Returns an Grid object in JSON.'''
     content_requested = request.matchdict.get('obj_id')
-    resp = Response(
-        content_type='arraybuffer',
-        content_encoding='deflate'
-    )
     route = content_requested[1] if len(content_requested) > 1 else None
     if (len(content_requested) > 1):
         if route == 'lines':
-            resp.body, num_lengths = get_lines(request)
-            resp.headers.add('Access-Control-Expose-Headers', 'num_lengths')
-            resp.headers.add('num_lengths', str(num_lengths))
-            return cors_response(request, resp)
+            codec = get_codec(request)
+            body, num_lengths = get_lines(request, codec)
+            return cors_array_response(request, body, codec,
+                                       {'num_lengths': num_lengths})
         if route == 'nodes':
-            resp.body = get_nodes(request)
-            return cors_response(request, resp)
+            codec = get_codec(request)
+            body, num_nodes = get_nodes(request, codec)
+            headers = None if num_nodes is None else {'num_nodes': num_nodes}
+            return cors_array_response(request, body, codec, headers)
         if route == 'centers':
-            resp.body = get_centers(request)
-            return cors_response(request, resp)
+            codec = get_codec(request)
+            return cors_array_response(request, get_centers(request, codec),
+                                       codec)
         if route == 'metadata':
             return get_metadata(request)
     else:
@@ -94,7 +108,7 @@ def get_metadata(request):
     log.info('<<' + log_prefix)
 
 
-def get_lines(request):
+def get_lines(request, codec):
     '''
     Outputs the object's grid lines in binary format
     '''
@@ -109,10 +123,30 @@ def get_lines(request):
         obj = get_session_object(obj_id, request)
 
         if obj is not None:
-            lengths, lines = obj.get_lines()
-            lines_bytes = b''.join([l.tobytes() for l in lines])
+            def compress_lines():
+                lengths, lines = obj.get_lines()
 
-            return (zlib.compress(lengths.tobytes() + lines_bytes), len(lengths))
+                # A grid has a great many short lines, and the compressor
+                # is a lot faster fed one large buffer than one per line.
+                coords = (np.concatenate([np.ravel(l) for l in lines])
+                          if len(lines) > 0 else np.empty(0))
+
+                return compress_arrays(codec, [lengths, coords]), len(lengths)
+
+            grid_cache = request.registry.settings['grid_cache']
+            bbox, level = get_viewport(request)
+
+            if bbox is None and level is None:
+                return grid_cache.get_or_create(grid_signature(obj) +
+                                                ('lines', codec.name),
+                                                compress_lines)
+
+            lengths, coords = get_lines_level(grid_cache, obj, level)
+
+            if bbox is not None:
+                lengths, coords = clip_lines(lengths, coords, bbox)
+
+            return compress_arrays(codec, [lengths, coords]), len(lengths)
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -124,7 +158,7 @@ def get_lines(request):
     log.info('<<' + log_prefix)
 
 
-def get_centers(request):
+def get_centers(request, codec):
     '''
         Outputs GNOME grid centers for a particular obj
     '''
@@ -140,8 +174,15 @@ def get_centers(request):
         obj = get_session_object(obj_id, request)
 
         if obj is not None:
-            centers = obj.get_centers()
-            return zlib.compress(centers.astype(np.float32).tobytes())
+            def compress_centers():
+                centers = np.ascontiguousarray(obj.get_centers(), dtype=np.float32)
+                return codec.compress(centers), None
+
+            grid_cache = request.registry.settings['grid_cache']
+
+            return grid_cache.get_or_create(grid_signature(obj) +
+                                            ('centers', codec.name),
+                                            compress_centers)[0]
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -153,9 +194,15 @@ def get_centers(request):
     log.info('<<' + log_prefix)
 
 
-def get_nodes(request):
+def get_nodes(request, codec):
     '''
         Outputs the object's grid nodes in binary format
+
+        A level-of-detail request gets only some of the nodes, so they are
+        preceded by their indices in the full grid, as uint32, for the
+        client to match them with the grid's nodes and data.  We return
+        the number of nodes along with the body, or None for the whole
+        grid, which has no indices.
     '''
     log_prefix = 'req({0}): get_grid():'.format(id(request))
     log.info('>>' + log_prefix)
@@ -168,9 +215,25 @@ def get_nodes(request):
         obj = get_session_object(obj_id, request)
 
         if obj is not None:
-            nodes = obj.get_nodes()
+            def compress_nodes():
+                nodes = np.ascontiguousarray(obj.get_nodes(), dtype=np.float32)
+                return codec.compress(nodes), None
+
+            grid_cache = request.registry.settings['grid_cache']
+            bbox, level = get_viewport(request)
+
+            if bbox is None and level is None:
+                return grid_cache.get_or_create(grid_signature(obj) +
+                                                ('nodes', codec.name),
+                                                compress_nodes)
 
-            return zlib.compress(nodes.astype(np.float32).tobytes())
+            indices, nodes = get_nodes_level(grid_cache, obj, level)
+
+            if bbox is not None:
+                kept, nodes = clip_points(nodes, bbox)
+                indices = indices[kept]
+
+            return compress_arrays(codec, [indices, nodes]), len(indices)
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -180,3 +243,83 @@ def get_nodes(request):
                  .format(log_prefix, id(session_lock), current_thread().ident))
 
     log.info('<<' + log_prefix)
+
+
+def get_viewport(request):
+    '''
+        Get the viewport of a level-of-detail request for our grid lines
+        or nodes.  The query parameters are:
+
+        - bbox: The visible extent, 'min_lon,min_lat,max_lon,max_lat'
+        - zoom: The map zoom level, or
+        - resolution: The size of a map pixel in degrees
+
+        Returns a (bbox, level) pair.  Either one can be None if it was not
+        requested.
+    '''
+    bbox = level = None
+
+    try:
+        if 'bbox' in request.GET:
+            bbox = parse_bbox(request.GET['bbox'])
+
+        if 'zoom' in request.GET:
+            level = min(max(int(request.GET['zoom']), 0), max_level)
+        elif 'resolution' in request.GET:
+            level = resolution_level(float(request.GET['resolution']))
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+    return bbox, level
+
+
+def get_lines_level(grid_cache, obj, level):
+    '''
+        Get the (lengths, coords) of our grid lines, decimated for a zoom
+        level over the whole extent of the grid.  A level of None gets the
+        lines at full resolution.
+    '''
+    def pack_lines_level():
+        lengths, lines = obj.get_lines()
+        lengths = np.asarray(lengths)
+        coords = (np.concatenate([np.asarray(l).reshape(-1, 2)
+                                  for l in lines])
+                  if len(lines) > 0 else np.empty((0, 2)))
+
+        if level is not None:
+            lengths, coords = decimate_lines(lengths, coords,
+                                             level_resolution(level))
+
+        return pack_lines(lengths, coords)
+
+    key = grid_signature(obj) + ('lines', 'level', level)
+
+    return unpack_lines(*grid_cache.get_or_create(key, pack_lines_level))
+
+
+def get_nodes_level(grid_cache, obj, level):
+    '''
+        Get the (indices, nodes) of our grid nodes, decimated for a zoom
+        level over the whole extent of the grid.  A level of None gets all
+        the nodes.  The indices, as uint32, are of the nodes in the full
+        grid.
+    '''
+    def pack_nodes_level():
+        nodes = obj.get_nodes().astype(np.float32).reshape(-1, 2)
+
+        if level is not None:
+            indices, nodes = decimate_points(nodes, level_resolution(level))
+        else:
+            indices = np.arange(len(nodes))
+
+        return (indices.astype('<u4').tobytes() + nodes.tobytes(),
+                len(indices))
+
+    key = grid_signature(obj) + ('nodes', 'level', level)
+    buff, num_nodes = grid_cache.get_or_create(key, pack_nodes_level)
+
+    indices = np.frombuffer(buff, dtype='<u4', count=num_nodes)
+    nodes = np.frombuffer(buff, dtype=np.float32,
+                          offset=indices.nbytes).reshape(-1, 2)
+
+    return indices, nodes
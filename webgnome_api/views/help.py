@@ -1,8 +1,7 @@
 """
 Views for help documentation
 """
-from os import walk
-from os.path import sep, join, isfile, isdir
+from os.path import sep
 
 from datetime import datetime, timezone
 import time
@@ -19,9 +18,9 @@ from email import encoders
 import ujson
 import redis
 
-from docutils.core import publish_parts
-
 from cornice import Service
+from pyramid.response import Response
+from pyramid.view import view_config
 from pyramid.httpexceptions import (HTTPError,
                                     HTTPNotFound,
                                     HTTPBadRequest,
@@ -32,8 +31,11 @@ from google.auth.exceptions import GoogleAuthError, ClientCertError
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 
-from webgnome_api.common.views import cors_exception, cors_policy
-from webgnome_api.common.indexing import iter_keywords
+from webgnome_api.common.views import (cors_exception,
+                                       cors_policy,
+                                       cors_response)
+from webgnome_api.common.help_corpus import (HelpCorpus,
+                                             help_dir_from_settings)
 
 log = logging.getLogger(__name__)
 
@@ -47,59 +49,65 @@ def get_help(request):
     """
     Get the requested help file if it exists
     """
-    help_dir = get_help_dir_from_config(request)
+    help_corpus = get_help_corpus(request)
     requested_dir = urllib.parse.unquote(sep.join(request.matchdict['dir']))
-    requested_file = join(help_dir, requested_dir)
-
-    if isfile(requested_file + '.rst'):
-        # a single help file was requested
-        html = ''
-        with open(requested_file + '.rst', 'r', encoding="utf-8") as f:
-            html = publish_parts(f.read(), writer_name='html')['html_body']
-
-        return {'path': requested_file, 'html': html}
-    elif isdir(requested_file) and requested_dir != '':
-        # a directory was requested
-        # aggregate the files contained with in the given directory
-        # and sub dirs.
-        for path, _dirnames, filenames in walk(requested_file):
-            filenames.sort()
-
-            html = ''
-
-            for fname in filenames:
-                with open(join(path, fname), 'r', encoding="utf-8") as f:
-                    html += publish_parts(f.read(),
-                                          writer_name='html')['html_body']
-
-            return {'path': requested_file, 'html': html}
-    elif isdir(requested_file) and requested_dir == '':
+
+    if requested_dir == '':
         # all helps requested
-        aggregate = []
-        for path, _dirnames, filenames in walk(requested_file):
-            filenames.sort()
+        return help_corpus.get_all()
 
-            # exclude location file user guides
-            if path.count(join('model', 'locations')) == 0:
-                for fname in filenames:
-                    text = ''
-                    with open(join(path, fname), 'r', encoding="utf-8") as f:
-                        text = f.read()
+    # a single help file, or a directory of help files, was requested
+    help_content = help_corpus.get_file(requested_dir)
 
-                    parts_whole = publish_parts(text)
-                    parts = publish_parts(text, writer_name='html')
+    if help_content is None:
+        help_content = help_corpus.get_dir(requested_dir)
 
-                    html = parts['html_body']
-                    keywords = iter_keywords(parts_whole['whole'])
+    if help_content is None:
+        raise cors_exception(request, HTTPNotFound)
 
-                    aggregate.append({'path': join(path,
-                                                   fname.replace('.rst', '')),
-                                      'html': html,
-                                      'keywords': keywords})
+    return help_content
+
+
+@view_config(route_name='help_search', request_method='OPTIONS')
+def search_help_options(request):
+    return cors_response(request, request.response)
 
-        return aggregate
-    else:
-        raise cors_exception(request, HTTPNotFound)
+
+@view_config(route_name='help_search', request_method='GET')
+def search_help(request):
+    """
+    Full-text search of our help documentation, /help/search?q=...
+
+    This has its own route, ahead of the /help catch-all, so the help
+    files are looked up the same as they always were.
+    """
+    help_corpus = get_help_corpus(request)
+    query = request.GET.get('q', '').strip()
+
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+    if query == '':
+        raise cors_exception(request, HTTPBadRequest,
+                             explanation='No search query (q) provided')
+
+    results = help_corpus.search(query, limit=max(1, min(limit, 100)))
+
+    return cors_response(request, Response(ujson.dumps(results),
+                                           content_type='application/json',
+                                           charset='utf-8'))
+
+
+def get_help_corpus(request):
+    """Get our compiled help corpus, creating it if necessary"""
+    settings = request.registry.settings
+
+    if settings.get('help_corpus') is None:
+        settings['help_corpus'] = HelpCorpus(get_help_dir_from_config(request))
+
+    return settings['help_corpus']
 
 
 @help_svc.put()
@@ -280,12 +288,4 @@ def _get_sasl_oauth_string(email_user, access_token):
 
 def get_help_dir_from_config(request):
     """Get help dir from config"""
-    help_dir = request.registry.settings['help_dir']
-
-    if help_dir[0] == sep:
-        full_path = help_dir
-    else:
-        here = request.registry.settings['install_path']
-        full_path = join(here, help_dir)
-
-    return full_path
+    return help_dir_from_settings(request.registry.settings)
@@ -3,8 +3,8 @@ Views for the model load/save operations.
 """
 import os
 import logging
-import tempfile
 import shutil
+import tempfile
 from threading import current_thread
 
 from pyramid.view import view_config
@@ -14,11 +14,13 @@ from pyramid.httpexceptions import (HTTPBadRequest,
 
 from cornice import Service
 
-from gnome.persist import is_savezip_valid
 from gnome.model import Model
 
-from webgnome_api.common.system_resources import list_files
-from webgnome_api.common.common_object import (clean_session_dir,
+from webgnome_api.common.save_files import SaveFileError, ingest_save_file
+from webgnome_api.common.system_resources import get_free_space
+from webgnome_api.common.common_object import (ObjectContentHash,
+                                               clean_session_dir,
+                                               get_session_dir,
                                                get_persistent_dir)
 from webgnome_api.common.session_management import (init_session_objects,
                                                     get_session_object,
@@ -32,6 +34,8 @@ from webgnome_api.common.views import (can_persist,
                                        cors_policy,
                                        process_upload,
                                        activate_uploaded,
+                                       list_folder,
+                                       invalidate_folder_index,
                                        HTTPPythonError)
 from webgnome_api.common.session_management import get_session_objects
 
@@ -43,6 +47,41 @@ persisted_files_api = Service(name='uploaded', path='/uploaded',
                               cors_policy=cors_policy)
 
 
+def extract_save_file(request, file_path):
+    '''
+        Check a save file, and extract it into a new folder in our session
+        folder, upgrading it if it is an old one.  The model is then loaded
+        from that folder.
+    '''
+    settings = request.registry.settings
+
+    max_json_filesize = eval(settings.get(
+        'zip_file.max_item_size',
+        '1024 * 1024',  # default
+    ), {}, {})  # Safety: don't reference any global or local variables.
+
+    max_compress_ratio = eval(settings.get(
+        'zip_file.max_compression_ratio',
+        '54',  # default
+    ), {}, {})  # Safety: don't reference any global or local variables.
+
+    session_dir = get_session_dir(request)
+    max_total_size = min(eval(settings['max_upload_size'], {}, {}),
+                         get_free_space(session_dir))
+
+    extract_dir = tempfile.mkdtemp(prefix='model_', dir=session_dir)
+
+    try:
+        return ingest_save_file(file_path, extract_dir,
+                                max_json_filesize, max_compress_ratio,
+                                max_total_size)
+    except SaveFileError as e:
+        log.info(f'Rejected save file {file_path}: {e}')
+        raise cors_response(request, HTTPBadRequest(
+            f'Incoming file is not a valid save file: {e}'
+        ))
+
+
 @view_config(route_name='upload', request_method='OPTIONS')
 def upload_model_options(request):
     return cors_response(request, request.response)
@@ -64,25 +103,8 @@ def upload_model(request):
     clean_session_dir(request)
     file_path, _name = process_upload(request, 'new_model')
 
-    max_json_filesize = eval(request.registry.settings.get(
-        'zip_file.max_item_size',
-        '1024 * 1024',  # default
-    ), {}, {})  # Safety: don't reference any global or local variables.
-
-    max_compress_ratio = eval(request.registry.settings.get(
-        'zip_file.max_compression_ratio',
-        '54',  # default
-    ), {}, {})  # Safety: don't reference any global or local variables.
-
-    # Now that we have our file, we will now try to load the model into
-    # memory.
-    # Now that we have our file, is it a zipfile?
-    if not is_savezip_valid(file_path,
-                            max_json_filesize=max_json_filesize,
-                            max_compress_ratio=max_compress_ratio):
-        raise cors_response(request, HTTPBadRequest(
-            'Incoming file is not a valid zipfile!'
-        ))
+    # Now that we have our file, we check it and extract it in one go
+    model_dir = extract_save_file(request, file_path)
 
     resp_msg = 'OK'
     # now we try to load our model from the zipfile.
@@ -97,7 +119,7 @@ def upload_model(request):
         # passing the session_objects in as refs completes object registration
         # for API
 
-        new_model = Model.load(file_path, refs=refs)
+        new_model = Model.load(model_dir, refs=refs)
         new_model._cache.enabled = False
 
         log.info('setting active model...')
@@ -130,28 +152,11 @@ def activate_uploaded_model(request):
     '''
     clean_session_dir(request)
 
-    max_json_filesize = eval(request.registry.settings.get(
-        'zip_file.max_item_size',
-        '1024 * 1024',  # default
-    ), {}, {})  # Safety: don't reference any global or local variables.
-
-    max_compress_ratio = eval(request.registry.settings.get(
-        'zip_file.max_compression_ratio',
-        '54',  # default
-    ), {}, {})  # Safety: don't reference any global or local variables.
-
     zipfile_path, _name = activate_uploaded(request)
     log.info('Model zipfile: {}'.format(zipfile_path))
 
-    # Now that we have our file, we will now try to load the model into
-    # memory.
-    # Now that we have our file, is it a zipfile?
-    if not is_savezip_valid(zipfile_path,
-                            max_json_filesize=max_json_filesize,
-                            max_compress_ratio=max_compress_ratio):
-        raise cors_response(request, HTTPBadRequest(
-            'File is not a valid zipfile!'
-        ))
+    # Now that we have our file, we check it and extract it in one go
+    model_dir = extract_save_file(request, zipfile_path)
 
     # now we try to load our model from the zipfile.
     session_lock = acquire_session_lock(request)
@@ -164,7 +169,7 @@ def activate_uploaded_model(request):
 
         # passing the session_objects in as refs completes object registration
         # for API
-        new_model = Model.load(zipfile_path, refs=refs)
+        new_model = Model.load(model_dir, refs=refs)
         new_model._cache.enabled = False
 
         log.info('setting active model...')
@@ -186,23 +191,51 @@ download = Service(name='download', path='/download',
                    cors_policy=cors_policy)
 
 
-def cleanup_tempfile_callback(request):
-    """
-    Cleanup the temp file we created when downloading the model.  This should
-    be a file in zip format.
-    """
-    saveloc = get_session_object('saveloc', request)
+def get_saved_model_file(request, my_model):
+    '''
+        Save the model as a zipfile in the session folder and return its path.
+
+        The saved file is kept around and reused until the content of the
+        model, or of any of its data files, changes.  So repeated
+        downloads of an unchanged model don't need to serialize and zip
+        all the model's data files again.
+    '''
+    revision = ObjectContentHash(my_model, by_file_content=True)
+    saved_model = get_session_object('saved_model', request)
+
+    if (saved_model is not None and
+            saved_model['revision'] == revision and
+            os.path.isfile(saved_model['path'])):
+        log.debug(f'using saved model file {saved_model["path"]}')
+        return saved_model['path']
+
+    save_dir = os.path.join(get_session_dir(request), '.saved_model')
+    os.makedirs(save_dir, exist_ok=True)
+
+    session_lock = acquire_session_lock(request)
+    log.info('  session lock acquired (sess:{}, thr_id: {})'
+             .format(id(session_lock), current_thread().ident))
     try:
-        if os.path.isfile(saveloc):
-            log.debug(f'cleaning up temp file: {saveloc}')
-            os.remove(saveloc)
-        elif os.path.isdir(saveloc):
-            log.debug(f'cleaning up temp directory: {saveloc}')
-            shutil.rmtree(saveloc, ignore_errors=True)
-
-        log.debug('Finished cleaning up temp file')
-    except Exception as e:
-        log.error(f'Error cleaning up temp file: {e}')
+        _json, saveloc, _refs = my_model.save(
+            saveloc=os.path.join(save_dir, f'{revision}.tmp')
+        )
+
+        saved_path = os.path.join(save_dir, f'{revision}.gnome')
+        os.replace(saveloc, saved_path)
+
+        if (saved_model is not None and
+                saved_model['path'] != saved_path and
+                os.path.isfile(saved_model['path'])):
+            os.remove(saved_model['path'])
+
+        set_session_object({'revision': revision, 'path': saved_path},
+                           request, obj_id='saved_model')
+    finally:
+        session_lock.release()
+        log.info('  session lock released (sess:{}, thr_id: {})'
+                 .format(id(session_lock), current_thread().ident))
+
+    return saved_path
 
 
 @download.get()
@@ -211,17 +244,10 @@ def download_model(request):
         Here is where we save the active model as a zipfile and
         download it to the client
     '''
-    request.add_finished_callback(cleanup_tempfile_callback)
-
     my_model = get_active_model(request)
 
     if my_model:
-        tf = tempfile.NamedTemporaryFile(prefix='gnome.')
-        filename = tf.name
-        tf.close()
-
-        _json, saveloc, _refs = my_model.save(saveloc=filename)
-        set_session_object(saveloc, request, obj_id='saveloc')
+        saveloc = get_saved_model_file(request, my_model)
 
         response_filename = ('{0}.gnome'.format(my_model.name))
         response = FileResponse(saveloc, request=request,
@@ -257,7 +283,11 @@ def save_and_persist_model(request):
         else:
             file_name = ('{0}.zip'.format(my_model.name))
 
-        my_model.save(saveloc=os.path.join(base_path, file_name))
+        persistent_path = os.path.join(base_path, file_name)
+
+        shutil.copyfile(get_saved_model_file(request, my_model),
+                        persistent_path)
+        invalidate_folder_index(request, persistent_path)
 
         return cors_response(request, Response('OK'))
     else:
@@ -276,4 +306,4 @@ def get_uploaded_files(request):
         TODO: We have an upload manager that has this functionality.  We need
               to prune this.
     '''
-    return list_files(get_persistent_dir(request))
+    return list_folder(request, get_persistent_dir(request))
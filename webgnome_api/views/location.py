@@ -1,28 +1,26 @@
 """
 Views for the Location objects.
 """
-from os import walk
-from os.path import sep, join, isdir, split, basename
+from os.path import isdir, split
 from logging import getLogger
 from threading import current_thread
 
-from geojson import FeatureCollection, Feature, Point
-
-import ujson
-import slugify
-
+from pyramid.response import Response
 from pyramid.httpexceptions import HTTPNotFound, HTTPInternalServerError
 from cornice import Service
 
 from gnome.model import Model
 
 from webgnome_api.common.common_object import obj_id_from_url, RegisterObject
+from webgnome_api.common.location_cache import LocationIndex
 from webgnome_api.common.session_management import (init_session_objects,
                                                     set_active_model,
                                                     get_active_model,
                                                     acquire_session_lock)
 
-from webgnome_api.common.views import cors_exception, cors_policy
+from webgnome_api.common.views import (cors_exception,
+                                       cors_response,
+                                       cors_policy)
 
 location_api = Service(name='location', path='/location*obj_id',
                        description="Location API", cors_policy=cors_policy)
@@ -38,33 +36,19 @@ def get_location(request):
     log.info('location_api.cors_origins_for("get") = {0}'
              .format(location_api.cors_origins_for('get')))
 
-    # first, lets just query that we can get to the data
-    locations_dir = request.registry.settings['locations_dir']
-    base_len = len(locations_dir.split(sep))
-    location_content = []
-    location_file_dirs = []
-
-    for (path, _dirnames, filenames) in walk(locations_dir):
-        if len(path.split(sep)) == base_len + 1:
-            [location_content.append(ujson.load(open(join(path, f), 'r')))
-             for f in filenames
-             if f == 'compiled.json']
-
-            [location_file_dirs.append(join(path, basename(path) + '_save'))
-             for f in filenames
-             if f == 'compiled.json']
+    location_index = get_location_index(request)
 
     slug = obj_id_from_url(request)
     if slug:
-        matching = [(i, c) for i, c in enumerate(location_content)
-                    if slugify.slugify_url(c['name']) == slug]
-        if matching:
+        location = location_index.get(slug)
+        if location is not None:
+            content, location_file = location
+
             session_lock = acquire_session_lock(request)
             log.info('  session lock acquired (sess:{}, thr_id: {})'
                      .format(id(session_lock), current_thread().ident))
 
             try:
-                location_file = location_file_dirs[matching[0][0]]
                 log.info('load location: {0}'.format(location_file))
                 load_location_file(location_file, request)
             except Exception:
@@ -75,18 +59,22 @@ def get_location(request):
                 log.info('  session lock released (sess:{}, thr_id: {})'
                          .format(id(session_lock), current_thread().ident))
 
-            return matching[0][1]
+            return content
         else:
             raise cors_exception(request, HTTPNotFound)
     else:
-        features = [Feature(geometry=Point(c['geometry']['coordinates']),
-                            properties={'title': c['name'],
-                                        'slug': slugify.slugify_url(c['name']),
-                                        'content': c['steps']
-                                        }
-                            )
-                    for c in location_content]
-        return FeatureCollection(features)
+        return cors_response(request,
+                             Response(body=location_index.feature_collection,
+                                      content_type='application/json'))
+
+
+def get_location_index(request):
+    settings = request.registry.settings
+
+    if settings.get('location_index') is None:
+        settings['location_index'] = LocationIndex(settings['locations_dir'])
+
+    return settings['location_index']
 
 
 def load_location_file(location_file, request):
@@ -97,7 +85,13 @@ def load_location_file(location_file, request):
     if isdir(location_file):
         active_model = get_active_model(request)
 
-        new_model = Model.load(location_file)
+        location_models = request.registry.settings.get('location_models')
+
+        if location_models is not None:
+            new_model = location_models.get_model(location_file)
+        else:
+            new_model = Model.load(location_file)
+
         new_model._cache.enabled = False
 
         if active_model is not None:
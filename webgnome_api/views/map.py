@@ -4,10 +4,8 @@ Views for the Map objects.
 import os
 import logging
 from threading import current_thread
-import zlib
 
 import ujson
-import numpy as np
 
 from cornice import Service
 
@@ -25,9 +23,12 @@ from webgnome_api.common.views import (can_persist,
                                        create_object,
                                        cors_policy,
                                        activate_uploaded,
-                                       web_ser_opts)
+                                       web_ser_opts,
+                                       get_codec,
+                                       cors_array_response)
 
 from webgnome_api.common.common_object import (UpdateObject,
+                                               ObjectContentHash,
                                                ObjectImplementsOneOf,
                                                obj_id_from_url,
                                                obj_id_from_req_payload)
@@ -38,6 +39,16 @@ from webgnome_api.common.session_management import (get_session_objects,
                                                     acquire_session_lock)
 
 from webgnome_api.common.helpers import JSONImplementsOneOf
+from webgnome_api.common.blob_cache import file_signature
+from webgnome_api.common.codecs import compress_arrays
+from webgnome_api.common.geometry import (level_resolution,
+                                          resolution_level,
+                                          simplify_geojson,
+                                          quantize_geojson,
+                                          max_level)
+from webgnome_api.common.raster_tiles import (downsample_raster,
+                                              tile_window,
+                                              max_raster_level)
 
 edited_cors_policy = cors_policy.copy()
 edited_cors_policy['headers'] = edited_cors_policy['headers'] + ('shape', 'bbox')
@@ -57,19 +68,18 @@ log = logging.getLogger(__name__)
 def get_map(request):
     '''Returns a Gnome Map object in JSON.'''
     content_requested = request.matchdict.get('obj_id')
-    resp = Response(
-        content_type='arraybuffer',
-        content_encoding='deflate'
-    )
     route = content_requested[1] if len(content_requested) > 1 else None
     if (len(content_requested) > 1):
+        if route == 'raster' and len(content_requested) == 5:
+            codec = get_codec(request)
+            body, headers = get_raster_tile(request, codec)
+            return cors_array_response(request, body, codec, headers)
+
         if route == 'raster':
-            resp.body, shape, bbox = get_raster(request)
-            resp.headers.add('Access-Control-Expose-Headers', 'shape')
-            resp.headers.add('Access-Control-Expose-Headers', 'bbox')
-            resp.headers.add('shape', str(shape))
-            resp.headers.add('bbox', str(bbox))
-            return cors_response(request, resp)
+            codec = get_codec(request)
+            body, (shape, bbox) = get_raster(request, codec)
+            return cors_array_response(request, body, codec,
+                                       {'shape': shape, 'bbox': bbox})
 
         if route == 'geojson':
             return get_geojson(request, implemented_types)
@@ -175,19 +185,82 @@ def activate_map(request):
 
 
 def get_geojson(request, implemented_types):
-    '''Returns the GeoJson for a Gnome Map object.'''
+    '''
+        Returns the GeoJson for a Gnome Map object.
+
+        The optional query parameters are:
+
+        - zoom: Simplify the shorelines for a map zoom level, or
+        - tolerance: Simplify the shorelines to within a tolerance in
+                     degrees.  This is rounded to the nearest zoom level.
+        - format=quantized: Encode the coordinates as delta-encoded
+                            integers with a TopoJSON style transform.
+
+        The encoded GeoJSON is cached for each map content, simplification
+        level and format.
+    '''
+    try:
+        if 'zoom' in request.GET:
+            level = min(max(int(request.GET['zoom']), 0), max_level)
+        elif 'tolerance' in request.GET:
+            level = resolution_level(float(request.GET['tolerance']))
+        else:
+            level = None
+
+        geojson_format = request.GET.get('format', 'geojson')
+
+        if geojson_format not in ('geojson', 'quantized'):
+            raise ValueError(f'Unknown format {geojson_format}')
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
     obj = get_session_object(obj_id_from_url(request), request)
 
     if obj:
         if ObjectImplementsOneOf(obj, implemented_types):
-            return obj.to_geojson()
+            def encode_geojson():
+                geojson = obj.to_geojson()
+
+                if level is not None:
+                    geojson = simplify_geojson(geojson,
+                                               level_resolution(level))
+
+                if geojson_format == 'quantized':
+                    geojson = quantize_geojson(geojson)
+
+                return ujson.dumps(geojson).encode('utf-8'), None
+
+            grid_cache = request.registry.settings['grid_cache']
+            body, _info = grid_cache.get_or_create(map_signature(obj) +
+                                                   ('geojson', level,
+                                                    geojson_format),
+                                                   encode_geojson)
+
+            return cors_response(request,
+                                 Response(body=body,
+                                          content_type='application/json'))
         else:
             raise cors_exception(request, HTTPNotImplemented)
     else:
         raise cors_exception(request, HTTPNotFound)
 
 
-def get_raster(request):
+def map_signature(obj):
+    '''
+        Generate a signature of a map's content.  Maps with the same
+        content share their cached rasters, and a map's signature changes
+        when it is updated.
+    '''
+    return ('map',
+            ObjectContentHash(obj),
+            file_signature(getattr(obj, 'filename', None)))
+
+
+def get_raster_bbox(obj):
+    return obj.land_polys.bounding_box.AsPoly().reshape(-1).tolist()
+
+
+def get_raster(request, codec):
     '''
         Outputs the map's raster in binary format
     '''
@@ -202,12 +275,19 @@ def get_raster(request):
         obj = get_session_object(obj_id, request)
 
         if obj is not None:
-            raster = obj.raster.copy()
-            # transpose for client
-            bbox = obj.land_polys.bounding_box.AsPoly().reshape(-1).tolist()
+            def compress_raster():
+                # transpose for client.  This is only a view of the raster,
+                # which is copied a block at a time as it is compressed.
+                raster = obj.raster.T
+
+                return (compress_arrays(codec, [raster]),
+                        (raster.shape, get_raster_bbox(obj)))
 
-            return (zlib.compress(np.ascontiguousarray(raster.T).tobytes()),
-                    raster.T.shape, bbox)
+            grid_cache = request.registry.settings['grid_cache']
+
+            return grid_cache.get_or_create(map_signature(obj) +
+                                            ('raster', codec.name),
+                                            compress_raster)
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -217,3 +297,73 @@ def get_raster(request):
                  .format(log_prefix, id(session_lock), current_thread().ident))
 
     log.info('<<' + log_prefix)
+
+
+def get_raster_tile(request, codec):
+    '''
+        Outputs a tile of the map's raster in binary format,
+        /map/<id>/raster/<level>/<row>/<col>?tile_size=<pixels>
+
+        The raster is downsampled by a factor of 2 ** level, so a client
+        can show a coarse level first, and then fetch the tiles it needs
+        at finer levels.  The tile's pixel window within its level, and
+        the shape of the whole level, are in the headers.
+    '''
+    log_prefix = 'req({0}): get_raster_tile():'.format(id(request))
+    log.info('>>' + log_prefix)
+
+    try:
+        level, row, col = [int(v) for v in
+                           request.matchdict.get('obj_id')[2:5]]
+        tile_size = int(request.GET.get('tile_size', 512))
+
+        if not (0 <= level <= max_raster_level and
+                64 <= tile_size <= 4096):
+            raise ValueError('Invalid raster level or tile size')
+    except ValueError as e:
+        raise cors_exception(request, HTTPBadRequest) from e
+
+    session_lock = acquire_session_lock(request)
+    log.info('  {} session lock acquired (sess:{}, thr_id: {})'
+             .format(log_prefix, id(session_lock), current_thread().ident))
+    try:
+        obj_id = request.matchdict.get('obj_id')[0]
+        obj = get_session_object(obj_id, request)
+
+        if obj is None:
+            raise cors_exception(request, HTTPNotFound)
+
+        grid_cache = request.registry.settings['grid_cache']
+        signature = map_signature(obj)
+
+        def create_level():
+            # transpose for client
+            return (downsample_raster(obj.raster.T, 2 ** level),
+                    get_raster_bbox(obj))
+
+        def compress_tile():
+            raster, bbox = grid_cache.get_or_create(signature +
+                                                    ('raster_level', level),
+                                                    create_level)
+            window = tile_window(raster.shape, row, col, tile_size)
+            tile = raster[window[0]:window[2], window[1]:window[3]]
+
+            return (compress_arrays(codec, [tile]),
+                    {'shape': tile.shape,
+                     'window': ','.join([str(w) for w in window]),
+                     'level_shape': raster.shape,
+                     'bbox': bbox})
+
+        try:
+            return grid_cache.get_or_create(signature +
+                                            ('raster_tile', codec.name, level,
+                                             tile_size, row, col),
+                                            compress_tile)
+        except ValueError as e:
+            raise cors_exception(request, HTTPBadRequest) from e
+    finally:
+        session_lock.release()
+        log.info('  {} session lock released (sess:{}, thr_id: {})'
+                 .format(log_prefix, id(session_lock), current_thread().ident))
+
+    log.info('<<' + log_prefix)
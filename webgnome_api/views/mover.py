@@ -2,9 +2,9 @@
 Views for the Mover objects.
 This currently includes ??? objects.
 """
+import os
 import logging
 import datetime as dt
-import zlib
 from threading import current_thread
 
 import ujson
@@ -14,7 +14,7 @@ from netCDF4 import Dataset, num2date, date2num
 
 from pyramid.response import Response
 from pyramid.view import view_config
-from pyramid.httpexceptions import HTTPNotFound
+from pyramid.httpexceptions import HTTPNotFound, HTTPBadRequest
 
 from cornice import Service
 
@@ -27,10 +27,26 @@ from webgnome_api.common.views import (get_object,
                                        cors_policy,
                                        cors_response,
                                        cors_exception,
-                                       switch_to_existing_session)
+                                       switch_to_existing_session,
+                                       get_tile_request,
+                                       get_time_range,
+                                       time_sliced_response,
+                                       get_codec,
+                                       cors_array_response,
+                                       binary_requested,
+                                       gen_unique_filename,
+                                       get_netcdf_metadata)
 
 from webgnome_api.common.session_management import (get_session_object,
                                                     acquire_session_lock)
+from webgnome_api.common.codecs import compress_arrays
+from webgnome_api.common.netcdf_probe import lon_varnames, lon_needs_shift
+from webgnome_api.common.upload_store import unshare_file
+from webgnome_api.common.vector_tiles import (VectorField,
+                                              cached_tile,
+                                              cached_vector_field,
+                                              float_columns,
+                                              lon_lat_points)
 
 log = logging.getLogger(__name__)
 
@@ -64,11 +80,32 @@ def get_mover(request):
     route = content_requested[1] if len(content_requested) > 1 else None
 
     if (route == 'grid'):
+        if binary_requested(request):
+            codec = get_codec(request)
+            cells = get_current_info(request, binary=True)
+
+            return cors_array_response(request, codec.compress(cells), codec,
+                                       {'shape': cells.shape})
+
         return get_current_info(request)
     elif (route == 'centers'):
+        if binary_requested(request):
+            codec = get_codec(request)
+            centers = get_grid_centers(request, binary=True)
+
+            return cors_array_response(request, codec.compress(centers),
+                                       codec, {'shape': centers.shape})
+
         return get_grid_centers(request)
     elif (route == 'vectors'):
+        time_range = get_time_range(request)
+
+        if time_range is not None:
+            return get_vector_slices(request, time_range)
+
         return get_vector_data(request)
+    elif (route == 'tiles'):
+        return get_vector_tile(request)
     else:
         return get_object(request, implemented_types)
 
@@ -102,28 +139,22 @@ def upload_mover(request):
     name = request.POST['name']
     file_name = file_list
 
-    # The tshift has been disabled here. However, it still checks for the need 
-    # to shift longitude from 0-360. 
+    # The tshift has been disabled here. However, it still checks for the need
+    # to shift longitude from 0-360.
     # More robust support at the environment level in pyGNOME would be better.
-    
+
     if isinstance(file_name, str):
         file_list = [file_name,]
 
-    for f in file_list:
-        try:
-            nc = Dataset(f, 'r')
-            is_netcdf = True
-            nc.close()
-        except:
-            is_netcdf = False
-        if is_netcdf:
-            shift_lon_time(f)
-   
     log.info('  {} file_name: {}, name: {}'
              .format(log_prefix, file_name, name))
 
     mover_type = request.POST.get('obj_type', [])
 
+    is_py_mover = ('py_current_movers.CurrentMover' in mover_type or
+                   'py_wind_movers.WindMover' in mover_type)
+    grid_file = normalize_lon(request, file_list, is_py_mover) or file_name
+
     basic_json = {'obj_type': mover_type,
                   'filename': file_name,
                   'name': name}
@@ -131,10 +162,10 @@ def upload_mover(request):
     env_obj_base_json = {'obj_type': 'temp',
                          'name': name,
                          'data_file': file_name,
-                         'grid_file': file_name,
+                         'grid_file': grid_file,
                          'grid': {'obj_type': ('gnome.environment.'
                                                'gridded_objects_base.PyGrid'),
-                                  'filename': file_name}
+                                  'filename': grid_file}
                          }
 
     wind_json = {'obj_type': 'gnome.environment.wind.Wind',
@@ -163,6 +194,107 @@ def upload_mover(request):
     log.info('<<{}'.format(log_prefix))
     return cors_response(request, resp)
 
+
+def normalize_lon(request, file_list, is_py_mover):
+    '''
+        The FVCOM OFS models have longitudes in the range 0-360, which we
+        need in the range -180-180.
+
+        We look up whether a file needs it in its probed metadata, so a
+        file that doesn't is not opened again.  For the py movers, which
+        can take their grid from a separate file, we write the grid, with
+        its longitudes normalized, to a small sidecar file, and leave the
+        data file alone.  The (possibly very large, possibly shared) data
+        file is never rewritten.  Other movers read the file themselves,
+        so we still have to shift it in place, but only if it needs it.
+
+        None of this can wait until after the response.  The mover is
+        created in this request, and that is when pygnome reads the grid
+        of a py mover, and a C mover reads the grid of its file.  So the
+        longitudes have to be normalized by then.
+
+        :returns: The path of the sidecar grid file, or None if we didn't
+                  write one.
+    '''
+    grid_file = None
+
+    for f in file_list:
+        if not lon_needs_shift(get_netcdf_metadata(request, f)):
+            continue
+
+        if not is_py_mover:
+            shift_lon_time(f)
+        elif grid_file is None:
+            with Dataset(f, 'r') as nc:
+                grid_file = write_normalized_grid_file(nc, f)
+
+    return grid_file
+
+
+def write_normalized_grid_file(nc, filename):
+    '''
+        Write the grid of a NetCDF file, which is all its time-independent
+        variables, to a sidecar file, with its longitudes normalized to
+        the range -180-180.
+
+        :returns: The path of the sidecar file
+    '''
+    grid_dir = os.path.dirname(filename)
+    root, ext = os.path.splitext(os.path.basename(filename))
+
+    _name, unique_name = gen_unique_filename(f'{root}_grid{ext or ".nc"}',
+                                             grid_dir or '.')
+    grid_path = os.path.join(grid_dir, unique_name)
+
+    log.info(f'Writing normalized grid file {grid_path}')
+
+    time_dims = set([d for d, dim in nc.dimensions.items()
+                     if dim.isunlimited() or d == 'time'])
+
+    with Dataset(grid_path, 'w') as grid_nc:
+        grid_nc.setncatts(nc.__dict__)
+
+        for d, dim in nc.dimensions.items():
+            grid_nc.createDimension(d, None if dim.isunlimited() else len(dim))
+
+        for name, var in nc.variables.items():
+            if time_dims.intersection(var.dimensions):
+                continue
+
+            attrs = var.__dict__.copy()
+            fill_value = attrs.pop('_FillValue', None)
+
+            grid_var = grid_nc.createVariable(name, var.datatype,
+                                              var.dimensions,
+                                              fill_value=fill_value)
+            grid_var.setncatts(attrs)
+
+            values = var[...]
+
+            if name in lon_varnames:
+                values = np.ma.where(values > 180, values - 360, values)
+
+            grid_var[...] = values
+
+    return grid_path
+
+
+def has_fvcom_lon_over_180(filename):
+    '''
+        Does a file have FVCOM longitudes over 180?  Only the longitudes
+        are read, so this is cheap next to copying or rewriting the file.
+    '''
+    try:
+        with Dataset(filename, 'r') as nc:
+            if not all([n in nc.variables for n in lon_varnames]):
+                return False
+
+            return any([np.ma.max(nc.variables[n][:]) > 180
+                        for n in lon_varnames])
+    except OSError:
+        return False
+
+
 def shift_lon_time(filename, tshift=0):
     '''
     tshift is now set to zero and not applied. The rest of this will be eliminated
@@ -171,7 +303,13 @@ def shift_lon_time(filename, tshift=0):
     hack is specific to the FVCOM OFSs:
        All the FVCOM OFS models are 0-360 and it's an issue.
     '''
+    if tshift == 0 and not has_fvcom_lon_over_180(filename):
+        return
+
     try:
+        # the file may be shared with other sessions, through our upload
+        # store, so we need our own copy before we change it.
+        unshare_file(filename)
         nc = Dataset(filename, 'r+')
     except OSError as err:
         if tshift != 0:
@@ -231,12 +369,14 @@ def shift_time(nc, tshift):
         log.error('Error shifting time: {}'.format(e))
 
 
-def get_current_info(request):
+def get_current_info(request, binary=False):
     '''
         Outputs GNOME current information for a particular current mover
         in a geojson format.
         The output is a collection of Features.
         The Features contain a MultiPolygon
+
+        If binary is True, we output the cells as a float32 array instead.
     '''
     log_prefix = 'req({0}): get_current_info():'.format(id(request))
     log.info('>>' + log_prefix)
@@ -251,8 +391,12 @@ def get_current_info(request):
         if (mover is not None and
                 isinstance(mover, (CurrentMoversBase, PyMover))):
             cells = get_cells(mover)
+            cells = cells.reshape(-1, cells.shape[-1]*cells.shape[-2])
+
+            if binary:
+                return np.ascontiguousarray(cells, dtype=np.float32)
 
-            return cells.reshape(-1, cells.shape[-1]*cells.shape[-2]).tolist()
+            return cells.tolist()
         else:
             exc = cors_exception(request, HTTPNotFound)
             raise exc
@@ -264,9 +408,12 @@ def get_current_info(request):
     log.info('<<' + log_prefix)
 
 
-def get_grid_centers(request):
+def get_grid_centers(request, binary=False):
     '''
         Outputs GNOME grid centers for a particular mover
+
+        If binary is True, we output the centers as an (N, 2) float32 array
+        instead.
     '''
     log_prefix = 'req({0}): get_grid_centers():'.format(id(request))
     log.info('>>' + log_prefix)
@@ -282,6 +429,10 @@ def get_grid_centers(request):
                 isinstance(mover, (CurrentMoversBase))):
             centers = get_center_points(mover)
 
+            if binary:
+                return np.ascontiguousarray(float_columns(centers),
+                                            dtype=np.float32)
+
             return centers.tolist()
         else:
             exc = cors_exception(request, HTTPNotFound)
@@ -309,44 +460,123 @@ def get_vector_data(request):
             log.info('{} found mover of type: {}'
                      .format(log_prefix, obj.__class__))
             vec_data = get_velocities(obj)
+            codec = get_codec(request)
+
+            # The velocities are in memory owned by the mover, so we
+            # compress them before we release the session lock.
+            return cors_array_response(request,
+                                       compress_arrays(codec, [vec_data]),
+                                       codec,
+                                       {'shape': vec_data.shape})
+        else:
+            exc = cors_exception(request, HTTPNotFound)
+            raise exc
+    finally:
+        session_lock.release()
+        log.info('  {} session lock released (sess:{}, thr_id: {})'
+                 .format(log_prefix, id(session_lock), current_thread().ident))
+
+    log.info('<<' + log_prefix)
 
-            resp = Response(
-                content_type='arraybuffer',
-                content_encoding='deflate'
-            )
 
-            resp.body, dshape = (zlib.compress(vec_data.tobytes()),
-                                 vec_data.shape)
+def get_vector_slices(request, time_range):
+    '''
+        Streams the mover's vector data for a range of times, one time
+        slice at a time.  Our C movers only have a single time slice,
+        the current one.
+    '''
+    log_prefix = 'req({0}): get_vector_slices():'.format(id(request))
+    log.info('>>' + log_prefix)
+
+    session_lock = acquire_session_lock(request)
+    log.info('  {} session lock acquired (sess:{}, thr_id: {})'
+             .format(log_prefix, id(session_lock), current_thread().ident))
+    try:
+        obj_id = request.matchdict.get('obj_id')[0]
+        mover = get_session_object(obj_id, request)
+
+        if isinstance(mover, PyMover):
+            env_obj = getattr(mover, 'current', getattr(mover, 'wind', None))
 
-            resp.headers.add('Access-Control-Expose-Headers', 'shape')
-            resp.headers.add('shape', str(dshape))
+            if env_obj is None:
+                raise cors_exception(request, HTTPNotFound)
 
-            return resp
+            # The time slices are read as they are streamed, taking the
+            # session lock again for each read.
+            try:
+                data = cached_vector_field(
+                    request.registry.settings['grid_cache'], env_obj
+                ).data
+            except ValueError as e:
+                raise cors_exception(request, HTTPBadRequest) from e
+        elif isinstance(mover, CurrentMoversBase):
+            data = get_velocities(mover).copy()[np.newaxis]
         else:
-            exc = cors_exception(request, HTTPNotFound)
-            raise exc
+            raise cors_exception(request, HTTPNotFound)
     finally:
         session_lock.release()
         log.info('  {} session lock released (sess:{}, thr_id: {})'
                  .format(log_prefix, id(session_lock), current_thread().ident))
 
     log.info('<<' + log_prefix)
+    return time_sliced_response(request, data, time_range, session_lock)
 
 
-def get_grid_signature(mover):
+def get_vector_tile(request):
     '''
-        Here we are trying to get an n-dimensional signature of our
-        grid data.
-        There may be a better way to do this, but for now we will get the
-        euclidian distances between all sequential points and sum them.
+        Outputs the mover's vector data within a map tile for a single
+        time slice, in binary format
     '''
-    points = mover.get_points()
+    log_prefix = 'req({0}): get_vector_tile():'.format(id(request))
+    log.info('>>' + log_prefix)
+
+    time_index, z, x, y = get_tile_request(request)
+    codec = get_codec(request)
+
+    session_lock = acquire_session_lock(request)
+    log.info('  {} session lock acquired (sess:{}, thr_id: {})'
+             .format(log_prefix, id(session_lock), current_thread().ident))
+    try:
+        obj_id = request.matchdict.get('obj_id')[0]
+        mover = get_session_object(obj_id, request)
 
-    dtype = points[0].dtype.descr
-    raw_points = points.view(dtype='<f8').reshape(-1, len(dtype))
-    point_diffs = raw_points[1:] - raw_points[:-1]
+        if mover is None:
+            raise cors_exception(request, HTTPNotFound)
 
-    return abs(point_diffs.view(dtype=np.complex)).sum()
+        try:
+            if isinstance(mover, PyMover):
+                env_obj = getattr(mover, 'current',
+                                  getattr(mover, 'wind', None))
+
+                if env_obj is None:
+                    raise cors_exception(request, HTTPNotFound)
+
+                body, dshape = cached_tile(
+                    request.registry.settings['grid_cache'],
+                    env_obj, codec, time_index, z, x, y
+                )
+            elif isinstance(mover, CurrentMoversBase):
+                # The velocities of our C movers can change with the model
+                # time, so they are not cached.  There is a single time
+                # slice, the current one.
+                velocities = float_columns(get_velocities(mover))
+                field = VectorField(lon_lat_points(get_center_points(mover)),
+                                    velocities[np.newaxis], 1)
+
+                body, dshape = field.compressed_tile(codec, time_index,
+                                                     z, x, y)
+            else:
+                raise cors_exception(request, HTTPNotFound)
+        except ValueError as e:
+            raise cors_exception(request, HTTPBadRequest) from e
+
+        return cors_array_response(request, body, codec, {'shape': dshape})
+    finally:
+        session_lock.release()
+        log.info('  {} session lock released (sess:{}, thr_id: {})'
+                 .format(log_prefix, id(session_lock), current_thread().ident))
+
+    log.info('<<' + log_prefix)
 
 
 def get_cells(mover):
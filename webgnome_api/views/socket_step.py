@@ -4,7 +4,6 @@ import logging
 import ujson
 import tempfile
 import os
-import zipfile
 import shutil
 import pdb
 
@@ -19,7 +18,9 @@ from pyramid.httpexceptions import (HTTPPreconditionFailed,
 from cornice import Service
 from greenlet import GreenletExit
 
+from webgnome_api.common.archive import write_archive, archive_settings
 from webgnome_api.common.common_object import (CreateObject,
+                                               ObjectContentHash,
                                                get_session_dir)
 
 from webgnome_api.common.session_management import (get_active_model,
@@ -89,6 +90,42 @@ def run_export_model(request):
     payload = ujson.loads(request.body)
     outpjson = payload['outputters']
     model_filename = payload['model_name']
+
+    sid = ns.get_sockid_from_sessid(request.session.session_id)
+
+    export_cache = request.registry.settings.get('export_cache')
+    cache_key = None
+
+    if active_model and export_cache is not None:
+        # keyed by the contents of the model's data files, not their
+        # session paths, so other sessions can share the export.
+        model_hash = ObjectContentHash(active_model, by_file_content=True)
+        cache_key = export_cache.make_key('ws_export',
+                                          model_hash,
+                                          outpjson,
+                                          model_filename)
+        cached_path = export_cache.get(cache_key)
+
+        # A session that is already running its model gets its finish
+        # event from that run.  Another one, from our cache, would
+        # conflict with it, so we only serve an idle session.
+        if (cached_path is not None and sid is not None and
+                not ns.active_greenlets.get(sid)):
+            end_basename = os.path.basename(cached_path)
+            end_filepath = os.path.join(session_path, end_basename)
+
+            if os.path.exists(end_filepath):
+                os.remove(end_filepath)
+
+            if export_cache.fetch(cache_key, end_filepath):
+                log.info(f'  {log_prefix} using cached export {cache_key}')
+                register_exportable_file(request, end_basename,
+                                         end_filepath)
+
+                ns.emit('export_finished', end_basename, room=sid)
+
+                return {'cached': True, 'filename': end_basename}
+
     td = tempfile.mkdtemp(suffix='gnome.')
 
     for itm in list(outpjson.values()):
@@ -103,7 +140,46 @@ def run_export_model(request):
         active_model.outputters += o
         log.info(f'attaching export outputter: {o.filename}')
 
-    sid = ns.get_sockid_from_sessid(request.session.session_id)
+    def collect_export_files():
+        '''
+            Move the export's output file into our session folder, or zip
+            them up if there is more than one, and register the result.
+        '''
+        obj_fns = []
+
+        for m in temporary_outputters:
+            obj_fn = m.filename
+
+            if not os.path.exists(obj_fn):
+                # special case for shapefile outputter
+                # which strips extensions...
+                obj_fn = obj_fn + '.zip'
+
+            obj_fns.append(obj_fn)
+
+        if len(obj_fns) > 1:
+            # need to zip up outputs
+            end_basename = model_filename + '_output.zip'
+            end_filepath = os.path.join(session_path, end_basename)
+
+            if os.path.exists(end_filepath):
+                # it may be linked to our export cache, which we mustn't
+                # write to.
+                os.remove(end_filepath)
+
+            write_archive(end_filepath,
+                          [(f, os.path.basename(f)) for f in obj_fns],
+                          **archive_settings(request.registry.settings))
+        else:
+            # only one output file, because one outputter selected
+            end_basename = os.path.basename(obj_fns[0])
+            end_filepath = os.path.join(session_path, end_basename)
+
+            shutil.move(obj_fns[0], end_filepath)
+
+        register_exportable_file(request, end_basename, end_filepath)
+
+        return end_basename, end_filepath
 
     def get_export_cleanup():
         def cleanup(grn):
@@ -125,76 +201,15 @@ def run_export_model(request):
                     ns.emit('export_failed', room=sid)
                 elif (grn.exception):
                     # same as the else for now, allow files to be output for any exception
-                    if len(temporary_outputters) > 1:
-                        # need to zip up outputs
-                        end_basename = model_filename + '_output.zip'
-                        end_filepath = os.path.join(session_path, end_basename)
-                        zipfile_ = zipfile.ZipFile(
-                            end_filepath, 'w',
-                            compression=zipfile.ZIP_DEFLATED
-                        )
-
-                        for m in temporary_outputters:
-                            obj_fn = m.filename
-
-                            if not os.path.exists(obj_fn):
-                                # special case for shapefile outputter
-                                # which strips extensions...
-                                obj_fn = obj_fn + '.zip'
-
-                            zipfile_.write(obj_fn, os.path.basename(obj_fn))
-                    else:
-                        # only one output file, because one outputter selected
-                        obj_fn = temporary_outputters[0].filename
-
-                        if not os.path.exists(obj_fn):
-                            # special case for shapefile outputter
-                            obj_fn = obj_fn + '.zip'
-
-                        end_basename = os.path.basename(obj_fn)
-                        end_filepath = os.path.join(session_path, end_basename)
-
-                        shutil.move(obj_fn, end_filepath)
-
-                    register_exportable_file(request, end_basename,
-                                             end_filepath)
+                    end_basename, end_filepath = collect_export_files()
 
                     ns.emit('export_finished_incomplete', end_basename, room=sid)
                     #ns.emit('export_failed', room=sid)
                 else:
-                    if len(temporary_outputters) > 1:
-                        # need to zip up outputs
-                        end_basename = model_filename + '_output.zip'
-                        end_filepath = os.path.join(session_path, end_basename)
-                        zipfile_ = zipfile.ZipFile(
-                            end_filepath, 'w',
-                            compression=zipfile.ZIP_DEFLATED
-                        )
-
-                        for m in temporary_outputters:
-                            obj_fn = m.filename
-
-                            if not os.path.exists(obj_fn):
-                                # special case for shapefile outputter
-                                # which strips extensions...
-                                obj_fn = obj_fn + '.zip'
-
-                            zipfile_.write(obj_fn, os.path.basename(obj_fn))
-                    else:
-                        # only one output file, because one outputter selected
-                        obj_fn = temporary_outputters[0].filename
-
-                        if not os.path.exists(obj_fn):
-                            # special case for shapefile outputter
-                            obj_fn = obj_fn + '.zip'
-
-                        end_basename = os.path.basename(obj_fn)
-                        end_filepath = os.path.join(session_path, end_basename)
-
-                        shutil.move(obj_fn, end_filepath)
+                    end_basename, end_filepath = collect_export_files()
 
-                    register_exportable_file(request, end_basename,
-                                             end_filepath)
+                    if cache_key is not None:
+                        export_cache.put(cache_key, end_filepath)
 
                     ns.emit('export_finished', end_basename, room=sid)
             except Exception:
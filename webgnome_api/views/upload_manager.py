@@ -3,6 +3,7 @@ Views for the model load/save operations.
 """
 import os
 import errno
+import hashlib
 import logging
 import urllib.parse
 import ujson
@@ -19,14 +20,13 @@ from pyramid.httpexceptions import (HTTPNotFound,
 from cornice import Service
 
 from webgnome_api.common.helpers import PyObjFromJson
-from webgnome_api.common.system_resources import (list_files,
-                                                  file_info,
+from webgnome_api.common.system_resources import (file_info,
                                                   mkdir,
                                                   rename_or_move,
                                                   remove_file_or_dir,
                                                   get_free_space,
                                                   get_size_of_open_file,
-                                                  write_to_file)
+                                                  transfer_file)
 from webgnome_api.common.common_object import (get_session_dir,
                                                get_persistent_dir)
 from webgnome_api.common.views import (can_persist,
@@ -35,7 +35,11 @@ from webgnome_api.common.views import (can_persist,
                                        cors_policy,
                                        cors_response,
                                        cors_file_response,
-                                       switch_to_existing_session)
+                                       switch_to_existing_session,
+                                       store_upload,
+                                       get_transfer_stats,
+                                       list_folder,
+                                       invalidate_folder_index)
 from webgnome_api.common.session_management import (search_registered_file)
 
 log = logging.getLogger(__name__)
@@ -120,7 +124,8 @@ def get_file(request):
 @can_persist
 def get_uploaded_files(request):
     '''
-        Returns a listing of the persistently uploaded files.
+        Returns a listing of the persistently uploaded files.  See
+        list_folder() for the sorting, filtering and paging parameters.
     '''
     sub_folders = [urllib.parse.unquote(d)
                    for d in request.matchdict['sub_folders']
@@ -129,7 +134,7 @@ def get_uploaded_files(request):
     requested_path = os.path.join(get_persistent_dir(request), *sub_folders)
 
     try:
-        return list_files(requested_path)
+        return list_folder(request, requested_path)
     except OSError as e:
         if e.errno == errno.ENOTDIR:
             # the path was found, but it is not a directory.  Try to return
@@ -228,7 +233,10 @@ def process_upload(request):
             'Not enough space to save the file'
         ))
 
-    write_to_file(input_file, file_path)
+    hasher = hashlib.sha256()
+    transfer_file(input_file, file_path, hasher=hasher,
+                  stats=get_transfer_stats(request))
+    store_upload(request, file_path, hasher.hexdigest())
 
     log.info(f'Successfully uploaded file "{file_path}"')
 
@@ -244,7 +252,11 @@ def process_upload(request):
 
         persistent_path = os.path.join(upload_dir, file_name)
 
-        write_to_file(input_file, persistent_path)
+        # uploaded files are never modified in place, so the persistent
+        # file can share the session file.
+        transfer_file(file_path, persistent_path, link=True,
+                      stats=get_transfer_stats(request))
+        invalidate_folder_index(request, persistent_path)
 
     return file_path, file_name
 
@@ -310,6 +322,7 @@ def delete_uploaded_file(request):
 
     try:
         remove_file_or_dir(requested_path)
+        invalidate_folder_index(request, requested_path)
     except OSError:
         raise cors_exception(request, HTTPInternalServerError)
 
@@ -325,6 +338,7 @@ def create_new_folder(request, base_path, sub_folders, file_model):
 
     try:
         mkdir(requested_path, file_model.name)
+        invalidate_folder_index(request, requested_path)
     except OSError:
         raise cors_exception(request, HTTPInternalServerError)
 
@@ -349,6 +363,7 @@ def rename_file(request, base_path, sub_folders, file_model):
         log.info(f'renaming file from {old_path} to {new_path}')
 
         rename_or_move(old_path, new_path)
+        invalidate_folder_index(request, old_path, new_path)
     except Exception as e:
         log.info(f'Exception: {e}')
         raise cors_exception(request, HTTPInternalServerError)